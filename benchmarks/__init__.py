@@ -0,0 +1 @@
+"""Offline benchmarks of ImagineS, run against a local stand-in for the search engine and image hosts"""
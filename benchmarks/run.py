@@ -0,0 +1,306 @@
+"""Runs the offline benchmarks and prints their results as JSON.
+
+    python -m benchmarks.run --images 200 --latency 0.02 --output results.json
+
+Every benchmark runs in a fresh process against a local BenchmarkServer, so
+that its peak RSS is its own.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from imagines import DatasetAugmentation, HttpSearchBackend
+
+from .server import EXTENSIONS, BenchmarkServer, synthetic_image
+
+BENCHMARKS = ('persist_images', 'augment_dataset', 'resize_images', 'load_label_images')
+
+
+class Recorder:
+    """Collects the latency and size of every image a benchmark handles"""
+
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.bytes = 0
+        self.start_time: Optional[float] = None
+        # Images the benchmark failed on, when it knows better than the images it did not return
+        self.failures: Optional[int] = None
+
+    def start(self) -> None:
+        """Starts the clock, once the benchmark is set up"""
+        self.start_time = time.perf_counter()
+
+    def add(self, latency: float, size: int = 0) -> None:
+        self.latencies.append(latency)
+        self.bytes += size
+
+    def timed(self, function: Callable) -> Callable:
+        def wrapper(*args):
+            start = time.perf_counter()
+            result = function(*args)
+            self.add(time.perf_counter() - start, len(result) if isinstance(result, bytes) else 0)
+            return result
+        return wrapper
+
+
+def _parse_size(value: str) -> Tuple[int, int]:
+    width, height = value.lower().split('x')
+    return int(width), int(height)
+
+
+def _peak_rss_mb(who) -> Optional[float]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(who).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def _warm_up_worker(_) -> None:
+    # Importing this module in the worker already imports imagines
+    return None
+
+
+def _new_dataset_augmentation(context: dict) -> DatasetAugmentation:
+    search_url = context['search_url']
+    dataset_augmentation = DatasetAugmentation(
+        search_backend=lambda: HttpSearchBackend(search_url=search_url),
+        max_workers=context['max_workers'],
+        process_workers=context['process_workers'])
+    # Worker processes are started before the clock, their startup is not what is measured
+    pool = dataset_augmentation._get_process_pool()
+    if pool is not None:
+        list(pool.map(_warm_up_worker, range(dataset_augmentation.process_workers)))
+    return dataset_augmentation
+
+
+def _write_images(folder: str, context: dict) -> int:
+    """Stores the benchmark images straight to disk, for the benchmarks that start from a dataset"""
+    os.makedirs(folder, exist_ok=True)
+    total = 0
+    for index in range(context['images']):
+        image_format = context['image_formats'][index % len(context['image_formats'])]
+        content = synthetic_image(index, context['image_size'], image_format, context['seed'])
+        with open(os.path.join(folder, '{}.{}'.format(index, EXTENSIONS[image_format])), 'wb') as f:
+            f.write(content)
+        total += len(content)
+    return total
+
+
+def bench_persist_images(context: dict, work_dir: str, recorder: Recorder) -> int:
+    dataset_augmentation = _new_dataset_augmentation(context)
+    dataset_augmentation.downloader.fetch = recorder.timed(dataset_augmentation.downloader.fetch)
+    recorder.start()
+    try:
+        records = dataset_augmentation._iter_persisted_images(
+            os.path.join(work_dir, 'label'), context['image_urls'],
+            load_images=False, image_shape=context['image_shape'])
+        return sum(1 for _ in records)
+    finally:
+        dataset_augmentation.close()
+
+
+def label_queries(labels: int) -> Dict[str, List[str]]:
+    """Labels of augment_dataset, each with a single query"""
+    return {'label_{}'.format(i): ['query {}'.format(i)] for i in range(labels)}
+
+
+def query_offsets(images: int, labels: int) -> Dict[str, int]:
+    """First image served to every query of ``label_queries``, so that no two labels share an image"""
+    per_label = max(images // labels, 1)
+    return {queries[0]: i * per_label for i, queries in enumerate(label_queries(labels).values())}
+
+
+def bench_augment_dataset(context: dict, work_dir: str, recorder: Recorder) -> int:
+    dataset_augmentation = _new_dataset_augmentation(context)
+    dataset_augmentation.downloader.fetch = recorder.timed(dataset_augmentation.downloader.fetch)
+    labels = context['labels']
+    recorder.start()
+    _, _, report = dataset_augmentation.augment_dataset(
+        label_queries(labels), work_dir, max(context['images'] // labels, 1), context['image_shape'],
+        resize_images=True, sleep_between_interactions=0, return_data=False, return_report=True)
+    # Images linked from another label were not downloaded, they are neither successes nor failures
+    recorder.failures = report.counters.get('images_failed', 0)
+    return report.counters.get('images_saved', 0)
+
+
+def bench_resize_images(context: dict, work_dir: str, recorder: Recorder) -> int:
+    recorder.bytes = _write_images(os.path.join(work_dir, 'label'), context)
+    dataset_augmentation = _new_dataset_augmentation(context)
+    submit = dataset_augmentation._submit
+
+    def timed_submit(function, *args):
+        start = time.perf_counter()
+        future = submit(function, *args)
+        future.add_done_callback(lambda _: recorder.latencies.append(time.perf_counter() - start))
+        return future
+
+    dataset_augmentation._submit = timed_submit
+    recorder.start()
+    try:
+        dataset_augmentation.resize_images(work_dir, context['image_shape'])
+    finally:
+        dataset_augmentation.close()
+    return len(recorder.latencies)
+
+
+def bench_load_label_images(context: dict, work_dir: str, recorder: Recorder) -> int:
+    folder = os.path.join(work_dir, 'label')
+    recorder.bytes = _write_images(folder, context)
+    dataset_augmentation = _new_dataset_augmentation(context)
+    iter_label_images = dataset_augmentation._iter_label_images
+
+    def timed_iter_label_images(*args, **kwargs):
+        records = iter_label_images(*args, **kwargs)
+        while True:
+            start = time.perf_counter()
+            try:
+                record = next(records)
+            except StopIteration:
+                return
+            recorder.latencies.append(time.perf_counter() - start)
+            yield record
+
+    dataset_augmentation._iter_label_images = timed_iter_label_images
+    recorder.start()
+    try:
+        return len(dataset_augmentation._load_label_images(folder))
+    finally:
+        dataset_augmentation.close()
+
+
+def run_benchmark(name: str, context: dict) -> dict:
+    """Runs a single benchmark in the current process and summarizes it"""
+    benchmark = globals()['bench_' + name]
+    recorder = Recorder()
+    work_dir = tempfile.mkdtemp(prefix='imagines-bench-')
+    try:
+        recorder.start()
+        images = benchmark(context, work_dir, recorder)
+        # Benchmarks restart the clock once they are set up
+        seconds = time.perf_counter() - recorder.start_time
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    latencies = np.asarray(recorder.latencies) * 1000
+    return {
+        'benchmark': name,
+        'images': images,
+        'failures': recorder.failures if recorder.failures is not None else max(context['images'] - images, 0),
+        'seconds': round(seconds, 4),
+        'images_per_sec': round(images / seconds, 2) if seconds else None,
+        'mb_per_sec': round(recorder.bytes / (1024 * 1024) / seconds, 2) if seconds else None,
+        'latency_p50_ms': round(float(np.percentile(latencies, 50)), 2) if len(latencies) else None,
+        'latency_p99_ms': round(float(np.percentile(latencies, 99)), 2) if len(latencies) else None,
+        'peak_rss_mb': _peak_rss_mb(resource.RUSAGE_SELF) if resource else None,
+        'peak_worker_rss_mb': _peak_rss_mb(resource.RUSAGE_CHILDREN) if resource else None,
+    }
+
+
+def _run_isolated(name: str, context: dict, results: multiprocessing.Queue) -> None:
+    try:
+        results.put(run_benchmark(name, context))
+    except Exception as e:
+        results.put({'benchmark': name, 'error': repr(e)})
+
+
+def run_benchmarks(benchmarks: List[str], context: dict, isolate: bool = True) -> List[dict]:
+    results = []
+    for name in benchmarks:
+        if not isolate:
+            results.append(run_benchmark(name, context))
+            continue
+        spawn = multiprocessing.get_context('spawn')
+        queue = spawn.Queue()
+        process = spawn.Process(target=_run_isolated, args=(name, context, queue))
+        process.start()
+        results.append(queue.get())
+        process.join()
+    return results
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--benchmark', action='append', choices=BENCHMARKS,
+                        help='Benchmark to run, can be repeated (default: all of them)')
+    parser.add_argument('--images', type=int, default=200, help='Images per benchmark')
+    parser.add_argument('--image-size', type=_parse_size, default=(800, 600), help='Served images, WIDTHxHEIGHT')
+    parser.add_argument('--thumbnail-size', type=_parse_size, default=(200, 150),
+                        help='Thumbnails of the result pages, WIDTHxHEIGHT')
+    parser.add_argument('--formats', default='jpeg', help='Comma separated formats served, jpeg and/or png')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds the server waits before every image')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of images the server fails')
+    parser.add_argument('--image-shape', type=_parse_size, default=(224, 224), help='Output images, WIDTHxHEIGHT')
+    parser.add_argument('--labels', type=int, default=4, help='Labels of augment_dataset')
+    parser.add_argument('--max-workers', type=int, default=8, help='Download threads')
+    parser.add_argument('--process-workers', type=int, default=None, help='Processes decoding and resizing')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-isolate', action='store_true', help='Run every benchmark in this process')
+    parser.add_argument('--output', default='-', help='JSON file to write the results to (default: stdout)')
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> Dict:
+    args = parse_args(argv)
+    image_formats = tuple(args.formats.split(','))
+    with BenchmarkServer(image_count=args.images,
+                         image_size=args.image_size,
+                         thumbnail_size=args.thumbnail_size,
+                         image_formats=image_formats,
+                         latency=args.latency,
+                         error_rate=args.error_rate,
+                         results_per_page=args.images,
+                         seed=args.seed,
+                         query_offsets=query_offsets(args.images, args.labels)) as server:
+        context = {
+            'image_urls': server.image_urls(),
+            'search_url': server.search_url,
+            'images': args.images,
+            'image_size': args.image_size,
+            'thumbnail_size': args.thumbnail_size,
+            'image_formats': image_formats,
+            'image_shape': args.image_shape,
+            'labels': args.labels,
+            'max_workers': args.max_workers,
+            'process_workers': args.process_workers,
+            'seed': args.seed,
+        }
+        results = run_benchmarks(args.benchmark or list(BENCHMARKS), context, isolate=not args.no_isolate)
+
+    report = {
+        'config': {key: value for key, value in context.items() if key not in ('image_urls', 'search_url')},
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'results': results,
+    }
+    # Comparable output with server latency and error rate
+    report['config'].update({'latency': args.latency, 'error_rate': args.error_rate})
+    output = json.dumps(report, indent=2)
+    if args.output == '-':
+        print(output)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+import base64
+import hashlib
+import io
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+from PIL import Image
+
+CONTENT_TYPES = {
+    'jpeg': 'image/jpeg',
+    'png': 'image/png',
+}
+EXTENSIONS = {
+    'jpeg': 'jpg',
+    'png': 'png',
+}
+
+
+def synthetic_image(index: int, image_size: Tuple[int, int], image_format: str = 'jpeg', seed: int = 0) -> bytes:
+    """Encodes a smooth random picture, distinct for every ``index``, that compresses like a photo"""
+    rng = np.random.default_rng((seed, index))
+    blocks = Image.fromarray(rng.integers(0, 256, size=(8, 8, 3), dtype=np.uint8))
+    image = blocks.resize(tuple(image_size), Image.BILINEAR)
+    output = io.BytesIO()
+    image.save(output, format=image_format.upper())
+    return output.getvalue()
+
+
+class BenchmarkServer:
+    """Local stand-in for an image search engine and the hosts of its images.
+
+    ``/images/<index>.<ext>`` serves synthetic images after ``latency``
+    seconds, a deterministic ``error_rate`` share of them fail with
+    ``error_status``. ``/search`` serves result pages in the format parsed by
+    HttpSearchBackend, each query getting its own slice of the images, with
+    a ``thumbnail_size`` thumbnail of every image inlined as a ``data:`` URL.
+    Slices start at the ``query_offsets`` of their query, queries left out
+    start at an offset derived from their digest, which may overlap.
+    """
+
+    def __init__(self,
+                 image_count: int = 200,
+                 image_size: Tuple[int, int] = (800, 600),
+                 thumbnail_size: Tuple[int, int] = (200, 150),
+                 image_formats: Tuple[str, ...] = ('jpeg',),
+                 latency: float = 0.0,
+                 error_rate: float = 0.0,
+                 error_status: int = 404,
+                 results_per_page: int = 100,
+                 seed: int = 0,
+                 query_offsets: Optional[Dict[str, int]] = None):
+        for image_format in image_formats:
+            if image_format not in CONTENT_TYPES:
+                raise ValueError('Image format not supported: {}'.format(image_format))
+        self.image_count = image_count
+        self.image_size = tuple(image_size)
+        # Thumbnails are never larger than the images themselves
+        self.thumbnail_size = tuple(min(sizes) for sizes in zip(thumbnail_size, image_size))
+        self.image_formats = tuple(image_formats)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.results_per_page = results_per_page
+        self.seed = seed
+        self.query_offsets = dict(query_offsets or {})
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._images: Dict[int, bytes] = {}
+        self._thumbnails: Dict[int, str] = {}
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @property
+    def base_url(self) -> str:
+        return 'http://127.0.0.1:{}'.format(self._server.server_address[1])
+
+    @property
+    def search_url(self) -> str:
+        return self.base_url + '/search?q={q}&ijn={page}&start={start}'
+
+    def image_format(self, index: int) -> str:
+        return self.image_formats[index % len(self.image_formats)]
+
+    def image_url(self, index: int) -> str:
+        return '{}/images/{}.{}'.format(self.base_url, index, EXTENSIONS[self.image_format(index)])
+
+    def image_urls(self, count: Optional[int] = None, offset: int = 0) -> List[str]:
+        count = self.image_count if count is None else count
+        return [self.image_url((offset + i) % self.image_count) for i in range(count)]
+
+    def image(self, index: int) -> bytes:
+        with self._lock:
+            content = self._images.get(index)
+        if content is None:
+            content = synthetic_image(index, self.image_size, self.image_format(index), self.seed)
+            with self._lock:
+                self._images[index] = content
+        return content
+
+    def thumbnail_url(self, index: int) -> str:
+        with self._lock:
+            data_url = self._thumbnails.get(index)
+        if data_url is None:
+            content = synthetic_image(index, self.thumbnail_size, 'jpeg', self.seed)
+            data_url = 'data:image/jpeg;base64,' + base64.b64encode(content).decode('ascii')
+            with self._lock:
+                self._thumbnails[index] = data_url
+        return data_url
+
+    def fails(self, index: int) -> bool:
+        return random.Random(self.seed * 1000003 + index).random() < self.error_rate
+
+    def query_offset(self, query: str) -> int:
+        if query in self.query_offsets:
+            return self.query_offsets[query] % self.image_count
+        # Stable across runs, unlike hash(), and spread out even for queries differing by a single character
+        return int.from_bytes(hashlib.sha1(query.encode('utf-8')).digest()[:8], 'big') % self.image_count
+
+    def search_page(self, query: str, start: int) -> bytes:
+        if start >= self.image_count:
+            entries = []
+        else:
+            count = min(self.results_per_page, self.image_count - start)
+            offset = self.query_offset(query) + start
+            entries = [(offset + i) % self.image_count for i in range(count)]
+        width, height = self.image_size
+        thumbnail_width, thumbnail_height = self.thumbnail_size
+        results = [[1, [0, str(i), [self.thumbnail_url(index), thumbnail_height, thumbnail_width],
+                        [self.image_url(index), height, width], None, 0]]
+                   for i, index in enumerate(entries)]
+        page = ('<!doctype html><html><body><div id="islrg"></div>'
+                '<script>AF_initDataCallback({{key: \'ds:1\', data:{}}});</script>'
+                '</body></html>').format(json.dumps(results, separators=(',', ':')))
+        return page.encode('utf-8')
+
+    def start(self) -> None:
+        # Images are encoded up front, so that serving them only costs the configured latency
+        for index in range(self.image_count):
+            self.image(index)
+            self.thumbnail_url(index)
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                with server._lock:
+                    server.requests += 1
+                url = urlparse(self.path)
+                if url.path == '/search':
+                    params = parse_qs(url.query)
+                    start = int(params.get('start', ['0'])[0])
+                    self._reply(200, server.search_page(params.get('q', [''])[0], start), 'text/html')
+                    return
+                if url.path.startswith('/images/'):
+                    try:
+                        index = int(url.path.rsplit('/', 1)[1].split('.')[0])
+                    except ValueError:
+                        index = -1
+                    if 0 <= index < server.image_count:
+                        if server.latency:
+                            time.sleep(server.latency)
+                        if server.fails(index):
+                            self._reply(server.error_status, b'unavailable', 'text/plain')
+                        else:
+                            self._reply(200, server.image(index), CONTENT_TYPES[server.image_format(index)])
+                        return
+                self._reply(404, b'not found', 'text/plain')
+
+            def _reply(self, status, body, content_type):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
@@ -1,4 +1,27 @@
 from .core import (
     WebScrapper,
-    DatasetAugmentation
-)
\ No newline at end of file
+    DatasetAugmentation,
+    DatasetRecord
+)
+from .dataset import (
+    LazyImageDataset
+)
+from .metrics import (
+    Metrics,
+    MetricEvent,
+    RunReport
+)
+from .search import (
+    SearchBackend,
+    HttpSearchBackend
+)
+from .search_cache import (
+    SearchCache
+)
+from .shards import (
+    iter_shards,
+    load_array
+)
+from .work_queue import (
+    WorkQueue
+)
@@ -1,55 +1,193 @@
 import hashlib
-import io
 import json
+import multiprocessing
 import shutil
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.common.by import By
-from webdriver_manager.chrome import ChromeDriverManager
-from webdriver_manager.core.utils import ChromeType
-from typing import Dict, List, Optional, Tuple, Union
+from collections import Counter, deque
+from itertools import chain
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, as_completed, wait
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Sized, Tuple, Union
 from PIL import Image
-import requests
-import time
+import numpy as np
 import os
 
 import logging
 
 from tqdm import tqdm
 
+from .download import ConcurrentDownloader
+from .dataset import LazyImageDataset, load_image
+from .drivers import DRIVER_TYPES, cached_driver_path, resolve_driver_path
+from .fetch import RejectedResponse, fetch_image
+from .http_client import HttpClient, is_transient
+from .index import METADATA_DIRNAME, ImageIndex
+from .inline import url_key
+from .manifest import LabelManifest, QueryManifest
+from .metrics import Metrics, NullMetrics, failure_reason
+from .phash import PerceptualHashIndex
+from .pool import ScraperPool, SearchStream
+from .processing import (ProcessedImage, check_aspect_mode, check_encode_format, is_resized, process_image,
+                         resize_file, split_shapes, timed_call)
+from .search import HttpSearchBackend, SearchBackend
+from .search_cache import SearchCache
+from .shards import ArrayWriter, ShardWriter
+from .tensors import TensorCache, folder_fingerprint
+from .work_queue import WorkQueue
+
 # Set up logging
 log_level = os.getenv("LOGGER_LEVEL", logging.WARNING)
 logging.basicConfig(level=log_level)
 logger = logging.getLogger("Dataset Augmentation classes")
 
-class WebScrapper:
+# How often condition-based waits poll the page, in seconds
+POLL_FREQUENCY = 0.05
+THUMBNAIL_COUNT_SCRIPT = "return document.querySelectorAll('img.Q4LuWd').length;"
+FULL_IMAGE_SOURCES_SCRIPT = """
+return Array.from(document.querySelectorAll('img.n3VNCb'), img => img.src)
+    .filter(src => src && src.startsWith('http'));
+"""
+# Source and natural size of every thumbnail, [src, width, height], 0 x 0 while it is not loaded
+THUMBNAIL_SOURCES_SCRIPT = """
+return Array.from(document.querySelectorAll('img.Q4LuWd'),
+    img => [img.currentSrc || img.src || '', img.naturalWidth, img.naturalHeight]);
+"""
+SHOW_MORE_RESULTS_SCRIPT = """
+const button = document.querySelector('input.mye4qd');
+if (button && button.offsetParent !== null) { button.click(); }
+"""
+
+
+def _thumbnail_covers(thumbnail: list, min_size: Tuple[int, int]) -> bool:
+    source, width, height = thumbnail
+    return (source.startswith(('data:image/', 'http'))
+            and width >= min_size[0] and height >= min_size[1])
+
+
+class DatasetRecord(NamedTuple):
+    label: str
+    path: str
+    image: Optional[Image.Image]
+
+
+def resolution_roots(output_directory: str,
+                     resolutions_directory: Optional[str],
+                     image_shapes: Sequence[Tuple[int, int]]) -> List[str]:
+    """Roots of the parallel label trees of every extra shape, ``<resolutions_directory>/<width>x<height>``"""
+    if resolutions_directory is None:
+        resolutions_directory = os.path.join(output_directory, METADATA_DIRNAME, 'resolutions')
+    return [os.path.join(resolutions_directory, '{}x{}'.format(*image_shape)) for image_shape in image_shapes]
+
+
+def _link_or_copy(source: str, destination: str) -> None:
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+
+class WebScrapper(SearchBackend):
 
     def __init__(self, driver_type: str = 'chrome'):
-        if driver_type == 'chrome':
-            chrome_type=ChromeType.GOOGLE
-        elif driver_type == 'chromium':
-            chrome_type=ChromeType.CHROMIUM
-        elif driver_type == 'brave':
-            chrome_type=ChromeType.BRAVE
-        else:
+        if driver_type not in DRIVER_TYPES:
             raise ValueError('Driver type not supported')
+        # Selenium is only needed once a browser is actually started
+        from selenium import webdriver
+        from selenium.webdriver.chrome.service import Service
+
         op = webdriver.ChromeOptions()
         op.add_argument('headless')
-        ser = Service(ChromeDriverManager(chrome_type=chrome_type).install())
-        self.driver = webdriver.Chrome(
-            service=ser,
-            options=op
-        )
-           
-
-    def __scroll_to_end(self, sleep_between_interactions: float = 1) -> None:
+        cached = cached_driver_path(driver_type) is not None
+        try:
+            ser = Service(resolve_driver_path(driver_type))
+            self.driver = webdriver.Chrome(
+                service=ser,
+                options=op
+            )
+        except Exception as e:
+            if not cached:
+                raise
+            # The browser may have been updated since the driver was cached
+            logger.info(f"Cached driver failed to start, resolving it again - {e}")
+            ser = Service(resolve_driver_path(driver_type, refresh=True))
+            self.driver = webdriver.Chrome(
+                service=ser,
+                options=op
+            )
+
+
+    def _wait_for(self, condition: Callable[[], bool], timeout: float) -> bool:
+        """Polls ``condition`` until it holds or ``timeout`` seconds went by, returns whether it held"""
+        from selenium.common.exceptions import TimeoutException
+        from selenium.webdriver.support.ui import WebDriverWait
+
+        try:
+            WebDriverWait(self.driver, timeout, poll_frequency=POLL_FREQUENCY).until(lambda driver: condition())
+            return True
+        except TimeoutException:
+            return False
+
+    def _thumbnail_count(self) -> int:
+        return self.driver.execute_script(THUMBNAIL_COUNT_SCRIPT)
+
+    def _full_image_sources(self) -> List[str]:
+        return self.driver.execute_script(FULL_IMAGE_SOURCES_SCRIPT) or []
+
+    def _wait_for_new_sources(self, known_sources: set, timeout: float) -> set:
+        """Waits until the preview pane swaps in a full-size image not in ``known_sources``"""
+        sources = known_sources
+
+        def changed() -> bool:
+            nonlocal sources
+            # All the sources in a single script call rather than a round-trip per element
+            sources = set(self._full_image_sources())
+            return not sources <= known_sources
+
+        self._wait_for(changed, timeout)
+        return sources
+
+    def __scroll_to_end(self, sleep_between_interactions: float = 1) -> bool:
+        previous_count = self._thumbnail_count()
         self.driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-        time.sleep(sleep_between_interactions)
+        # Returns as soon as the next batch of thumbnails shows up, the sleep is only an upper bound
+        return self._wait_for(lambda: self._thumbnail_count() > previous_count, sleep_between_interactions)
 
-    def search_images(self,
+    def _thumbnail_sources(self) -> List[list]:
+        return self.driver.execute_script(THUMBNAIL_SOURCES_SCRIPT) or []
+
+    def iter_images(self,
+                    query: str,
+                    max_links_to_fetch: int,
+                    sleep_between_interactions: float = 1,
+                    max_stale_rounds: int = 3) -> Iterator[str]:
+        """Yields up to ``max_links_to_fetch`` full-size image URLs for ``query`` as they are found.
+
+        Every wait is bounded by ``sleep_between_interactions`` but ends as soon
+        as the page reacts. The search stops once ``max_stale_rounds`` scrolls in
+        a row neither load new thumbnails nor yield new URLs.
+        """
+        return self._iter_results(query, max_links_to_fetch, sleep_between_interactions, max_stale_rounds)
+
+    def iter_thumbnails(self,
+                        query: str,
+                        max_links_to_fetch: int,
+                        min_size: Tuple[int, int],
+                        sleep_between_interactions: float = 1,
+                        max_stale_rounds: int = 3) -> Iterator[str]:
+        """Like ``iter_images``, but results whose loaded thumbnail is at least ``min_size`` are not clicked.
+
+        The sources and natural sizes of all the thumbnails are read in one
+        script call per scroll, and their source (often an inline ``data:``
+        URL) is yielded instead of the full-size image. Only smaller
+        thumbnails are clicked.
+        """
+        return self._iter_results(query, max_links_to_fetch, sleep_between_interactions, max_stale_rounds, min_size)
+
+    def _iter_results(self,
                       query: str,
                       max_links_to_fetch: int,
-                      sleep_between_interactions: float = 1) -> set:
+                      sleep_between_interactions: float,
+                      max_stale_rounds: int,
+                      min_size: Optional[Tuple[int, int]] = None) -> Iterator[str]:
+        from selenium.webdriver.common.by import By
 
         # build the google query
         search_url = "https://www.google.com/search?safe=off&site=&tbm=isch&source=hp&q={q}&oq={q}&gs_l=img"
@@ -57,160 +195,1030 @@ class WebScrapper:
         self.driver.get(search_url.format(q=query))
 
         image_urls = set()
-        image_count = 0
         results_start = 0
-        patience = 100
-        while image_count < max_links_to_fetch:
-            self.__scroll_to_end(sleep_between_interactions)
+        stale_rounds = 0
+        while len(image_urls) < max_links_to_fetch:
+            if not self.__scroll_to_end(sleep_between_interactions):
+                # End of the loaded results, ask for more if the page offers it
+                self.driver.execute_script(SHOW_MORE_RESULTS_SCRIPT)
 
             # get all image thumbnail results
             thumbnail_results = self.driver.find_elements(By.CSS_SELECTOR, "img.Q4LuWd")
             number_results = len(thumbnail_results)
+            thumbnails = self._thumbnail_sources() if min_size is not None else []
 
-            # print(f"Found: {number_results} search results. Extracting links from {results_start}:{number_results}")
-            previous_image_count = image_count
-            for img in thumbnail_results[results_start:number_results]:
-                # try to click every thumbnail such that we can get the real image behind it
-                try:
-                    img.click()
-                    time.sleep(sleep_between_interactions)
-                except Exception:
-                    continue
+            previous_image_count = len(image_urls)
+            sources = set(self._full_image_sources())
+            for position in range(results_start, number_results):
+                if position < len(thumbnails) and _thumbnail_covers(thumbnails[position], min_size):
+                    found = {thumbnails[position][0]}
+                else:
+                    # try to click every thumbnail such that we can get the real image behind it
+                    try:
+                        thumbnail_results[position].click()
+                    except Exception:
+                        continue
 
-                # extract image urls    
-                actual_images = self.driver.find_elements(By.CSS_SELECTOR, 'img.n3VNCb')
-                for actual_image in actual_images:
-                    if actual_image.get_attribute('src') and 'http' in actual_image.get_attribute('src'):
-                        image_urls.add(actual_image.get_attribute('src'))
-
-                image_count = len(image_urls)
+                    sources = self._wait_for_new_sources(sources, sleep_between_interactions)
+                    found = sources
+                for source in found:
+                    # Inline thumbnails are remembered by digest, they can be large
+                    key = url_key(source)
+                    if key in image_urls:
+                        continue
+                    image_urls.add(key)
+                    yield source
+                    if len(image_urls) >= max_links_to_fetch:
+                        break
 
                 if len(image_urls) >= max_links_to_fetch:
-                    logger.info(f"Found: {len(image_urls)} image links, done!")
                     break
 
-                # move the result startpoint further down
-                results_start = len(thumbnail_results)
-
-            if previous_image_count == image_count:
-                patience -= 1
-                if patience == 0:
-                    logger.info(f"Found: {len(image_urls)} image links, done!")
+            if number_results == results_start and len(image_urls) == previous_image_count:
+                stale_rounds += 1
+                if stale_rounds >= max_stale_rounds:
                     break
             else:
-                patience = 100
+                stale_rounds = 0
+            # move the result startpoint further down
+            results_start = number_results
 
-        return image_urls
+        logger.info(f"Found: {len(image_urls)} image links, done!")
+
+    def search_images(self,
+                      query: str,
+                      max_links_to_fetch: int,
+                      sleep_between_interactions: float = 1,
+                      max_stale_rounds: int = 3) -> set:
+        return set(self.iter_images(query, max_links_to_fetch, sleep_between_interactions, max_stale_rounds))
 
     def close_session(self):
         self.driver.quit()
 
 class DatasetAugmentation:
 
-    def __init__(self, driver_type: str = 'chrome'):
-        self.driver = WebScrapper(driver_type)
+    def __init__(self,
+                 driver_type: str = 'chrome',
+                 max_workers: int = 8,
+                 max_connections_per_host: int = 4,
+                 max_inflight_bytes: int = 64 * 1024 * 1024,
+                 http_client: Optional[HttpClient] = None,
+                 use_index: bool = True,
+                 near_duplicate_threshold: Optional[int] = None,
+                 near_duplicate_scope: str = 'label',
+                 process_workers: Optional[int] = 0,
+                 search_workers: int = 1,
+                 search_timeout: Optional[float] = None,
+                 url_queue_size: Optional[int] = None,
+                 search_backend: Optional[Callable[[], SearchBackend]] = None,
+                 metrics: Optional[Metrics] = None,
+                 offline: bool = False,
+                 max_image_bytes: int = 32 * 1024 * 1024,
+                 min_image_size: Optional[Tuple[int, int]] = None,
+                 tensor_cache: bool = False,
+                 search_cache: Optional[SearchCache] = None,
+                 search_cache_key: Optional[str] = None,
+                 keep_original_bytes: bool = False,
+                 encode_format: str = 'jpeg',
+                 encode_quality: Optional[int] = None,
+                 use_thumbnails: bool = True):
+        if near_duplicate_scope not in ('label', 'global'):
+            raise ValueError('near_duplicate_scope must be either "label" or "global"')
+        if search_backend is None and driver_type not in DRIVER_TYPES + ('http',):
+            raise ValueError('Driver type not supported')
+        check_encode_format(encode_format)
+        self.http_client = http_client or HttpClient(pool_maxsize=max_connections_per_host)
+        # Per-stage timings and failures, nothing is recorded unless a Metrics instance is given
+        self.metrics = metrics if metrics is not None else NullMetrics()
+        self.driver_type = driver_type
+        self.search_backend = search_backend
+        # Only loads what is already on disk, without ever searching or downloading
+        self.offline = offline
+        # Search sessions (browsers) are only started once searches are dispatched
+        self._driver: Optional[SearchBackend] = None
+        # URLs found by earlier searches of the same query, possibly for other labels or output directories
+        self.search_cache = search_cache
+        # Tells apart the cached results of custom backends, defaults to the cache_key attribute of the factory
+        self.search_cache_key = search_cache_key or getattr(search_backend, 'cache_key', None)
+        if search_cache is not None and search_backend is not None and not isinstance(self.search_cache_key, str):
+            raise ValueError('A custom search_backend needs a search_cache_key, naming it along with every '
+                             'parameter that changes its results, to use the search cache')
+        self.search_workers = search_workers
+        self.search_timeout = search_timeout
+        # URLs found ahead of the downloads, defaults to the number of links fetched per query
+        self.url_queue_size = url_queue_size
+        self._search_pool: Optional[ScraperPool] = None
+        self.downloader = ConcurrentDownloader(
+            fetch=self._fetch_image,
+            max_workers=max_workers,
+            max_per_host=max_connections_per_host,
+            max_inflight_bytes=max_inflight_bytes)
+        # Downloads are aborted past this size or when the image header shows fewer pixels
+        self.max_image_bytes = max_image_bytes
+        self.min_image_size = min_image_size
+        self.use_index = use_index
+        self._indexes: Dict[str, ImageIndex] = {}
+        self.near_duplicate_threshold = near_duplicate_threshold
+        self.near_duplicate_scope = near_duplicate_scope
+        self._phash_indexes: Dict[Tuple[str, Optional[str]], PerceptualHashIndex] = {}
+        # Decoding, resizing and encoding are CPU bound, 0 runs them in the calling process and None on one process
+        # per CPU. Worker processes are spawned, the script using them needs an ``if __name__ == '__main__'`` guard
+        self.process_workers = (os.cpu_count() or 1) if process_workers is None else process_workers
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+        # Cached labels loaded at a given image_shape are kept decoded, see load_label_tensor
+        self.tensor_cache = tensor_cache
+        # Downloads that need no conversion are stored as they are, the others are encoded to encode_format
+        self.keep_original_bytes = keep_original_bytes
+        self.encode_format = encode_format
+        self.encode_quality = encode_quality
+        # Searches for images resized afterwards take the thumbnails of the results page when they are large enough
+        self.use_thumbnails = use_thumbnails
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self) -> None:
+        """Shuts down every browser session and worker pool, even if some of them fail to close"""
+        try:
+            if self._search_pool is not None:
+                self._search_pool.close()
+                self._search_pool = None
+        finally:
+            try:
+                if self._driver is not None:
+                    self._driver.close_session()
+            except Exception as e:
+                logger.warning(f"ERROR - Could not close the search session - {e}")
+            finally:
+                self._driver = None
+                self._shutdown_process_pool()
+                for index in self._indexes.values():
+                    index.close()
+                self._indexes = {}
+
+    @property
+    def driver(self) -> SearchBackend:
+        """Search session of this instance, started on first use"""
+        if self._driver is None:
+            self._driver = self._new_search_backend()
+        return self._driver
+
+    def _new_search_backend(self) -> SearchBackend:
+        if self.offline:
+            raise RuntimeError('Searches are disabled in offline mode')
+        if self.search_backend is not None:
+            return self.search_backend()
+        if self.driver_type == 'http':
+            return HttpSearchBackend(http_client=self.http_client)
+        return WebScrapper(self.driver_type)
+
+    def _get_search_pool(self) -> ScraperPool:
+        if self._search_pool is None:
+            self._search_pool = ScraperPool(factory=self._new_search_backend,
+                                            size=self.search_workers,
+                                            sessions=[self.driver],
+                                            search_timeout=self.search_timeout,
+                                            on_discard=self._forget_driver)
+        return self._search_pool
+
+    def _forget_driver(self, session: SearchBackend) -> None:
+        # The pool closed the session after a failure, the next use of driver starts a new one
+        if self._driver is session:
+            self._driver = None
+
+    def _get_process_pool(self) -> Optional[ProcessPoolExecutor]:
+        if self.process_workers == 0:
+            return None
+        if self._process_pool is None:
+            # Spawned rather than forked: the parent runs download threads and holds SQLite connections
+            self._process_pool = ProcessPoolExecutor(max_workers=self.process_workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+        return self._process_pool
+
+    def _shutdown_process_pool(self) -> None:
+        if self._process_pool is not None:
+            self._process_pool.shutdown()
+            self._process_pool = None
+
+    def _submit(self, function: Callable, *args) -> Future:
+        pool = self._get_process_pool()
+        if pool is not None:
+            return pool.submit(function, *args)
+        future = Future()
+        try:
+            future.set_result(function(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def _open_index(self, output_directory: str, shared: bool = False) -> Optional[ImageIndex]:
+        if not self.use_index:
+            return None
+        key = os.path.realpath(output_directory)
+        if key in self._indexes and shared and not self._indexes[key].shared:
+            self._indexes.pop(key).close()
+        if key not in self._indexes:
+            self._indexes[key] = ImageIndex(output_directory, shared=shared)
+        return self._indexes[key]
+
+    def _near_duplicates(self,
+                         output_directory: str,
+                         label: str,
+                         index: Optional[ImageIndex]) -> Optional[PerceptualHashIndex]:
+        if self.near_duplicate_threshold is None:
+            return None
+        key = (os.path.realpath(output_directory), label if self.near_duplicate_scope == 'label' else None)
+        if key not in self._phash_indexes:
+            hashes = index.phashes(key[1]) if index is not None else ()
+            self._phash_indexes[key] = PerceptualHashIndex(self.near_duplicate_threshold, hashes)
+        return self._phash_indexes[key]
+
+    def _forget_label(self, output_directory: str, label: str) -> None:
+        root = os.path.realpath(output_directory)
+        self._phash_indexes.pop((root, label), None)
+        self._phash_indexes.pop((root, None), None)
+        index = self._open_index(output_directory) if os.path.exists(output_directory) else None
+        if index is not None:
+            index.remove_label(label)
+
+    def _fetch_image(self, image_url: str, reserve: Optional[Callable[[int], None]] = None) -> bytes:
+        with self.metrics.time('download') as timer:
+            content = fetch_image(self.http_client, image_url, self.max_image_bytes, self.min_image_size,
+                                  reserve=reserve)
+            timer.bytes = len(content)
+        return content
+
+    def _image_path(self, target_folder: str, sha1: str, index: Optional[ImageIndex], extension: str = '.jpg') -> str:
+        file_path = os.path.join(target_folder, sha1[:10] + extension)
+        if index is not None and index.owner(file_path) not in (None, sha1):
+            # Another image already owns the short name, fall back to the full hash
+            file_path = os.path.join(target_folder, sha1 + extension)
+        return file_path
 
-    def _persist_images(self, target_folder: str, image_urls: List[str], return_images: bool = True) -> Optional[List]:
+    def _reuse_stored_image(self,
+                            target_folder: str,
+                            label: str,
+                            sha1: str,
+                            index: ImageIndex,
+                            near_duplicates: Optional[PerceptualHashIndex] = None,
+                            variant_roots: Sequence[str] = ()) -> Optional[str]:
+        entry = index.lookup(sha1, label)
+        if entry is None:
+            return None
+        if entry.label == label:
+            return entry.path
+
+        file_path = self._image_path(target_folder, sha1, index, os.path.splitext(entry.path)[1])
+        if not os.path.exists(file_path):
+            _link_or_copy(entry.path, file_path)
+        for root in variant_roots:
+            # Copies at the other shapes come along when they exist, resize_images fills in the others
+            source = os.path.join(root, entry.label, os.path.basename(entry.path))
+            destination = os.path.join(root, label, os.path.basename(file_path))
+            if os.path.exists(source) and not os.path.exists(destination):
+                os.makedirs(os.path.dirname(destination), exist_ok=True)
+                _link_or_copy(source, destination)
+        index.add(sha1, label, file_path, entry.width, entry.height, phash=entry.phash)
+        if near_duplicates is not None and entry.phash is not None and self.near_duplicate_scope == 'label':
+            near_duplicates.add(entry.phash)
+        return file_path
+
+    def _save_image(self,
+                    target_folder: str,
+                    image_url: str,
+                    sha1: str,
+                    processed: ProcessedImage,
+                    index: Optional[ImageIndex] = None,
+                    variant_roots: Sequence[str] = ()) -> Optional[str]:
+        try:
+            with self.metrics.time('write') as timer:
+                file_path = self._image_path(target_folder, sha1, index, processed.extension)
+                with open(file_path, 'wb') as f:
+                    f.write(processed.content)
+                timer.bytes = len(processed.content)
+                label = os.path.basename(os.path.normpath(target_folder))
+                for root, content in zip(variant_roots, processed.variants or ()):
+                    variant_folder = os.path.join(root, label)
+                    os.makedirs(variant_folder, exist_ok=True)
+                    with open(os.path.join(variant_folder, os.path.basename(file_path)), 'wb') as f:
+                        f.write(content)
+                    timer.bytes += len(content)
+                if index is not None:
+                    index.add(sha1, label, file_path, processed.width, processed.height,
+                              url=image_url, phash=processed.phash)
+            return file_path
+        except Exception as e:
+            logger.warning(f"ERROR - Could not save {image_url} - {e}")
+            return None
+
+    def _open_record(self, label: str, file_path: str, load_image: bool) -> DatasetRecord:
+        if not load_image:
+            return DatasetRecord(label, file_path, None)
+        with Image.open(file_path) as image:
+            return DatasetRecord(label, file_path, image.convert('RGB'))
+
+    def _iter_persisted_images(self,
+                               target_folder: str,
+                               image_urls: Iterable[str],
+                               load_images: bool = True,
+                               image_shape: Optional[Union[Tuple[int, int], Sequence[Tuple[int, int]]]] = None,
+                               progress: Optional[QueryManifest] = None,
+                               aspect_mode: str = 'stretch',
+                               resolutions_directory: Optional[str] = None) -> Iterator[DatasetRecord]:
+        """Downloads and stores ``image_urls``, yielding every image as soon as it is on disk.
+
+        Each image is decoded, resized to ``image_shape`` (if given) and encoded
+        once, on the process pool. When ``image_shape`` is a list of shapes,
+        the first one is stored under ``target_folder`` and the others, made
+        from the same decoded image, in the parallel trees of
+        ``resolution_roots``. The outcome of every URL is recorded in
+        ``progress`` when given.
+        """
 
         if not os.path.exists(target_folder):
             os.makedirs(target_folder)
 
-        images = [] if return_images else None
+        output_directory = os.path.dirname(os.path.normpath(target_folder))
+        label = os.path.basename(os.path.normpath(target_folder))
+        index = self._open_index(output_directory)
+        near_duplicates = self._near_duplicates(output_directory, label, index)
+        image_shape, extra_shapes = split_shapes(image_shape)
+        variant_roots = resolution_roots(output_directory, resolutions_directory, extra_shapes)
 
-        for image_url in tqdm(image_urls, desc="Saving images"):
-            try:
-                image_content = requests.get(image_url, timeout=10).content
+        # (URL key, file) of images already stored under this label, either from this label or linked from another one
+        reused_files = deque()
+        # Images being decoded, resized and encoded, mapped to the key of their URL and their content hash
+        processing: Dict[Future, Tuple[str, str]] = {}
+        max_processing = max(2 * self.process_workers, 1)
+        counts = Counter()
 
-            except Exception as e:
-                logger.warning(f"ERROR - Could not download {image_url} - {e}")
+        def urls_to_download():
+            for image_url in image_urls:
+                sha1 = index.lookup_url(url_key(image_url)) if index is not None else None
+                file_path = sha1 and self._reuse_stored_image(
+                    target_folder, label, sha1, index, near_duplicates, variant_roots)
+                if file_path:
+                    reused_files.append((url_key(image_url), file_path))
+                else:
+                    yield image_url
 
-            try:
-                image_file = io.BytesIO(image_content)
-                image = Image.open(image_file).convert('RGB')
-                if return_images:
-                    images.append(image.copy())
-                file_path = os.path.join(target_folder, hashlib.sha1(image_content).hexdigest()[:10] + '.jpg')
-                with open(file_path, 'wb') as f:
-                    image.save(f)
-                image.close()
-            except Exception as e:
-                logger.warning(f"ERROR - Could not save {image_url} - {e}")
+        def skip(image_url, reason):
+            if progress is not None:
+                progress.mark_skipped(image_url, reason)
 
-        return images
+        def drain_reused_files():
+            while reused_files:
+                counts['reused'] += 1
+                image_url, file_path = reused_files.popleft()
+                if progress is not None:
+                    progress.mark_saved(image_url, file_path)
+                yield self._open_record(label, file_path, load_images)
 
-    def _load_label_images(self, image_folder: str, max_images: int = None) -> List:
-        images = []
-        for image_filename in os.listdir(image_folder):
-            image = Image.open(os.path.join(image_folder, image_filename)).convert('RGB')
-            images.append(image.copy())
-            image.close()
-            if max_images is not None and len(images) >= max_images:
+        def finish(futures):
+            for future in futures:
+                image_url, sha1 = processing.pop(future)
+                try:
+                    processed = future.result()
+                except Exception as e:
+                    logger.warning(f"ERROR - Could not save {image_url} - {e}")
+                    self.metrics.record('decode', error=failure_reason(e))
+                    counts['failures'] += 1
+                    skip(image_url, 'decode')
+                    continue
+                for stage, seconds in (processed.timings or {}).items():
+                    self.metrics.record(stage, seconds)
+
+                if near_duplicates is not None and not near_duplicates.add_if_new(processed.phash):
+                    logger.info(f"Skipping {image_url}, near duplicate of an already stored image")
+                    counts['rejected'] += 1
+                    skip(image_url, 'near_duplicate')
+                    continue
+
+                file_path = self._save_image(target_folder, image_url, sha1, processed, index, variant_roots)
+                if file_path is None:
+                    counts['failures'] += 1
+                    continue
+                counts['saved'] += 1
+                if progress is not None:
+                    progress.mark_saved(image_url, file_path)
+                yield DatasetRecord(label, file_path, processed.to_image() if load_images else None)
+
+        results = self.downloader.download(urls_to_download())
+        total = len(image_urls) if isinstance(image_urls, Sized) else None
+        for result in tqdm(results, total=total, desc="Saving images"):
+            yield from drain_reused_files()
+
+            # data: URLs are only needed to download them, they are recorded and logged by key
+            key = url_key(result.url)
+            if result.error is not None:
+                logger.warning(f"ERROR - Could not download {key} - {result.error}")
+                counts['failures'] += 1
+                # Rejected responses say why they were dropped, transient errors leave the URL for the next runs
+                if isinstance(result.error, RejectedResponse):
+                    skip(key, result.error.reason)
+                elif not is_transient(result.error):
+                    skip(key, 'download')
+                elif progress is not None:
+                    progress.mark_failed(key)
+                continue
+
+            sha1 = hashlib.sha1(result.content).hexdigest()
+            if index is not None:
+                file_path = self._reuse_stored_image(
+                    target_folder, label, sha1, index, near_duplicates, variant_roots)
+                if file_path:
+                    index.add_url(key, sha1)
+                    reused_files.append((key, file_path))
+                    continue
+
+            future = self._submit(process_image, result.content, image_shape, near_duplicates is not None, load_images,
+                                  extra_shapes, aspect_mode, self.keep_original_bytes, self.encode_format,
+                                  self.encode_quality)
+            processing[future] = (key, sha1)
+            if len(processing) >= max_processing:
+                done, _ = wait(processing, return_when=FIRST_COMPLETED)
+            else:
+                done = [future for future in processing if future.done()]
+            yield from finish(done)
+
+        yield from finish(list(as_completed(processing)))
+        yield from drain_reused_files()
+
+        if index is not None:
+            index.commit()
+        for name, metric in (('saved', 'images_saved'), ('reused', 'images_reused'),
+                             ('rejected', 'near_duplicates_rejected'), ('failures', 'images_failed')):
+            if counts[name]:
+                self.metrics.increment(metric, counts[name])
+        if counts['reused']:
+            logger.info(f"Reused {counts['reused']} already stored images for {target_folder}")
+        if counts['rejected']:
+            logger.info(f"Rejected {counts['rejected']} near duplicate images for {target_folder}")
+        if counts['failures']:
+            logger.warning(f"Could not persist {counts['failures']} images into {target_folder}")
+
+    def _persist_images(self, target_folder: str, image_urls: Iterable[str], return_images: bool = True) -> Optional[List]:
+        records = self._iter_persisted_images(target_folder, image_urls, load_images=return_images)
+        if not return_images:
+            for _ in records:
+                pass
+            return None
+        return [record.image for record in records]
+
+    def _iter_label_images(self,
+                           image_folder: str,
+                           max_images: int = None,
+                           load_images: bool = True) -> Iterator[Tuple[str, Optional[Image.Image]]]:
+        for n_images, image_filename in enumerate(os.listdir(image_folder)):
+            if max_images is not None and n_images >= max_images:
                 break
-        return images
+            file_path = os.path.join(image_folder, image_filename)
+            if not load_images:
+                yield file_path, None
+                continue
+            with self.metrics.time('cache_load') as timer:
+                with Image.open(file_path) as image:
+                    loaded = image.convert('RGB')
+                if self.metrics.enabled:
+                    timer.bytes = os.path.getsize(file_path)
+            yield file_path, loaded
+
+    def _load_label_images(self, image_folder: str, max_images: int = None) -> List:
+        return [image for _, image in self._iter_label_images(image_folder, max_images)]
+
+    def load_label_dataset(self,
+                           image_folder: str,
+                           max_images: int = None,
+                           image_shape: Optional[Tuple[int, int]] = None,
+                           cache_size: int = 0,
+                           prefetch: int = 0) -> LazyImageDataset:
+        """Lazy counterpart of ``_load_label_images``: the same images, decoded only when they are accessed"""
+        return LazyImageDataset.from_folder(image_folder, max_images=max_images, image_shape=image_shape,
+                                            cache_size=cache_size, prefetch=prefetch)
+
+    def load_label_tensor(self,
+                          image_folder: str,
+                          image_shape: Tuple[int, int],
+                          max_images: int = None) -> Tuple[np.ndarray, List[str]]:
+        """Images of a label folder as an N x H x W x 3 uint8 array of ``image_shape`` images, with their paths.
+
+        The array is stored under ``.imagines/tensors`` next to the label
+        folder and memory-mapped by later calls, until a file of the folder is
+        added, removed or modified.
+        """
+        output_directory, label = os.path.split(os.path.normpath(image_folder))
+        file_names = os.listdir(image_folder)
+        fingerprint = folder_fingerprint(image_folder, file_names)
+        cache = TensorCache(output_directory)
+        cached = cache.load(label, image_shape, fingerprint)
+        if cached is not None:
+            self.metrics.increment('tensor_cache_hits')
+        else:
+            self.metrics.increment('tensor_cache_misses')
+
+            def decode():
+                for file_name in file_names:
+                    file_path = os.path.join(image_folder, file_name)
+                    with self.metrics.time('cache_load') as timer:
+                        image = load_image(file_path, image_shape)
+                        if self.metrics.enabled:
+                            timer.bytes = os.path.getsize(file_path)
+                    yield image
+
+            try:
+                cache.store(label, image_shape, fingerprint, file_names, decode())
+                cached = cache.load(label, image_shape, fingerprint)
+            except OSError as e:
+                logger.warning(f"Could not cache the images of {image_folder} - {e}")
+            if cached is None:
+                width, height = image_shape
+                images = [np.asarray(image, dtype=np.uint8) for image in decode()]
+                cached = (np.stack(images) if images else np.zeros((0, height, width, 3), dtype=np.uint8)), file_names
+
+        images, file_names = cached
+        if max_images is not None:
+            images, file_names = images[:max_images], file_names[:max_images]
+        return images, [os.path.join(image_folder, file_name) for file_name in file_names]
 
     def resize_images(self,
                       folder_path: str,
-                      image_shape: Tuple[int, int]) -> None:
+                      image_shape: Union[Tuple[int, int], Sequence[Tuple[int, int]]],
+                      skip_if_sized: bool = False,
+                      aspect_mode: str = 'stretch',
+                      resolutions_directory: Optional[str] = None) -> None:
+        """Resizes every image of every label folder in place, on the process pool.
+
+        ``image_shape`` can also be a list of shapes: images are resized in
+        place to the first one, and copies at the others are written from the
+        same decoded image into the parallel trees of ``resolution_roots``.
+        With ``skip_if_sized`` images that already have ``image_shape`` are left
+        untouched, which only costs reading their header in this process, and
+        existing copies are kept.
+        """
 
+        check_aspect_mode(aspect_mode)
+        image_shape, extra_shapes = split_shapes(image_shape)
+        variant_roots = resolution_roots(folder_path, resolutions_directory, extra_shapes)
         for label in os.listdir(folder_path):
             label_folder_path = os.path.join(folder_path, label)
+            if label.startswith('.') or not os.path.isdir(label_folder_path):
+                continue
 
-            for image_file in tqdm(os.listdir(label_folder_path), desc="Resizing images for label {}".format(label)):
+            jobs = []
+            for image_file in os.listdir(label_folder_path):
                 file_path = os.path.join(label_folder_path, image_file)
+                variants = [(shape, os.path.join(root, label, image_file))
+                            for shape, root in zip(extra_shapes, variant_roots)]
+                # Reading a header is cheaper than shipping the file to a worker process
+                if skip_if_sized and is_resized(file_path, image_shape, variants):
+                    continue
+                jobs.append((file_path, (resize_file, file_path, image_shape, skip_if_sized, aspect_mode, variants)))
+            if self._get_process_pool() is None:
+                # Each image is resized as the progress bar reaches it
+                results = ((file_path, self._submit(timed_call, *args).result()) for file_path, args in jobs)
+            else:
+                futures = {self._submit(timed_call, *args): file_path for file_path, args in jobs}
+                results = ((futures[future], future.result()) for future in as_completed(futures))
+            for file_path, (error, seconds) in tqdm(results, total=len(jobs),
+                                                    desc="Resizing images for label {}".format(label)):
+                if error is not None:
+                    logger.warning(f"ERROR - Could not resize image {file_path} - {error}")
+                self.metrics.record('resize', seconds, error=None if error is None else 'resize_failed')
+
+    def iter_dataset(self,
+                     label_queries: Union[Dict[str, List[str]], str],
+                     output_directory: str,
+                     max_links_to_fetch: int,
+                     sleep_between_interactions: float = 1,
+                     cache_data: bool = True,
+                     load_images: bool = True,
+                     image_shape: Optional[Union[Tuple[int, int], Sequence[Tuple[int, int]]]] = None,
+                     aspect_mode: str = 'stretch',
+                     resolutions_directory: Optional[str] = None) -> Iterator[DatasetRecord]:
+        """Builds the dataset label by label, yielding a ``(label, path, image)`` record per stored image.
+
+        Records are yielded as soon as each image is persisted and are not kept
+        around, so memory stays bounded whatever the size of the dataset. With
+        ``load_images=False`` the ``image`` field is ``None``. Downloaded images
+        are resized to ``image_shape`` before being written, when it is given,
+        in which case cached labels come out of the tensor cache if it is
+        enabled (see ``load_label_tensor``) instead of being decoded again.
+        A list of shapes also writes every image at the other ones, see
+        ``_iter_persisted_images``; records always hold the first one.
+        Unless ``use_thumbnails`` is off, searches then take the thumbnail of
+        every result that already covers the shapes, instead of clicking
+        through to a full-size image that would mostly be thrown away.
+
+        Every label keeps a manifest of the URLs found and saved per query.
+        With ``cache_data`` a label whose manifest covers all of its queries
+        (or a non-empty folder created before manifests existed) is loaded
+        from disk, otherwise only the missing searches and downloads are run,
+        which also resumes interrupted runs. URLs whose download failed on a
+        transient error (connection error, timeout, 5xx) are tried again then,
+        for up to ``MAX_DOWNLOAD_ATTEMPTS`` runs. In offline mode every label
+        folder on disk is loaded as it is and labels without one are skipped.
+        """
+
+        if isinstance(label_queries, str):
+            # Load json file
+            with open(label_queries, 'r') as f:
+                label_queries = json.load(f)
+
+        # Work out what every label needs first, so that searches run ahead on the scraper pool
+        plans = []
+        searches: Dict[Tuple[str, str], SearchStream] = {}
+        if self.offline and not cache_data:
+            raise ValueError('Offline mode can only load cached data, cache_data must be True')
+        check_aspect_mode(aspect_mode)
+        primary_shape, extra_shapes = split_shapes(image_shape)
+        variant_roots = resolution_roots(output_directory, resolutions_directory, extra_shapes)
+        thumbnail_size = self._thumbnail_size(image_shape)
+
+        for label, queries in label_queries.items():
+            target_folder = os.path.join(output_directory, label)
+            if self.offline:
+                if os.path.exists(target_folder):
+                    plans.append((label, queries, target_folder, None, True))
+                else:
+                    logger.warning(f"Skipping label {label}, {target_folder} does not exist and searches are disabled")
+                continue
+            manifest = LabelManifest(output_directory, label)
+
+            if os.path.exists(target_folder) and not cache_data:
+                logger.info(f"Found target folder {target_folder}. Removing folder...")
+                shutil.rmtree(target_folder)
+                for root in variant_roots:
+                    shutil.rmtree(os.path.join(root, label), ignore_errors=True)
+                self._forget_label(output_directory, label)
+            if not os.path.exists(target_folder):
+                manifest.reset()
+
+            # Folders without a manifest were made before manifests existed, unless nothing was stored in them
+            if manifest.exists:
+                cached = os.path.exists(target_folder) and manifest.is_complete(queries, max_links_to_fetch)
+            else:
+                cached = os.path.exists(target_folder) and bool(os.listdir(target_folder))
+            plans.append((label, queries, target_folder, manifest, cached))
+            if cached:
+                continue
+            for query in queries:
+                progress = manifest.query(query)
+                if not progress.needs_search(max_links_to_fetch) or (label, query) in searches:
+                    continue
+                if not self._load_cached_search(query, progress, max_links_to_fetch, thumbnail_size):
+                    searches[(label, query)] = self._get_search_pool().stream(
+                        query, max_links_to_fetch, sleep_between_interactions,
+                        maxsize=self.url_queue_size or max_links_to_fetch, thumbnail_size=thumbnail_size)
+
+        try:
+            for label, queries, target_folder, manifest, cached in tqdm(plans, desc="Augmenting dataset"):
+                if cached:
+                    logger.info(f"Found target folder {target_folder}. Loading images...")
+                    if self.tensor_cache and load_images and primary_shape is not None:
+                        images, file_paths = self.load_label_tensor(target_folder, primary_shape, max_links_to_fetch)
+                        for file_path, image in zip(file_paths, images):
+                            yield DatasetRecord(label, file_path, Image.fromarray(image))
+                        continue
+                    for file_path, image in self._iter_label_images(target_folder, max_links_to_fetch, load_images):
+                        yield DatasetRecord(label, file_path, image)
+                    continue
+
+                yield from self._iter_label_queries(label, queries, target_folder, manifest, searches,
+                                                    max_links_to_fetch, load_images, image_shape, aspect_mode,
+                                                    resolutions_directory)
+        finally:
+            # Searches queued for labels that will not be reached anymore
+            for search in searches.values():
+                search.cancel()
+
+    def _iter_label_queries(self,
+                            label: str,
+                            queries: List[str],
+                            target_folder: str,
+                            manifest: LabelManifest,
+                            searches: Dict[Tuple[str, str], SearchStream],
+                            max_links_to_fetch: int,
+                            load_images: bool,
+                            image_shape: Optional[Union[Tuple[int, int], Sequence[Tuple[int, int]]]],
+                            aspect_mode: str = 'stretch',
+                            resolutions_directory: Optional[str] = None) -> Iterator[DatasetRecord]:
+        # Written before the label folder, which would otherwise pass for a complete one made without manifests
+        if not manifest.exists:
+            manifest.save()
+        # Files yielded before resuming, reused images of the label must not be yielded twice
+        existing_files = set()
+        if os.path.exists(target_folder):
+            logger.info(f"Found incomplete target folder {target_folder}. Resuming...")
+            for file_path, image in self._iter_label_images(target_folder, load_images=load_images):
+                existing_files.add(file_path)
+                yield DatasetRecord(label, file_path, image)
+
+        try:
+            for query in queries:
+                progress = manifest.query(query)
+
+                # URLs left over by the previous run go first, then the ones found while the search runs
+                image_urls = progress.pending_downloads()
+                search = searches.pop((label, query), None)
+                if search is not None:
+                    image_urls = chain(image_urls, self._iter_search_results(search, progress, max_links_to_fetch))
+
+                records = self._iter_persisted_images(target_folder, image_urls, load_images, image_shape, progress,
+                                                      aspect_mode, resolutions_directory)
                 try:
-                    image = Image.open(file_path)
-                    image = image.resize(image_shape)
-                    image.save(file_path)
-                except Exception as e:
-                    print(f"ERROR - Could not resize image {file_path} - {e}")
+                    for record in records:
+                        if record.path not in existing_files:
+                            yield record
+                finally:
+                    if search is not None:
+                        self._stop_search(search, progress, max_links_to_fetch)
+        finally:
+            # Also reached when interrupted, so that the next run resumes from here
+            manifest.save()
+
+    def _iter_search_results(self,
+                             search: SearchStream,
+                             progress: QueryManifest,
+                             max_links_to_fetch: int) -> Iterator[str]:
+        """Records the URLs of a running search in the manifest, passing on the new ones"""
+        try:
+            for image_url in search:
+                if progress.add_url(image_url):
+                    yield image_url
+        except Exception as e:
+            logger.warning(f"ERROR - Could not search {search.query} - {e}")
+            self.metrics.record('search', search.seconds, error=failure_reason(e))
+            return
+        self.metrics.record('search', search.seconds)
+        self._search_completed(search.query, progress, max_links_to_fetch, search.thumbnail_size)
+
+    def _stop_search(self, search: SearchStream, progress: QueryManifest, max_links_to_fetch: int) -> None:
+        # A search that already completed keeps its results even if they were not all downloaded
+        if search.future.done():
+            image_urls, completed = search.drain()
+            for image_url in image_urls:
+                progress.add_url(image_url)
+            if completed and progress.needs_search(max_links_to_fetch):
+                self._search_completed(search.query, progress, max_links_to_fetch, search.thumbnail_size)
+        search.cancel()
+
+    def _thumbnail_size(self,
+                        image_shape: Optional[Union[Tuple[int, int], Sequence[Tuple[int, int]]]]
+                        ) -> Optional[Tuple[int, int]]:
+        """Smallest thumbnail that can stand in for a full-size image, None if thumbnails are not used.
+
+        It covers every shape images are resized to, and ``min_image_size``.
+        """
+        if not self.use_thumbnails or image_shape is None:
+            return None
+        primary_shape, extra_shapes = split_shapes(image_shape)
+        shapes = (primary_shape,) + extra_shapes
+        if self.min_image_size is not None:
+            shapes += (tuple(self.min_image_size),)
+        return max(width for width, _ in shapes), max(height for _, height in shapes)
+
+    def _search_backend_name(self, thumbnail_size: Optional[Tuple[int, int]] = None) -> str:
+        # Results of different backends are cached apart, and so are thumbnails of different sizes
+        if self.search_backend is not None:
+            name = 'custom:' + self.search_cache_key
+        else:
+            name = self.driver_type
+        if thumbnail_size is not None:
+            name += ':thumbnails:{}x{}'.format(*thumbnail_size)
+        return name
+
+    def _load_cached_search(self,
+                            query: str,
+                            progress: QueryManifest,
+                            max_links_to_fetch: int,
+                            thumbnail_size: Optional[Tuple[int, int]] = None) -> bool:
+        """Fills ``progress`` from the search cache, returns whether no search is needed anymore.
+
+        URLs cached by a smaller search are still used, the search that
+        follows only hands over the URLs it finds beyond them.
+        """
+        if self.search_cache is None:
+            return False
+        cached = self.search_cache.get(query, self._search_backend_name(thumbnail_size))
+        if cached is None:
+            self.metrics.increment('search_cache_misses')
+            return False
+        for image_url in cached.urls[:max_links_to_fetch]:
+            progress.add_url(image_url)
+        if not cached.covers(max_links_to_fetch):
+            self.metrics.increment('search_cache_partial_hits')
+            return False
+        self.metrics.increment('search_cache_hits')
+        progress.mark_searched(max_links_to_fetch)
+        return True
+
+    def _search_completed(self,
+                          query: str,
+                          progress: QueryManifest,
+                          max_links_to_fetch: int,
+                          thumbnail_size: Optional[Tuple[int, int]] = None) -> None:
+        progress.mark_searched(max_links_to_fetch)
+        if self.search_cache is not None:
+            self.search_cache.put(query, self._search_backend_name(thumbnail_size), progress.search_results(),
+                                  max_links_to_fetch)
+
+    def _open_packed_writers(self,
+                             output_format: Union[str, Sequence[str]],
+                             packed_directory: str,
+                             image_shape: Union[Tuple[int, int], Sequence[Tuple[int, int]]],
+                             max_shard_bytes: int,
+                             aspect_mode: str = 'stretch',
+                             variant_roots: Sequence[str] = ()) -> List[Tuple[object, Optional[str]]]:
+        """Writers of every packed format and shape, each with the root of the tree it reads (None for the main one)"""
+        formats = [output_format] if isinstance(output_format, str) else list(output_format)
+        unknown = set(formats) - {'files', 'shards', 'array'}
+        if unknown:
+            raise ValueError(f'Output format not supported: {", ".join(sorted(unknown))}')
+
+        image_shape, extra_shapes = split_shapes(image_shape)
+        writers = []
+        for index, shape in enumerate((image_shape,) + extra_shapes):
+            width, height = shape
+            # The first shape keeps the names packed outputs had before several shapes were supported
+            root = variant_roots[index - 1] if index else None
+            if 'shards' in formats:
+                shards_name = f'shards_{width}x{height}' if index else 'shards'
+                writers.append((ShardWriter(os.path.join(packed_directory, shards_name), max_shard_bytes), root))
+            if 'array' in formats:
+                writers.append((ArrayWriter(os.path.join(packed_directory, f'array_{width}x{height}'), shape,
+                                            aspect_mode), root))
+        return writers
 
     def augment_dataset(self,
                         label_queries: Union[Dict[str, List[str]], str],
                         output_directory: str,
                         max_links_to_fetch: int,
-                        image_shape: Tuple[int, int],
+                        image_shape: Union[Tuple[int, int], Sequence[Tuple[int, int]]],
                         resize_images: bool = False,
                         sleep_between_interactions: float = 1,
                         return_data: bool = True,
-                        cache_data: bool = True) -> Optional[Tuple[List, List]]:
+                        cache_data: bool = True,
+                        output_format: Union[str, Sequence[str]] = 'files',
+                        packed_directory: Optional[str] = None,
+                        max_shard_bytes: int = 256 * 1024 * 1024,
+                        return_report: bool = False,
+                        lazy: bool = False,
+                        image_cache_size: int = 0,
+                        prefetch: int = 0,
+                        aspect_mode: str = 'stretch',
+                        resolutions_directory: Optional[str] = None) -> Optional[Tuple]:
+        """Searches, downloads and stores images for every label of ``label_queries``.
 
-        images_list = [] if return_data else None
-        labels_list = [] if return_data else None
+        Images are always stored one per file under ``output_directory/<label>``,
+        as JPEG unless ``encode_format`` or ``keep_original_bytes`` say
+        otherwise. ``output_format`` can also ask for packed copies of the
+        whole dataset, written under ``packed_directory``
+        (``output_directory/.imagines/packed`` by default): ``'shards'`` for
+        size-bounded tar shards (see ``iter_shards``) and ``'array'`` for a
+        memory-mappable uint8 array of ``image_shape`` images (see ``load_array``).
 
-        if isinstance(label_queries, str):
-            # Load json file
-            with open(label_queries, 'r') as f:
-                label_queries = json.load(f)
+        ``image_shape`` can also be a list of shapes, along with
+        ``resize_images``: every image is then decoded once and written at the
+        first shape under ``output_directory`` and at the other ones under
+        ``resolutions_directory/<width>x<height>/<label>``
+        (``output_directory/.imagines/resolutions`` by default), with packed
+        outputs for each shape. ``aspect_mode`` says how images of another
+        aspect ratio are resized: ``'stretch'``, ``'fit'`` (padded) or
+        ``'crop'`` (centered).
 
-        for label, queries in tqdm(label_queries.items(), desc="Augmenting dataset"):
-            target_folder = os.path.join(output_directory, label)
+        With ``return_report`` a RunReport of the per-stage metrics of the run
+        is returned as well, as ``(images, labels, report)``.
 
-            if os.path.exists(target_folder) and cache_data:
-                logger.info(f"Found target folder {target_folder}. Loading images...")
-                images = self._load_label_images(target_folder, max_links_to_fetch)
-                images_list += images
-                labels_list += [label] * len(images)
-            else:
-                if os.path.exists(target_folder) and not cache_data:
-                    logger.info(f"Found target folder {target_folder}. Removing folder...")
-                    shutil.rmtree(target_folder)
-                for query in queries:
+        With ``lazy`` the images are returned as a LazyImageDataset, which only
+        decodes an image when it is accessed, keeping up to ``image_cache_size``
+        of them and decoding the next ``prefetch`` ones in the background.
+        """
 
-                    image_urls = self.driver.search_images(
-                        query=query,
-                        max_links_to_fetch=max_links_to_fetch,
-                        sleep_between_interactions=sleep_between_interactions)
+        check_aspect_mode(aspect_mode)
+        extra_shapes = split_shapes(image_shape)[1]
+        if extra_shapes and not resize_images:
+            raise ValueError('Several image shapes are only written with resize_images')
+        if return_report and not self.metrics.enabled:
+            self.metrics = Metrics()
+        # Metrics cover the latest run
+        self.metrics.reset()
 
-                    images = self._persist_images(target_folder, image_urls)
+        images_list = [] if return_data else None
+        labels_list = [] if return_data else None
+        paths_list = []
 
-                    if return_data:
-                        images_list.append(images)
-                        labels_list.append(label)
+        if packed_directory is None:
+            packed_directory = os.path.join(output_directory, METADATA_DIRNAME, 'packed')
+        variant_roots = resolution_roots(output_directory, resolutions_directory, extra_shapes)
+        writers = self._open_packed_writers(output_format, packed_directory, image_shape, max_shard_bytes,
+                                            aspect_mode, variant_roots)
 
-        if resize_images:
-            self.resize_images(output_directory, image_shape)
+        if resize_images and os.path.exists(output_directory):
+            # Catch up on cached labels, new images are resized while they are persisted
+            self.resize_images(output_directory, image_shape, skip_if_sized=True, aspect_mode=aspect_mode,
+                               resolutions_directory=resolutions_directory)
 
-        self.driver.close_session()
+        records = self.iter_dataset(label_queries,
+                                    output_directory,
+                                    max_links_to_fetch,
+                                    sleep_between_interactions=sleep_between_interactions,
+                                    cache_data=cache_data,
+                                    load_images=(return_data and not lazy) or any(
+                                        isinstance(w, ArrayWriter) and root is None for w, root in writers),
+                                    image_shape=image_shape if resize_images else None,
+                                    aspect_mode=aspect_mode,
+                                    resolutions_directory=resolutions_directory)
+        try:
+            for record in records:
+                for writer, root in writers:
+                    if root is None:
+                        writer.add(record.label, record.path, record.image)
+                    else:
+                        writer.add(record.label, os.path.join(root, record.label, os.path.basename(record.path)))
+                if return_data:
+                    if lazy:
+                        paths_list.append(record.path)
+                    else:
+                        images_list.append(record.image)
+                    labels_list.append(record.label)
+        finally:
+            try:
+                for writer, _ in writers:
+                    writer.close()
+            finally:
+                self.close()
 
+        if return_data and lazy:
+            images_list = LazyImageDataset(paths_list, labels_list, cache_size=image_cache_size, prefetch=prefetch)
+        if return_report:
+            return images_list, labels_list, self.metrics.report()
         if return_data:
             return images_list, labels_list
+
+    def run_worker(self,
+                   label_queries: Union[Dict[str, List[str]], str],
+                   output_directory: str,
+                   max_links_to_fetch: int,
+                   image_shape: Optional[Union[Tuple[int, int], Sequence[Tuple[int, int]]]] = None,
+                   sleep_between_interactions: float = 1,
+                   worker_id: Optional[str] = None,
+                   lease_seconds: float = 600.0,
+                   merge: bool = True) -> List[str]:
+        """Builds the labels of ``label_queries`` along with other workers sharing ``output_directory``.
+
+        Every worker (process or host) runs the same call: labels are claimed
+        one at a time through a WorkQueue, so each one is built by a single
+        worker, and labels left behind by dead workers are resumed once their
+        lease expires. Downloaded images are resized to ``image_shape`` when it
+        is given. With ``merge`` the worker finally writes the merged
+        manifest (see ``WorkQueue.merge``), complete once all labels are.
+        A label is only marked done once its manifest is complete, labels
+        with images that could not be stored are left for another run. A
+        worker losing the lease of its label stops building it.
+        Returns the labels built by this worker.
+        """
+
+        if isinstance(label_queries, str):
+            with open(label_queries, 'r') as f:
+                label_queries = json.load(f)
+
+        queue = WorkQueue(output_directory, worker_id, lease_seconds)
+        built = []
+        try:
+            # Every worker writes to the index of the output directory
+            os.makedirs(output_directory, exist_ok=True)
+            self._open_index(output_directory, shared=True)
+            for label, queries in label_queries.items():
+                if not queue.claim(label):
+                    continue
+                logger.info(f"Worker {queue.worker_id} building label {label}")
+                with queue.hold(label) as lost:
+                    records = self.iter_dataset({label: queries},
+                                                output_directory,
+                                                max_links_to_fetch,
+                                                sleep_between_interactions=sleep_between_interactions,
+                                                load_images=False,
+                                                image_shape=image_shape)
+                    count = 0
+                    for _ in records:
+                        if lost.is_set():
+                            break
+                        count += 1
+                    records.close()
+                    # The worker that took the label over builds and completes it
+                    if lost.is_set() or not queue.renew(label):
+                        logger.warning(f"Stopped building label {label}, its lease was lost")
+                        continue
+                    if not LabelManifest(output_directory, label).is_complete(queries, max_links_to_fetch):
+                        logger.warning(f"Label {label} is incomplete, leaving it to another run")
+                        continue
+                    queue.complete(label, count)
+                built.append(label)
+        finally:
+            self.close()
+        if merge:
+            queue.merge(label_queries)
+        return built
@@ -0,0 +1,162 @@
+import os
+import threading
+from collections import OrderedDict
+from collections.abc import Sequence
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple, Union
+
+from PIL import Image
+
+from .processing import draft, resize
+
+
+def load_image(file_path: str, image_shape: Optional[Tuple[int, int]] = None) -> Image.Image:
+    with Image.open(file_path) as image:
+        draft(image, image_shape)
+        loaded = image.convert('RGB')
+    return resize(loaded, image_shape)
+
+
+class LazyImageDataset(Sequence):
+    """Images stored on disk, decoded only when they are accessed.
+
+    Behaves as a read-only list of RGB images (resized to ``image_shape`` if
+    given), with the label of every image in ``labels``. Up to ``cache_size``
+    decoded images are kept, least recently used first out, and accessing an
+    image also decodes the next ``prefetch`` ones on a thread pool, where they
+    wait until they are used. Pickled copies, such as the ones of data loader
+    workers, start with an empty cache.
+    """
+
+    def __init__(self,
+                 paths: Sequence,
+                 labels: Optional[Sequence] = None,
+                 image_shape: Optional[Tuple[int, int]] = None,
+                 cache_size: int = 0,
+                 prefetch: int = 0,
+                 max_workers: Optional[int] = None):
+        if labels is not None and len(labels) != len(paths):
+            raise ValueError('paths and labels must have the same length')
+        self.paths = list(paths)
+        self.labels = list(labels) if labels is not None else None
+        self.image_shape = tuple(image_shape) if image_shape is not None else None
+        self.cache_size = cache_size
+        self.prefetch = prefetch
+        # Prefetched images wait in the cache until they are used, on top of the recently used ones
+        self._capacity = cache_size + prefetch
+        self.max_workers = max_workers or min(prefetch, os.cpu_count() or 1, 8) or 1
+        self._init_state()
+
+    def _init_state(self) -> None:
+        self._lock = threading.Lock()
+        self._cache: 'OrderedDict[int, Image.Image]' = OrderedDict()
+        self._pending: Dict[int, Future] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @classmethod
+    def from_folder(cls, image_folder: str, label: Optional[str] = None, max_images: Optional[int] = None, **kwargs):
+        """Dataset of the images of a label folder, in directory order like ``_load_label_images``"""
+        paths = [os.path.join(image_folder, image_filename) for image_filename in os.listdir(image_folder)]
+        paths = paths[:max_images] if max_images is not None else paths
+        if label is None:
+            label = os.path.basename(os.path.normpath(image_folder))
+        return cls(paths, [label] * len(paths), **kwargs)
+
+    def __getstate__(self):
+        # Workers of training data loaders get their own cache and threads
+        state = self.__dict__.copy()
+        for name in ('_lock', '_cache', '_pending', '_executor'):
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_state()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def __getitem__(self, index: Union[int, slice]):
+        if isinstance(index, slice):
+            return LazyImageDataset(self.paths[index],
+                                    self.labels[index] if self.labels is not None else None,
+                                    image_shape=self.image_shape,
+                                    cache_size=self.cache_size,
+                                    prefetch=self.prefetch,
+                                    max_workers=self.max_workers)
+        if index < 0:
+            index += len(self.paths)
+        if not 0 <= index < len(self.paths):
+            raise IndexError('LazyImageDataset index out of range')
+
+        for ahead in range(index + 1, min(index + 1 + self.prefetch, len(self.paths))):
+            self._schedule(ahead)
+
+        with self._lock:
+            image = self._cache.get(index)
+            if image is not None:
+                if self.cache_size:
+                    self._cache.move_to_end(index)
+                else:
+                    del self._cache[index]
+                return image
+            future = self._pending.get(index)
+        if future is not None:
+            image = future.result()
+            if not self.cache_size:
+                with self._lock:
+                    self._cache.pop(index, None)
+            return image
+        image = load_image(self.paths[index], self.image_shape)
+        if self.cache_size:
+            self._store(index, image)
+        return image
+
+    def _store(self, index: int, image: Image.Image) -> None:
+        with self._lock:
+            self._cache[index] = image
+            self._cache.move_to_end(index)
+            while len(self._cache) > self._capacity:
+                self._cache.popitem(last=False)
+
+    def _schedule(self, index: int) -> None:
+        with self._lock:
+            if index in self._cache or index in self._pending:
+                return
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                    thread_name_prefix='imagines-prefetch')
+            self._pending[index] = self._executor.submit(self._prefetch, index)
+
+    def _prefetch(self, index: int) -> Image.Image:
+        try:
+            image = load_image(self.paths[index], self.image_shape)
+            self._store(index, image)
+            return image
+        finally:
+            with self._lock:
+                self._pending.pop(index, None)
+
+    def cached_indices(self) -> List[int]:
+        with self._lock:
+            return list(self._cache)
+
+    def close(self) -> None:
+        """Stops prefetching and empties the cache"""
+        with self._lock:
+            executor = self._executor
+            self._executor = None
+            pending = list(self._pending.values())
+        for future in pending:
+            future.cancel()
+        if executor is not None:
+            executor.shutdown(wait=True)
+        with self._lock:
+            self._cache.clear()
+            self._pending.clear()
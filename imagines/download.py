@@ -0,0 +1,176 @@
+import threading
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Deque, Dict, Iterable, Iterator, List, NamedTuple, Optional
+from urllib.parse import urlsplit
+
+
+class DownloadResult(NamedTuple):
+    url: str
+    content: Optional[bytes]
+    error: Optional[Exception]
+
+
+class ByteBudget:
+    """Caps the number of downloaded bytes held in memory at the same time.
+
+    Downloads reserve their bytes while they receive them, through a
+    Reservation, and hand them back once the payload is consumed. A
+    reservation waits while the budget is full. When the budget is only held
+    by downloads still receiving, nothing would ever be released, so the
+    oldest of them goes through: memory stays within ``max_bytes`` plus one
+    payload.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.in_flight = 0
+        self._closed = False
+        self._condition = threading.Condition()
+        # Downloads still receiving, oldest first
+        self._receiving: List['Reservation'] = []
+
+    def reservation(self) -> 'Reservation':
+        reservation = Reservation(self)
+        with self._condition:
+            self._receiving.append(reservation)
+        return reservation
+
+    def acquire(self, n_bytes: int, reservation: Optional['Reservation'] = None) -> None:
+        with self._condition:
+            # A payload bigger than the whole budget is let through once nothing else is held
+            self._condition.wait_for(
+                lambda: self._closed
+                or self.in_flight == 0
+                or self.in_flight + n_bytes <= self.max_bytes
+                or (reservation is not None and self._receiving[:1] == [reservation]
+                    and self.in_flight == sum(receiving.held for receiving in self._receiving)))
+            self.in_flight += n_bytes
+            if reservation is not None:
+                reservation.held += n_bytes
+
+    def release(self, n_bytes: int, reservation: Optional['Reservation'] = None) -> None:
+        with self._condition:
+            self.in_flight -= n_bytes
+            if reservation is not None:
+                reservation.held -= n_bytes
+            self._condition.notify_all()
+
+    def _done_receiving(self, reservation: 'Reservation') -> None:
+        with self._condition:
+            if reservation in self._receiving:
+                self._receiving.remove(reservation)
+                self._condition.notify_all()
+
+    def close(self) -> None:
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+
+class Reservation:
+    """Bytes of a single download held in a ByteBudget"""
+
+    def __init__(self, budget: ByteBudget):
+        self.budget = budget
+        self.held = 0
+
+    def reserve(self, n_bytes: int) -> None:
+        """Holds ``n_bytes`` in total for this download, waiting for room in the budget if needed"""
+        if n_bytes > self.held:
+            self.budget.acquire(n_bytes - self.held, self)
+
+    def settle(self, n_bytes: int) -> None:
+        """Ends the download, adjusting the bytes held to the ``n_bytes`` it kept"""
+        self.reserve(n_bytes)
+        self.budget._done_receiving(self)
+        if self.held > n_bytes:
+            self.budget.release(self.held - n_bytes, self)
+
+
+def url_host(url: str) -> str:
+    return urlsplit(url).netloc.lower()
+
+
+class ConcurrentDownloader:
+    """Fetches URLs on a thread pool and yields the results as they complete.
+
+    At most ``max_per_host`` requests run against the same host at once, and the
+    payloads being received or not consumed yet stay within ``max_inflight_bytes``
+    plus a single payload, see ByteBudget. ``fetch(url, reserve)`` is expected to
+    call ``reserve`` with the number of bytes it holds so far as the body comes
+    in; whatever it did not reserve is reserved once it returns.
+    """
+
+    def __init__(self,
+                 fetch: Callable[[str, Callable[[int], None]], bytes],
+                 max_workers: int = 8,
+                 max_per_host: int = 4,
+                 max_inflight_bytes: int = 64 * 1024 * 1024):
+        if max_workers < 1 or max_per_host < 1:
+            raise ValueError('max_workers and max_per_host must be at least 1')
+        self.fetch = fetch
+        self.max_workers = max_workers
+        self.max_per_host = max_per_host
+        self.max_inflight_bytes = max_inflight_bytes
+
+    def _fetch(self, url: str, budget: ByteBudget) -> DownloadResult:
+        reservation = budget.reservation()
+        try:
+            content = self.fetch(url, reservation.reserve)
+        except Exception as e:
+            reservation.settle(0)
+            return DownloadResult(url, None, e)
+        reservation.settle(len(content))
+        return DownloadResult(url, content, None)
+
+    def download(self, urls: Iterable[str]) -> Iterator[DownloadResult]:
+        budget = ByteBudget(self.max_inflight_bytes)
+        url_iter = iter(urls)
+        exhausted = False
+        pending: Dict[Future, str] = {}
+        # URLs pulled from the input whose host is already at its concurrency cap
+        deferred: Deque[str] = deque()
+        active: Counter = Counter()
+
+        def next_url() -> Optional[str]:
+            nonlocal exhausted
+            for _ in range(len(deferred)):
+                url = deferred.popleft()
+                if active[url_host(url)] < self.max_per_host:
+                    return url
+                deferred.append(url)
+            while not exhausted and len(deferred) < self.max_workers * 4:
+                try:
+                    url = next(url_iter)
+                except StopIteration:
+                    exhausted = True
+                    break
+                if active[url_host(url)] < self.max_per_host:
+                    return url
+                deferred.append(url)
+            return None
+
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            while True:
+                while len(pending) < self.max_workers:
+                    url = next_url()
+                    if url is None:
+                        break
+                    active[url_host(url)] += 1
+                    pending[executor.submit(self._fetch, url, budget)] = url
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    active[url_host(pending.pop(future))] -= 1
+                    result = future.result()
+                    yield result
+                    if result.content is not None:
+                        budget.release(len(result.content))
+        finally:
+            for future in pending:
+                future.cancel()
+            budget.close()
+            executor.shutdown(wait=True)
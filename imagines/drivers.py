@@ -0,0 +1,73 @@
+import json
+import logging
+import os
+from typing import Dict, Optional
+
+from .files import replace_json
+
+logger = logging.getLogger("Dataset Augmentation classes")
+
+DRIVER_TYPES = ('chrome', 'chromium', 'brave')
+
+
+def cache_directory() -> str:
+    """Where ImagineS keeps state shared between runs, ``IMAGINES_CACHE_DIR`` or ``~/.cache/imagines``"""
+    return os.environ.get('IMAGINES_CACHE_DIR') or os.path.join(
+        os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'), 'imagines')
+
+
+def _drivers_file() -> str:
+    return os.path.join(cache_directory(), 'drivers.json')
+
+
+def _load_driver_paths() -> Dict[str, str]:
+    try:
+        with open(_drivers_file()) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_driver_paths(driver_paths: Dict[str, str]) -> None:
+    path = _drivers_file()
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        replace_json(path, driver_paths)
+    except OSError as e:
+        logger.debug(f"Could not cache the driver path - {e}")
+
+
+def cached_driver_path(driver_type: str) -> Optional[str]:
+    """Driver resolved by a previous run, if it is still there"""
+    driver_path = _load_driver_paths().get(driver_type)
+    if driver_path and os.path.exists(driver_path):
+        return driver_path
+    return None
+
+
+def resolve_driver_path(driver_type: str, refresh: bool = False) -> str:
+    """Path of the chromedriver for ``driver_type``.
+
+    webdriver_manager looks the matching driver up online, so its answer is
+    kept in the cache directory and reused until ``refresh`` is asked for.
+    """
+    if driver_type not in DRIVER_TYPES:
+        raise ValueError('Driver type not supported')
+    if not refresh:
+        driver_path = cached_driver_path(driver_type)
+        if driver_path:
+            return driver_path
+
+    from webdriver_manager.chrome import ChromeDriverManager
+    from webdriver_manager.core.utils import ChromeType
+
+    chrome_type = {
+        'chrome': ChromeType.GOOGLE,
+        'chromium': ChromeType.CHROMIUM,
+        'brave': ChromeType.BRAVE,
+    }[driver_type]
+    driver_path = ChromeDriverManager(chrome_type=chrome_type).install()
+    driver_paths = _load_driver_paths()
+    driver_paths[driver_type] = driver_path
+    _save_driver_paths(driver_paths)
+    return driver_path
@@ -0,0 +1,135 @@
+import base64
+import binascii
+import io
+from typing import Callable, NamedTuple, Optional, Tuple
+from urllib.parse import unquote_to_bytes
+
+from PIL import Image
+
+from .http_client import HttpClient
+
+# Content types of servers that do not know what they send, the body decides
+GENERIC_CONTENT_TYPES = ('application/octet-stream', 'binary/octet-stream', 'application/binary')
+
+
+class RejectedResponse(Exception):
+    """A response discarded before it was fully downloaded, ``reason`` says why"""
+
+    def __init__(self, reason: str, message: str):
+        super().__init__(message)
+        self.reason = reason
+
+
+class ImageHeader(NamedTuple):
+    format: str
+    width: int
+    height: int
+
+
+def sniff_image(data: bytes) -> Optional[ImageHeader]:
+    """Reads the format and dimensions from the beginning of an image, None if they are not there (yet)"""
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            return ImageHeader(image.format, image.width, image.height)
+    except Exception:
+        return None
+
+
+def check_content_type(content_type: Optional[str]) -> None:
+    if not content_type:
+        return
+    media_type = content_type.split(';')[0].strip().lower()
+    if not media_type.startswith('image/') and media_type not in GENERIC_CONTENT_TYPES:
+        raise RejectedResponse('content_type', 'Not an image: {}'.format(media_type))
+
+
+def check_dimensions(header: ImageHeader, min_image_size: Optional[Tuple[int, int]]) -> None:
+    if min_image_size is not None and (header.width < min_image_size[0] or header.height < min_image_size[1]):
+        raise RejectedResponse('too_small', 'Image of {}x{} is below {}x{}'.format(
+            header.width, header.height, *min_image_size))
+
+
+def decode_data_url(data_url: str) -> Tuple[str, bytes]:
+    """Splits a ``data:`` URL into its media type and decoded content"""
+    header, separator, data = data_url.partition(',')
+    if not header.startswith('data:') or not separator:
+        raise RejectedResponse('not_an_image', 'Malformed data URL')
+    parameters = header[len('data:'):].split(';')
+    try:
+        if 'base64' in parameters[1:]:
+            content = base64.b64decode(data, validate=True)
+        else:
+            content = unquote_to_bytes(data)
+    except (binascii.Error, ValueError):
+        raise RejectedResponse('not_an_image', 'Undecodable data URL')
+    return parameters[0] or 'text/plain', content
+
+
+def _check_data_url(data_url: str,
+                    max_bytes: int,
+                    min_image_size: Optional[Tuple[int, int]],
+                    reserve: Optional[Callable[[int], None]]) -> bytes:
+    media_type, content = decode_data_url(data_url)
+    check_content_type(media_type)
+    if len(content) > max_bytes:
+        raise RejectedResponse('too_large', 'Body over {} bytes'.format(max_bytes))
+    if reserve is not None:
+        reserve(len(content))
+    header = sniff_image(content)
+    if header is None:
+        raise RejectedResponse('not_an_image', 'No image header in {} bytes'.format(len(content)))
+    check_dimensions(header, min_image_size)
+    return content
+
+
+def fetch_image(http_client: HttpClient,
+                image_url: str,
+                max_bytes: int = 32 * 1024 * 1024,
+                min_image_size: Optional[Tuple[int, int]] = None,
+                sniff_bytes: int = 128 * 1024,
+                chunk_size: int = 64 * 1024,
+                reserve: Optional[Callable[[int], None]] = None) -> bytes:
+    """Downloads an image, giving up as soon as the response turns out not to be one worth keeping.
+
+    The headers are checked first (``Content-Type`` must be an image,
+    ``Content-Length`` at most ``max_bytes``), then the body is streamed: its
+    format and dimensions must be readable within the first ``sniff_bytes``
+    and be at least ``min_image_size``, and it is cut off past ``max_bytes``.
+    Raises RejectedResponse in each of those cases. ``reserve`` is called with
+    the number of bytes held so far, the announced ``Content-Length`` up
+    front and then after every chunk, so that callers can bound the memory of
+    concurrent downloads. ``data:`` URLs, such as
+    the inline thumbnails of result pages, go through the same checks
+    without any request.
+    """
+    if image_url.startswith('data:'):
+        return _check_data_url(image_url, max_bytes, min_image_size, reserve)
+    response = http_client.get(image_url, stream=True)
+    try:
+        response.raise_for_status()
+        check_content_type(response.headers.get('Content-Type'))
+        content_length = response.headers.get('Content-Length')
+        if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+            raise RejectedResponse('too_large', 'Announced {} bytes, over {}'.format(content_length, max_bytes))
+        if reserve is not None and content_length and content_length.isdigit():
+            reserve(int(content_length))
+
+        content = bytearray()
+        header = None
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            content += chunk
+            if len(content) > max_bytes:
+                raise RejectedResponse('too_large', 'Body over {} bytes'.format(max_bytes))
+            if reserve is not None:
+                reserve(len(content))
+            if header is None:
+                header = sniff_image(bytes(content))
+                if header is not None:
+                    check_dimensions(header, min_image_size)
+                elif len(content) >= sniff_bytes:
+                    raise RejectedResponse('not_an_image', 'No image header in the first {} bytes'.format(len(content)))
+        if header is None:
+            raise RejectedResponse('not_an_image', 'No image header in {} bytes'.format(len(content)))
+        return bytes(content)
+    finally:
+        response.close()
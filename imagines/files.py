@@ -0,0 +1,29 @@
+import json
+import os
+import uuid
+from typing import Any, Optional
+
+
+def temporary_path(path: str) -> str:
+    """Name next to ``path`` to write its new content to, unique to the writer"""
+    return '{}.{}.tmp'.format(path, uuid.uuid4().hex)
+
+
+def replace_json(path: str, content: Any, indent: Optional[int] = 2) -> None:
+    """Writes ``content`` to ``path`` atomically, readers find either the previous file or the new one.
+
+    Every writer goes through its own temporary file, so concurrent writers
+    of the same path (threads, processes or hosts) never mix their content:
+    the last rename wins.
+    """
+    tmp_path = temporary_path(path)
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump(content, f, indent=indent)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
@@ -0,0 +1,147 @@
+import email.utils
+import random
+import threading
+import time
+from typing import Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) '
+                  'Chrome/120.0 Safari/537.36',
+}
+
+
+class HttpStats:
+    """Thread-safe counters describing the traffic of an HttpClient."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {
+            'requests': 0,
+            'retries': 0,
+            'new_connections': 0,
+        }
+
+    def add(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def as_dict(self) -> Dict[str, int]:
+        with self._lock:
+            counters = dict(self._counters)
+        counters['reused_connections'] = max(counters['requests'] - counters['new_connections'], 0)
+        return counters
+
+
+def _counting_pool(pool_class, stats: HttpStats):
+    class CountingConnectionPool(pool_class):
+
+        def _new_conn(self):
+            stats.add('new_connections')
+            return super()._new_conn()
+
+    return CountingConnectionPool
+
+
+class _CountingAdapter(HTTPAdapter):
+
+    def __init__(self, stats: HttpStats, **kwargs):
+        self.stats = stats
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            scheme: _counting_pool(pool_class, self.stats)
+            for scheme, pool_class in self.poolmanager.pool_classes_by_scheme.items()
+        }
+
+
+def is_transient(error: BaseException) -> bool:
+    """Whether a failed request may succeed later: connection errors, timeouts, 408, 429 and 5xx responses"""
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return error.response.status_code in (408, 429) or error.response.status_code >= 500
+    return isinstance(error, (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError))
+
+
+class HttpClient:
+    """Pooled HTTP client shared by every download of a DatasetAugmentation.
+
+    Connections are kept alive and reused per host. Connection errors and 5xx
+    responses are retried up to ``max_retries`` times with jittered exponential
+    backoff, and 429 responses honour their ``Retry-After`` header.
+    """
+
+    def __init__(self,
+                 pool_connections: int = 16,
+                 pool_maxsize: int = 8,
+                 max_retries: int = 3,
+                 backoff_factor: float = 0.5,
+                 max_backoff: float = 30,
+                 timeout: float = 10,
+                 headers: Optional[Dict[str, str]] = None):
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.stats = HttpStats()
+
+        self.session = requests.Session()
+        self.session.headers.update(DEFAULT_HEADERS if headers is None else headers)
+        adapter = _CountingAdapter(self.stats,
+                                   pool_connections=pool_connections,
+                                   pool_maxsize=pool_maxsize,
+                                   pool_block=False,
+                                   max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def _backoff(self, attempt: int) -> float:
+        # "Full jitter": spreads retries of many workers hitting the same host
+        return random.uniform(0, min(self.max_backoff, self.backoff_factor * 2 ** attempt))
+
+    def _retry_after(self, response: requests.Response) -> Optional[float]:
+        value = response.headers.get('Retry-After')
+        if not value:
+            return None
+        try:
+            delay = float(value)
+        except ValueError:
+            try:
+                date = email.utils.parsedate_to_datetime(value)
+            except (TypeError, ValueError):
+                return None
+            delay = date.timestamp() - time.time()
+        return min(max(delay, 0), self.max_backoff)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault('timeout', self.timeout)
+        attempt = 0
+        while True:
+            self.stats.add('requests')
+            try:
+                response = self.session.get(url, **kwargs)
+            except requests.exceptions.ConnectionError:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+            else:
+                retryable = response.status_code == 429 or response.status_code >= 500
+                if not retryable or attempt >= self.max_retries:
+                    return response
+                delay = None
+                if response.status_code == 429:
+                    delay = self._retry_after(response)
+                if delay is None:
+                    delay = self._backoff(attempt)
+                response.close()
+
+            attempt += 1
+            self.stats.add('retries')
+            time.sleep(delay)
+
+    def close(self) -> None:
+        self.session.close()
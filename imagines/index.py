@@ -0,0 +1,180 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Iterator, List, NamedTuple, Optional
+
+from .phash import to_signed, to_unsigned
+
+METADATA_DIRNAME = '.imagines'
+# Seconds a shared index waits for the writes of other processes before giving up
+SHARED_TIMEOUT = 60.0
+
+
+class IndexEntry(NamedTuple):
+    sha1: str
+    label: str
+    path: str
+    width: int
+    height: int
+    phash: Optional[int] = None
+
+
+class ImageIndex:
+    """On-disk content-addressed index of the images stored in an output directory.
+
+    Maps source URLs to the full sha1 of the downloaded bytes, and every sha1 to
+    the files holding it per label along with the image dimensions. Paths are
+    stored relative to ``root`` so that the dataset can be moved around. Every
+    lookup is a primary-key hit on a SQLite table, so it stays cheap with
+    millions of entries.
+
+    A ``shared`` index is written by several processes, possibly on a network
+    filesystem: it uses a rollback journal rather than WAL, which needs shared
+    memory between the writers, and commits every change right away so that
+    the database is only locked for the duration of a single write.
+    """
+
+    def __init__(self, root: str, path: Optional[str] = None, shared: bool = False):
+        self.root = root
+        self.path = path or os.path.join(root, METADATA_DIRNAME, 'index.sqlite')
+        self.shared = shared
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.RLock()
+        if shared:
+            # Autocommit, waiting for the writes of the other processes
+            self._connection = sqlite3.connect(self.path, timeout=SHARED_TIMEOUT, check_same_thread=False,
+                                               isolation_level=None)
+            self._connection.execute('PRAGMA journal_mode=DELETE')
+        else:
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS urls (
+                url TEXT PRIMARY KEY,
+                sha1 TEXT NOT NULL
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS files (
+                sha1 TEXT NOT NULL,
+                label TEXT NOT NULL,
+                path TEXT NOT NULL,
+                width INTEGER,
+                height INTEGER,
+                phash INTEGER,
+                PRIMARY KEY (sha1, label)
+            ) WITHOUT ROWID;
+            CREATE UNIQUE INDEX IF NOT EXISTS files_path ON files (path);
+        """)
+        columns = [row[1] for row in self._connection.execute('PRAGMA table_info(files)')]
+        if 'phash' not in columns:
+            try:
+                self._connection.execute('ALTER TABLE files ADD COLUMN phash INTEGER')
+            except sqlite3.OperationalError:
+                # Added by another process opening the index at the same time
+                columns = [row[1] for row in self._connection.execute('PRAGMA table_info(files)')]
+                if 'phash' not in columns:
+                    raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _absolute(self, entry: tuple) -> IndexEntry:
+        sha1, label, path, width, height, phash = entry
+        return IndexEntry(sha1, label, os.path.join(self.root, path), width, height,
+                          None if phash is None else to_unsigned(phash))
+
+    def lookup_url(self, url: str) -> Optional[str]:
+        with self._lock:
+            row = self._connection.execute('SELECT sha1 FROM urls WHERE url = ?', (url,)).fetchone()
+        return row[0] if row else None
+
+    def lookup(self, sha1: str, label: Optional[str] = None) -> Optional[IndexEntry]:
+        """Returns a stored copy of ``sha1``, preferring the one filed under ``label``"""
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT sha1, label, path, width, height, phash FROM files WHERE sha1 = ?', (sha1,)).fetchall()
+        entries = [self._absolute(row) for row in rows if os.path.exists(os.path.join(self.root, row[2]))]
+        for entry in entries:
+            if entry.label == label:
+                return entry
+        return entries[0] if entries else None
+
+    def owner(self, path: str) -> Optional[str]:
+        """Returns the sha1 stored at ``path``, if any"""
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT sha1 FROM files WHERE path = ?', (os.path.relpath(path, self.root),)).fetchone()
+        return row[0] if row else None
+
+    def entries(self, label: str) -> List[IndexEntry]:
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT sha1, label, path, width, height, phash FROM files WHERE label = ?', (label,)).fetchall()
+        return [self._absolute(row) for row in rows]
+
+    def phashes(self, label: Optional[str] = None) -> List[int]:
+        """Perceptual hashes stored for ``label``, or for every label"""
+        query = 'SELECT phash FROM files WHERE phash IS NOT NULL'
+        with self._lock:
+            if label is None:
+                rows = self._connection.execute(query).fetchall()
+            else:
+                rows = self._connection.execute(query + ' AND label = ?', (label,)).fetchall()
+        return [to_unsigned(row[0]) for row in rows]
+
+    def add_url(self, url: str, sha1: str) -> None:
+        with self._lock:
+            self._connection.execute('INSERT OR REPLACE INTO urls VALUES (?, ?)', (url, sha1))
+
+    def add(self,
+            sha1: str,
+            label: str,
+            path: str,
+            width: int,
+            height: int,
+            url: Optional[str] = None,
+            phash: Optional[int] = None) -> None:
+        relative_path = os.path.relpath(path, self.root)
+        with self._lock, self._transaction():
+            self._connection.execute('DELETE FROM files WHERE path = ?', (relative_path,))
+            self._connection.execute(
+                'INSERT OR REPLACE INTO files (sha1, label, path, width, height, phash) VALUES (?, ?, ?, ?, ?, ?)',
+                (sha1, label, relative_path, width, height, None if phash is None else to_signed(phash)))
+            if url is not None:
+                self.add_url(url, sha1)
+
+    @contextmanager
+    def _transaction(self) -> Iterator[None]:
+        # Statements of a shared index are committed on their own, keep the ones of a single change together
+        if not self.shared or self._connection.in_transaction:
+            yield
+            return
+        self._connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except BaseException:
+            self._connection.rollback()
+            raise
+        self._connection.commit()
+
+    def remove_label(self, label: str) -> None:
+        with self._lock:
+            self._connection.execute('DELETE FROM files WHERE label = ?', (label,))
+            self._connection.commit()
+
+    def commit(self) -> None:
+        with self._lock:
+            self._connection.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.commit()
+            self._connection.close()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute('SELECT COUNT(*) FROM files').fetchone()[0]
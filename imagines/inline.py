@@ -0,0 +1,66 @@
+import hashlib
+import os
+from typing import Optional
+
+from .files import temporary_path
+
+# Stands for a data: URL wherever URLs are recorded, the payload itself is kept apart
+INLINE_KEY_PREFIX = 'data:sha1:'
+
+
+def is_inline_key(url: str) -> bool:
+    # Actual data: URLs always have a comma between their media type and their data
+    return url.startswith(INLINE_KEY_PREFIX) and ',' not in url
+
+
+def url_key(url: str) -> str:
+    """Key recording ``url``: the URL itself, or a digest for ``data:`` URLs, which hold a whole image"""
+    if not url.startswith('data:') or is_inline_key(url):
+        return url
+    return INLINE_KEY_PREFIX + hashlib.sha1(url.encode()).hexdigest()
+
+
+class InlineStore:
+    """``data:`` URLs found by searches and not stored yet, one file per key under ``directory``.
+
+    Manifests only record the key of a ``data:`` URL, this is where a resumed
+    run finds the data to decode. Each file is written once, and removed as
+    soon as the outcome of its URL is final.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[len(INLINE_KEY_PREFIX):])
+
+    def put(self, url: str) -> str:
+        key = url_key(url)
+        path = self._path(key)
+        if not os.path.exists(path):
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = temporary_path(path)
+            try:
+                with open(tmp_path, 'w') as f:
+                    f.write(url)
+                os.replace(tmp_path, path)
+            except BaseException:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+                raise
+        return key
+
+    def get(self, key: str) -> Optional[str]:
+        try:
+            with open(self._path(key)) as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def discard(self, key: str) -> None:
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
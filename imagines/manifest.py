@@ -0,0 +1,195 @@
+import json
+import os
+import shutil
+import time
+from typing import Dict, Iterable, List, Optional
+
+from .files import replace_json
+from .index import METADATA_DIRNAME
+from .inline import InlineStore, is_inline_key, url_key
+
+# Runs a URL may fail on transient errors before it is skipped, dead hosts fail that way too
+MAX_DOWNLOAD_ATTEMPTS = 3
+
+
+class QueryManifest:
+    """Progress of a single query of a label: the URLs it found and what happened to each of them.
+
+    Saved URLs map to the stored file name, skipped URLs (rejected or missing
+    content, undecodable content, near duplicates) map to the reason they were
+    dropped. Both are final, only the remaining URLs are downloaded when
+    resuming. Failed URLs map to the number of runs their download failed
+    on transient errors, they are retried until ``MAX_DOWNLOAD_ATTEMPTS``
+    and then skipped. ``data:`` URLs are
+    recorded under their ``url_key``, their data is kept in ``inline`` until
+    their outcome is final.
+    """
+
+    def __init__(self, data: Optional[dict] = None, on_change=None, inline: Optional[InlineStore] = None):
+        data = data or {}
+        self._inline = inline
+        # data: URLs found during this run by key, what the search cache keeps of them
+        self.inline_urls: Dict[str, str] = {}
+        self.max_links_to_fetch: int = data.get('max_links_to_fetch', 0)
+        self.searched: bool = data.get('searched', False)
+        # Manifests written before keys were used hold whole data: URLs
+        self.saved: Dict[str, str] = {url_key(url): name for url, name in data.get('saved', {}).items()}
+        self.skipped: Dict[str, str] = {url_key(url): reason for url, reason in data.get('skipped', {}).items()}
+        self.failed: Dict[str, int] = data.get('failed', {})
+        self.urls: List[str] = []
+        self._known = set()
+        for url in data.get('urls', []):
+            self._add(url)
+        self._on_change = on_change
+
+    def to_dict(self) -> dict:
+        return {
+            'max_links_to_fetch': self.max_links_to_fetch,
+            'searched': self.searched,
+            'urls': self.urls,
+            'saved': self.saved,
+            'skipped': self.skipped,
+            'failed': self.failed,
+        }
+
+    def needs_search(self, max_links_to_fetch: int) -> bool:
+        # A previous search for as many links (or more) already found everything there was
+        return not self.searched or self.max_links_to_fetch < max_links_to_fetch
+
+    def _add(self, url: str) -> bool:
+        key = url_key(url)
+        if key in self._known:
+            return False
+        self._known.add(key)
+        self.urls.append(key)
+        if key != url:
+            self.inline_urls[key] = url
+            if self._inline is not None and key not in self.saved and key not in self.skipped:
+                self._inline.put(url)
+        return True
+
+    def add_url(self, url: str) -> bool:
+        """Records a URL found by a search still in progress, returns whether it is new"""
+        if not self._add(url):
+            return False
+        self._changed()
+        return True
+
+    def mark_searched(self, max_links_to_fetch: int) -> None:
+        self.max_links_to_fetch = max(self.max_links_to_fetch, max_links_to_fetch)
+        self.searched = True
+        self._changed()
+
+    def pending_urls(self) -> List[str]:
+        return [url for url in self.urls if url not in self.saved and url not in self.skipped]
+
+    def url(self, key: str) -> Optional[str]:
+        """URL to download for a recorded ``key``, None for a ``data:`` URL whose data is gone"""
+        if not is_inline_key(key):
+            return key
+        url = self.inline_urls.get(key)
+        if url is None and self._inline is not None:
+            url = self._inline.get(key)
+            if url is not None:
+                self.inline_urls[key] = url
+        return url
+
+    def pending_downloads(self) -> List[str]:
+        """URLs left to download, ``data:`` URLs whose data is gone are skipped instead"""
+        image_urls = []
+        for key in self.pending_urls():
+            image_url = self.url(key)
+            if image_url is None:
+                self.mark_skipped(key, 'missing')
+            else:
+                image_urls.append(image_url)
+        return image_urls
+
+    def search_results(self) -> List[str]:
+        """URLs found so far, the ``data:`` URLs found during this run included"""
+        return [self.inline_urls.get(key, key) for key in self.urls]
+
+    def is_complete(self, max_links_to_fetch: int) -> bool:
+        return not self.needs_search(max_links_to_fetch) and not self.pending_urls()
+
+    def mark_saved(self, url: str, file_path: str) -> None:
+        key = url_key(url)
+        self.saved[key] = os.path.basename(file_path)
+        self._finished(key)
+
+    def mark_skipped(self, url: str, reason: str) -> None:
+        key = url_key(url)
+        self.skipped[key] = reason
+        self._finished(key)
+
+    def mark_failed(self, url: str) -> bool:
+        """Records a transient download failure, returns whether the URL was skipped for failing too often"""
+        key = url_key(url)
+        attempts = self.failed.get(key, 0) + 1
+        if attempts >= MAX_DOWNLOAD_ATTEMPTS:
+            self.mark_skipped(key, 'download')
+            return True
+        self.failed[key] = attempts
+        self._changed()
+        return False
+
+    def _finished(self, key: str) -> None:
+        self.failed.pop(key, None)
+        if self._inline is not None and is_inline_key(key):
+            self._inline.discard(key)
+        self._changed()
+
+    def _changed(self) -> None:
+        if self._on_change is not None:
+            self._on_change()
+
+
+class LabelManifest:
+    """Per-label record of the queries run so far, stored under ``<output_directory>/.imagines/manifests``.
+
+    Changes are flushed to disk at most every ``save_interval`` seconds (and
+    on ``save``), with an atomic replace, so an interrupted run can be resumed
+    from the last flush.
+    """
+
+    def __init__(self, output_directory: str, label: str, save_interval: float = 1.0):
+        self.label = label
+        self.path = os.path.join(output_directory, METADATA_DIRNAME, 'manifests', label + '.json')
+        self.inline = InlineStore(os.path.join(output_directory, METADATA_DIRNAME, 'inline', label))
+        self.save_interval = save_interval
+        self.queries: Dict[str, QueryManifest] = {}
+        self._last_save = 0.0
+        self.exists = os.path.exists(self.path)
+        if self.exists:
+            with open(self.path) as f:
+                data = json.load(f)
+            self.queries = {query: QueryManifest(entry, self.maybe_save, self.inline)
+                            for query, entry in data.get('queries', {}).items()}
+
+    def query(self, query: str) -> QueryManifest:
+        if query not in self.queries:
+            self.queries[query] = QueryManifest(on_change=self.maybe_save, inline=self.inline)
+        return self.queries[query]
+
+    def is_complete(self, queries: Iterable[str], max_links_to_fetch: int) -> bool:
+        return all(query in self.queries and self.queries[query].is_complete(max_links_to_fetch)
+                   for query in queries)
+
+    def reset(self) -> None:
+        self.queries = {}
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        shutil.rmtree(self.inline.directory, ignore_errors=True)
+        self.exists = False
+
+    def maybe_save(self) -> None:
+        if time.monotonic() - self._last_save >= self.save_interval:
+            self.save()
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        replace_json(self.path, {'label': self.label,
+                                 'queries': {query: entry.to_dict() for query, entry in self.queries.items()}},
+                     indent=None)
+        self._last_save = time.monotonic()
+        self.exists = True
@@ -0,0 +1,197 @@
+import json
+import threading
+import time
+from collections import Counter
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional
+
+import requests
+
+from .fetch import RejectedResponse
+
+STAGES = ('search', 'download', 'decode', 'resize', 'encode', 'write', 'cache_load')
+
+
+class MetricEvent(NamedTuple):
+    stage: str
+    seconds: float
+    bytes: int
+    # Failure reason, None when the stage succeeded
+    error: Optional[str]
+
+
+def failure_reason(error: BaseException) -> str:
+    """Short, low-cardinality name for why a stage failed"""
+    if isinstance(error, RejectedResponse):
+        return error.reason
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return 'http_{}'.format(error.response.status_code)
+    return type(error).__name__
+
+
+class StageStats:
+
+    def __init__(self):
+        self.succeeded = 0
+        self.failed = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.bytes = 0
+        self.failures: Counter = Counter()
+
+    def to_dict(self) -> dict:
+        return {
+            'succeeded': self.succeeded,
+            'failed': self.failed,
+            'seconds': round(self.seconds, 6),
+            'max_seconds': round(self.max_seconds, 6),
+            'bytes': self.bytes,
+            'failures': dict(self.failures),
+        }
+
+
+class _Timer:
+    """Times a ``with`` block; set ``bytes`` inside it to count what the stage handled"""
+
+    def __init__(self, metrics: 'Metrics', stage: str):
+        self.metrics = metrics
+        self.stage = stage
+        self.bytes = 0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        error = failure_reason(exc_value) if exc_value is not None else None
+        self.metrics.record(self.stage, time.perf_counter() - self._start, self.bytes, error)
+        return False
+
+
+class _NullTimer:
+    bytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class RunReport:
+    """Snapshot of the metrics of a run, exportable as JSON or in the Prometheus text format"""
+
+    def __init__(self, stages: Dict[str, dict], counters: Dict[str, int], seconds: float):
+        self.stages = stages
+        self.counters = counters
+        self.seconds = seconds
+
+    def to_dict(self) -> dict:
+        return {'seconds': round(self.seconds, 6), 'stages': self.stages, 'counters': self.counters}
+
+    def to_json(self, **kwargs) -> str:
+        return json.dumps(self.to_dict(), **kwargs)
+
+    def to_prometheus(self, prefix: str = 'imagines') -> str:
+        lines: List[str] = []
+
+        def metric(name: str, kind: str, help_text: str, samples: Iterable):
+            samples = list(samples)
+            if not samples:
+                return
+            lines.append('# HELP {}_{} {}'.format(prefix, name, help_text))
+            lines.append('# TYPE {}_{} {}'.format(prefix, name, kind))
+            for labels, value in samples:
+                label_text = ','.join('{}="{}"'.format(key, value) for key, value in labels.items())
+                lines.append('{}_{}{{{}}} {}'.format(prefix, name, label_text, value))
+
+        stages = sorted(self.stages.items())
+        metric('stage_seconds_total', 'counter', 'Time spent in each stage.',
+               (({'stage': stage}, stats['seconds']) for stage, stats in stages))
+        metric('stage_max_seconds', 'gauge', 'Longest single run of each stage.',
+               (({'stage': stage}, stats['max_seconds']) for stage, stats in stages))
+        metric('stage_bytes_total', 'counter', 'Bytes handled by each stage.',
+               (({'stage': stage}, stats['bytes']) for stage, stats in stages))
+        metric('stage_runs_total', 'counter', 'Runs of each stage by outcome.',
+               (({'stage': stage, 'outcome': outcome}, stats[outcome])
+                for stage, stats in stages for outcome in ('succeeded', 'failed')))
+        metric('stage_failures_total', 'counter', 'Failed runs of each stage by reason.',
+               (({'stage': stage, 'reason': reason}, count)
+                for stage, stats in stages for reason, count in sorted(stats['failures'].items())))
+        metric('events_total', 'counter', 'Other events of the run.',
+               (({'event': name}, count) for name, count in sorted(self.counters.items())))
+        metric('run_seconds', 'gauge', 'Wall time covered by the report.', [({}, round(self.seconds, 6))])
+        return '\n'.join(lines) + '\n'
+
+
+class Metrics:
+    """Thread-safe per-stage timers, byte counters and failure reasons of DatasetAugmentation runs.
+
+    Every recorded stage run is also passed to the ``hooks``, as a
+    MetricEvent, on the thread that recorded it.
+    """
+
+    enabled = True
+
+    def __init__(self, hooks: Iterable[Callable[[MetricEvent], None]] = ()):
+        self.hooks = list(hooks)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stages: Dict[str, StageStats] = {}
+            self._counters: Counter = Counter()
+            self._start = time.perf_counter()
+
+    def add_hook(self, hook: Callable[[MetricEvent], None]) -> None:
+        self.hooks.append(hook)
+
+    def time(self, stage: str) -> _Timer:
+        """Records a stage run around a ``with`` block, as failed if the block raises"""
+        return _Timer(self, stage)
+
+    def record(self, stage: str, seconds: float = 0.0, nbytes: int = 0, error: Optional[str] = None) -> None:
+        with self._lock:
+            stats = self._stages.get(stage)
+            if stats is None:
+                stats = self._stages[stage] = StageStats()
+            if error is None:
+                stats.succeeded += 1
+            else:
+                stats.failed += 1
+                stats.failures[error] += 1
+            stats.seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+            stats.bytes += nbytes
+        if self.hooks:
+            event = MetricEvent(stage, seconds, nbytes, error)
+            for hook in self.hooks:
+                hook(event)
+
+    def increment(self, name: str, count: int = 1) -> None:
+        with self._lock:
+            self._counters[name] += count
+
+    def report(self) -> RunReport:
+        with self._lock:
+            return RunReport(stages={stage: stats.to_dict() for stage, stats in self._stages.items()},
+                             counters=dict(self._counters),
+                             seconds=time.perf_counter() - self._start)
+
+
+class NullMetrics(Metrics):
+    """Metrics that record nothing, the default of DatasetAugmentation"""
+
+    enabled = False
+
+    def time(self, stage: str) -> _NullTimer:
+        return _NULL_TIMER
+
+    def record(self, stage: str, seconds: float = 0.0, nbytes: int = 0, error: Optional[str] = None) -> None:
+        pass
+
+    def increment(self, name: str, count: int = 1) -> None:
+        pass
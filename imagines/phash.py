@@ -0,0 +1,112 @@
+from typing import Iterable
+
+import numpy as np
+from PIL import Image
+
+HASH_SIZE = 8
+_SAMPLE_SIZE = 32
+_UINT64_MASK = (1 << 64) - 1
+# Masks of the SWAR popcount, for numpy versions without bitwise_count
+_M1 = np.uint64(0x5555555555555555)
+_M2 = np.uint64(0x3333333333333333)
+_M4 = np.uint64(0x0f0f0f0f0f0f0f0f)
+_H01 = np.uint64(0x0101010101010101)
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.sqrt(2 / n) * np.cos(np.pi * (2 * i + 1) * k / (2 * n))
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+
+_DCT = _dct_matrix(_SAMPLE_SIZE)
+
+
+def perceptual_hash(image: Image.Image) -> int:
+    """64-bit DCT perceptual hash, stable under resizing and recompression"""
+    pixels = np.asarray(image.convert('L').resize((_SAMPLE_SIZE, _SAMPLE_SIZE), Image.LANCZOS),
+                        dtype=np.float64)
+    low_frequencies = (_DCT @ pixels @ _DCT.T)[:HASH_SIZE, :HASH_SIZE].flatten()
+    # The DC term only carries the average brightness, keep it out of the median
+    bits = low_frequencies > np.median(low_frequencies[1:])
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+def swar_popcount(values: np.ndarray) -> np.ndarray:
+    """Set bits of every uint64 of ``values``, counted in place with word-parallel arithmetic"""
+    shifted = np.empty_like(values)
+    np.right_shift(values, np.uint64(1), out=shifted)
+    shifted &= _M1
+    values -= shifted
+    np.right_shift(values, np.uint64(2), out=shifted)
+    shifted &= _M2
+    values &= _M2
+    values += shifted
+    np.right_shift(values, np.uint64(4), out=shifted)
+    values += shifted
+    values &= _M4
+    values *= _H01
+    values >>= np.uint64(56)
+    return values
+
+
+def hamming_distances(hashes: np.ndarray, image_hash: int) -> np.ndarray:
+    xor = np.bitwise_xor(hashes, np.uint64(image_hash))
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(xor)
+    return swar_popcount(xor)
+
+
+def to_signed(image_hash: int) -> int:
+    """Maps an unsigned 64-bit hash into SQLite's signed INTEGER range"""
+    return image_hash - (1 << 64) if image_hash >= 1 << 63 else image_hash
+
+
+def to_unsigned(image_hash: int) -> int:
+    return image_hash & _UINT64_MASK
+
+
+class PerceptualHashIndex:
+    """Packed array of 64-bit perceptual hashes answering near-duplicate queries.
+
+    An image is a near duplicate when the Hamming distance between its hash and
+    any stored hash is at most ``threshold`` bits. Queries are a single
+    vectorized XOR and popcount over the packed array.
+    """
+
+    def __init__(self, threshold: int = 6, hashes: Iterable[int] = ()):
+        self.threshold = threshold
+        self._hashes = np.zeros(1024, dtype=np.uint64)
+        self._size = 0
+        for image_hash in hashes:
+            self.add(image_hash)
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def hashes(self) -> np.ndarray:
+        return self._hashes[:self._size]
+
+    def add(self, image_hash: int) -> None:
+        if self._size == len(self._hashes):
+            self._hashes = np.concatenate([self._hashes, np.zeros_like(self._hashes)])
+        self._hashes[self._size] = image_hash
+        self._size += 1
+
+    def nearest_distance(self, image_hash: int) -> int:
+        if not self._size:
+            return 64 + 1
+        return int(hamming_distances(self.hashes, image_hash).min())
+
+    def contains(self, image_hash: int) -> bool:
+        return self.nearest_distance(image_hash) <= self.threshold
+
+    def add_if_new(self, image_hash: int) -> bool:
+        """Stores the hash unless it is a near duplicate, returns whether it was stored"""
+        if self.contains(image_hash):
+            return False
+        self.add(image_hash)
+        return True
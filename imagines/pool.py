@@ -0,0 +1,333 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, List, Optional, Set, Tuple
+
+logger = logging.getLogger("Dataset Augmentation classes")
+
+_DONE = object()
+
+
+class SearchStream:
+    """URLs of a search running on the pool, handed over through a bounded queue as they are found.
+
+    Iterating blocks until the next URL is found and raises the error of the
+    search if it failed. Once the queue holds ``maxsize`` URLs the search waits
+    for the consumer to catch up.
+    """
+
+    def __init__(self, query: str, maxsize: int = 0, thumbnail_size: Optional[Tuple[int, int]] = None):
+        self.query = query
+        # Results whose thumbnail is at least this size come as their thumbnail
+        self.thumbnail_size = thumbnail_size
+        self._queue: queue.Queue = queue.Queue(maxsize)
+        self._cancelled = threading.Event()
+        self.error: Optional[BaseException] = None
+        self.future: Optional[Future] = None
+        # Time the search took, once it is over
+        self.seconds = 0.0
+
+    def __iter__(self) -> Iterator[str]:
+        while True:
+            item = self._queue.get()
+            if item is _DONE:
+                if self.error is not None:
+                    raise self.error
+                return
+            yield item
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def put(self, url: str) -> bool:
+        """Hands a URL over to the consumer, returns False once the stream is cancelled"""
+        while not self._cancelled.is_set():
+            try:
+                self._queue.put(url, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        self.error = error
+        while True:
+            try:
+                self._queue.put(_DONE, timeout=0.1)
+                return
+            except queue.Full:
+                # Nobody reads a cancelled stream anymore, make room for the end marker
+                if self._cancelled.is_set():
+                    try:
+                        self._queue.get_nowait()
+                    except queue.Empty:
+                        pass
+
+    def drain(self) -> Tuple[List[str], bool]:
+        """Takes the URLs not consumed yet without blocking, along with whether the search completed"""
+        urls = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return urls, False
+            if item is _DONE:
+                return urls, self.error is None
+            urls.append(item)
+
+    def cancel(self) -> None:
+        self._cancelled.set()
+        if self.future is not None and self.future.cancel():
+            self.finish(RuntimeError(f'Search for {self.query} was cancelled'))
+
+
+class ScraperPool:
+    """Runs searches concurrently over a pool of up to ``size`` scraper sessions.
+
+    Sessions are created lazily with ``factory`` (each one is a browser, so
+    they start in parallel on the worker threads). A session whose search
+    raises, or takes longer than ``search_timeout`` seconds, is closed and
+    replaced by a new one, and the search is retried up to ``max_attempts``
+    times. ``sessions`` are adopted as already created sessions: they are used
+    by the pool but not closed by it, unless they fail, in which case
+    ``on_discard`` is called with the session once it is closed.
+    """
+
+    def __init__(self,
+                 factory: Callable,
+                 size: int = 1,
+                 sessions: Iterable = (),
+                 search_timeout: Optional[float] = None,
+                 max_attempts: int = 2,
+                 on_discard: Optional[Callable] = None):
+        if size < 1:
+            raise ValueError('The pool needs at least one session')
+        self.factory = factory
+        self.size = size
+        self.search_timeout = search_timeout
+        self.max_attempts = max_attempts
+        self.on_discard = on_discard
+        self._lock = threading.Lock()
+        self._idle: queue.Queue = queue.Queue()
+        self._sessions: List = []
+        self._adopted: Set[int] = set()
+        self._timed_out: Set[int] = set()
+        self._starting = 0
+        self._futures: Set[Future] = set()
+        self._streams: Set[SearchStream] = set()
+        for session in list(sessions)[:size]:
+            self._sessions.append(session)
+            self._adopted.add(id(session))
+            self._idle.put(session)
+        self._executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix='imagines-search')
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def sessions(self) -> List:
+        with self._lock:
+            return list(self._sessions)
+
+    def _checkout(self):
+        # There are as many worker threads as sessions, so a worker either finds an idle
+        # session or there is room left to create one
+        with self._lock:
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                pass
+            create = len(self._sessions) + self._starting < self.size
+            if create:
+                self._starting += 1
+        if not create:
+            return self._idle.get()
+        try:
+            session = self.factory()
+        finally:
+            with self._lock:
+                self._starting -= 1
+        with self._lock:
+            self._sessions.append(session)
+        return session
+
+    def _close_session(self, session) -> None:
+        try:
+            session.close_session()
+        except Exception as e:
+            logger.debug(f"Could not close scraper session - {e}")
+
+    def _discard(self, session) -> None:
+        with self._lock:
+            if session in self._sessions:
+                self._sessions.remove(session)
+            self._timed_out.discard(id(session))
+            adopted = id(session) in self._adopted
+            self._adopted.discard(id(session))
+        self._close_session(session)
+        if adopted and self.on_discard is not None:
+            self.on_discard(session)
+
+    def _time_out(self, session) -> None:
+        logger.warning(f"Scraper session timed out after {self.search_timeout}s, recycling it")
+        with self._lock:
+            self._timed_out.add(id(session))
+        # Quitting the browser makes the blocked call return with an error
+        self._close_session(session)
+
+    def _search(self,
+                query: str,
+                max_links_to_fetch: int,
+                sleep_between_interactions: float,
+                stream: Optional[SearchStream] = None):
+        error = None
+        # URLs already handed over by an attempt that failed half way
+        emitted = set()
+        for _ in range(self.max_attempts):
+            if self._closed:
+                break
+            try:
+                session = self._checkout()
+            except Exception as e:
+                error = e
+                logger.warning(f"ERROR - Could not start a scraper session - {e}")
+                continue
+            timer = None
+            if self.search_timeout is not None:
+                timer = threading.Timer(self.search_timeout, self._time_out, [session])
+                timer.daemon = True
+                timer.start()
+            try:
+                if stream is None:
+                    image_urls = session.search_images(
+                        query=query,
+                        max_links_to_fetch=max_links_to_fetch,
+                        sleep_between_interactions=sleep_between_interactions)
+                else:
+                    image_urls = self._stream_search(session, stream, emitted, query, max_links_to_fetch,
+                                                     sleep_between_interactions, stream.thumbnail_size)
+            except Exception as e:
+                error = e
+                logger.warning(f"ERROR - Search for {query} failed, recycling the session - {e}")
+                self._discard(session)
+                continue
+            finally:
+                if timer is not None:
+                    timer.cancel()
+            if id(session) in self._timed_out:
+                error = TimeoutError(f"Search for {query} timed out")
+                self._discard(session)
+                continue
+            self._idle.put(session)
+            return image_urls
+        raise error or RuntimeError('The scraper pool is closed')
+
+    @staticmethod
+    def _stream_search(session,
+                       stream: SearchStream,
+                       emitted: Set[str],
+                       query: str,
+                       max_links_to_fetch: int,
+                       sleep_between_interactions: float,
+                       thumbnail_size: Optional[Tuple[int, int]] = None) -> Set[str]:
+        if thumbnail_size is None:
+            image_urls = session.iter_images(
+                query=query,
+                max_links_to_fetch=max_links_to_fetch,
+                sleep_between_interactions=sleep_between_interactions)
+        else:
+            image_urls = session.iter_thumbnails(
+                query=query,
+                max_links_to_fetch=max_links_to_fetch,
+                min_size=thumbnail_size,
+                sleep_between_interactions=sleep_between_interactions)
+        try:
+            for url in image_urls:
+                if url in emitted:
+                    continue
+                if not stream.put(url):
+                    break
+                emitted.add(url)
+        finally:
+            # Backends only promise an iterator, generators are stopped right away
+            close = getattr(image_urls, 'close', None)
+            if close is not None:
+                close()
+        return emitted
+
+    def _run_stream(self,
+                    stream: SearchStream,
+                    query: str,
+                    max_links_to_fetch: int,
+                    sleep_between_interactions: float) -> None:
+        start = time.perf_counter()
+        try:
+            self._search(query, max_links_to_fetch, sleep_between_interactions, stream)
+        except BaseException as e:
+            stream.seconds = time.perf_counter() - start
+            stream.finish(e)
+            raise
+        stream.seconds = time.perf_counter() - start
+        # A search stopped half way by its consumer did not find everything there was
+        stream.finish(RuntimeError(f'Search for {query} was cancelled') if stream.cancelled else None)
+
+    def submit(self, query: str, max_links_to_fetch: int, sleep_between_interactions: float = 1) -> Future:
+        future = self._executor.submit(self._search, query, max_links_to_fetch, sleep_between_interactions)
+        with self._lock:
+            self._futures.add(future)
+        future.add_done_callback(self._forget_future)
+        return future
+
+    def stream(self,
+               query: str,
+               max_links_to_fetch: int,
+               sleep_between_interactions: float = 1,
+               maxsize: int = 0,
+               thumbnail_size: Optional[Tuple[int, int]] = None) -> SearchStream:
+        """Starts a search whose URLs can be consumed while the session keeps scrolling.
+
+        With ``thumbnail_size`` the session hands over the thumbnail of every
+        result that is at least that large, see ``SearchBackend.iter_thumbnails``.
+        """
+        stream = SearchStream(query, maxsize, thumbnail_size)
+        stream.future = self._executor.submit(
+            self._run_stream, stream, query, max_links_to_fetch, sleep_between_interactions)
+        with self._lock:
+            self._futures.add(stream.future)
+            self._streams.add(stream)
+        stream.future.add_done_callback(lambda future: self._forget_stream(stream))
+        return stream
+
+    def _forget_stream(self, stream: SearchStream) -> None:
+        with self._lock:
+            self._futures.discard(stream.future)
+            self._streams.discard(stream)
+
+    def _forget_future(self, future: Future) -> None:
+        with self._lock:
+            self._futures.discard(future)
+
+    def close(self) -> None:
+        """Cancels the pending searches and shuts down every session the pool created"""
+        self._closed = True
+        with self._lock:
+            futures = list(self._futures)
+            streams = list(self._streams)
+        for stream in streams:
+            stream.cancel()
+        for future in futures:
+            future.cancel()
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            sessions = self._sessions
+            self._sessions = []
+        for session in sessions:
+            if id(session) not in self._adopted:
+                self._close_session(session)
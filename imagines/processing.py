@@ -0,0 +1,262 @@
+import io
+import numbers
+import os
+import time
+from typing import Callable, Dict, NamedTuple, Optional, Sequence, Tuple
+
+from PIL import Image
+
+from .phash import perceptual_hash
+
+# Ratio between consecutive downscaling steps when shrinking with Image.reduce
+REDUCING_GAP = 3.0
+# How images are brought to a shape of another aspect ratio: distorted, padded or cropped
+ASPECT_MODES = ('stretch', 'fit', 'crop')
+# Formats images are encoded to, with the extension of their files
+ENCODE_FORMATS = {
+    'jpeg': ('JPEG', '.jpg'),
+    'png': ('PNG', '.png'),
+    'webp': ('WEBP', '.webp'),
+}
+# Downloaded formats that can be stored as they are, and the modes they may have for that
+ORIGINAL_EXTENSIONS = {
+    'JPEG': '.jpg',
+    'PNG': '.png',
+    'WEBP': '.webp',
+    'GIF': '.gif',
+}
+ORIGINAL_MODES = ('RGB', 'RGBA', 'L', 'LA', 'P')
+
+
+class ProcessedImage(NamedTuple):
+    content: bytes
+    width: int
+    height: int
+    phash: Optional[int]
+    # Raw RGB pixels of the output, only filled in when the caller wants the image back
+    pixels: Optional[bytes]
+    size: Tuple[int, int]
+    # Seconds spent decoding, hashing, resizing and encoding, reported back to the parent process
+    timings: Optional[Dict[str, float]] = None
+    # Encoded copies at each of the extra shapes, in the order they were asked for
+    variants: Optional[Tuple[bytes, ...]] = None
+    # Extension matching the format of ``content``
+    extension: str = '.jpg'
+
+    def to_image(self) -> Image.Image:
+        if self.pixels is not None:
+            return Image.frombytes('RGB', self.size, self.pixels)
+        with Image.open(io.BytesIO(self.content)) as image:
+            return image.convert('RGB')
+
+
+def is_shape(image_shape) -> bool:
+    """Whether ``image_shape`` is a single ``(width, height)`` rather than a list of them"""
+    return len(image_shape) == 2 and all(isinstance(size, numbers.Integral) for size in image_shape)
+
+
+def _shape(image_shape) -> Tuple[int, int]:
+    width, height = image_shape
+    return int(width), int(height)
+
+
+def split_shapes(image_shapes) -> Tuple[Optional[Tuple[int, int]], Tuple[Tuple[int, int], ...]]:
+    """Splits one shape or a list of shapes into the first one and the others"""
+    if image_shapes is None:
+        return None, ()
+    if is_shape(image_shapes):
+        return _shape(image_shapes), ()
+    shapes = [_shape(image_shape) for image_shape in image_shapes]
+    if not shapes:
+        raise ValueError('At least one image shape is needed')
+    return shapes[0], tuple(shapes[1:])
+
+
+def check_aspect_mode(aspect_mode: str) -> None:
+    if aspect_mode not in ASPECT_MODES:
+        raise ValueError('aspect_mode must be one of {}'.format(', '.join(ASPECT_MODES)))
+
+
+def check_encode_format(encode_format: str) -> None:
+    if encode_format not in ENCODE_FORMATS:
+        raise ValueError('encode_format must be one of {}'.format(', '.join(ENCODE_FORMATS)))
+
+
+def draft(image: Image.Image, image_shape: Optional[Tuple[int, int]], mode: Optional[str] = 'RGB') -> None:
+    """Lets the JPEG decoder downscale by up to 8x when the target is much smaller than the source"""
+    if image_shape is not None and image.format == 'JPEG':
+        image.draft(mode, tuple(image_shape))
+
+
+def resize(image: Image.Image, image_shape: Optional[Tuple[int, int]], aspect_mode: str = 'stretch') -> Image.Image:
+    """Brings ``image`` to ``image_shape``, distorting it (``stretch``), padding it (``fit``) or cropping it (``crop``)"""
+    if image_shape is None or image.size == tuple(image_shape):
+        return image
+    width, height = image_shape
+    if aspect_mode == 'crop':
+        # Largest centered box with the target aspect ratio
+        scale = min(image.width / width, image.height / height)
+        crop_width, crop_height = width * scale, height * scale
+        left, top = (image.width - crop_width) / 2, (image.height - crop_height) / 2
+        return image.resize((width, height), box=(left, top, left + crop_width, top + crop_height),
+                            reducing_gap=REDUCING_GAP)
+    if aspect_mode == 'fit':
+        scale = min(width / image.width, height / image.height)
+        inner = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+        padded = Image.new(image.mode, (width, height))
+        padded.paste(image.resize(inner, reducing_gap=REDUCING_GAP),
+                     ((width - inner[0]) // 2, (height - inner[1]) // 2))
+        return padded
+    return image.resize((width, height), reducing_gap=REDUCING_GAP)
+
+
+def _draft_shape(image_shapes: Sequence[Optional[Tuple[int, int]]]) -> Optional[Tuple[int, int]]:
+    # The decoder may only downscale as far as the largest shape allows
+    if not image_shapes or any(image_shape is None for image_shape in image_shapes):
+        return None
+    return max(width for width, _ in image_shapes), max(height for _, height in image_shapes)
+
+
+def _encode(image: Image.Image, encode_format: str = 'jpeg', encode_quality: Optional[int] = None) -> bytes:
+    output = io.BytesIO()
+    options = {} if encode_quality is None else {'quality': encode_quality}
+    image.save(output, format=ENCODE_FORMATS[encode_format][0], **options)
+    return output.getvalue()
+
+
+def original_extension(image: Image.Image) -> Optional[str]:
+    """Extension to store an opened image under as it is, None if it has to be transcoded"""
+    if image.mode not in ORIGINAL_MODES:
+        return None
+    return ORIGINAL_EXTENSIONS.get(image.format)
+
+
+def process_image(image_content: bytes,
+                  image_shape: Optional[Tuple[int, int]] = None,
+                  compute_phash: bool = False,
+                  return_pixels: bool = False,
+                  extra_shapes: Sequence[Tuple[int, int]] = (),
+                  aspect_mode: str = 'stretch',
+                  keep_original: bool = False,
+                  encode_format: str = 'jpeg',
+                  encode_quality: Optional[int] = None) -> ProcessedImage:
+    """Decodes, resizes and encodes a downloaded image in a single pass.
+
+    The copies at ``extra_shapes`` are made from the same decoded image.
+    With ``keep_original``, an image that needs no resizing and whose format
+    and mode can be stored as they are (see ``original_extension``) keeps its
+    downloaded bytes, only its header is read unless pixels or a hash are
+    needed. Otherwise it is encoded to ``encode_format``.
+    Runs in worker processes, so it only takes and returns picklable values.
+    """
+    timings = {}
+    start = time.perf_counter()
+    with Image.open(io.BytesIO(image_content)) as source:
+        width, height = source.size
+        extension = original_extension(source) if keep_original and not extra_shapes else None
+        if extension is not None and (image_shape is None or source.size == tuple(image_shape)):
+            decoded = source.convert('RGB') if compute_phash or return_pixels else None
+            timings['decode'] = time.perf_counter() - start
+            phash = None
+            if compute_phash:
+                start = time.perf_counter()
+                phash = perceptual_hash(decoded)
+                timings['phash'] = time.perf_counter() - start
+            return ProcessedImage(
+                content=image_content,
+                width=width,
+                height=height,
+                phash=phash,
+                pixels=decoded.tobytes() if return_pixels else None,
+                size=(width, height),
+                timings=timings,
+                extension=extension)
+        draft(source, _draft_shape((image_shape,) + tuple(extra_shapes)))
+        decoded = source.convert('RGB')
+    timings['decode'] = time.perf_counter() - start
+    image = decoded
+
+    phash = None
+    if compute_phash:
+        start = time.perf_counter()
+        phash = perceptual_hash(image)
+        timings['phash'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    image = resize(image, image_shape, aspect_mode)
+    timings['resize'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    content = _encode(image, encode_format, encode_quality)
+    timings['encode'] = time.perf_counter() - start
+
+    variants = None
+    if extra_shapes:
+        variants = []
+        for extra_shape in extra_shapes:
+            start = time.perf_counter()
+            variant = resize(decoded, extra_shape, aspect_mode)
+            timings['resize'] += time.perf_counter() - start
+            start = time.perf_counter()
+            variants.append(_encode(variant, encode_format, encode_quality))
+            timings['encode'] += time.perf_counter() - start
+        variants = tuple(variants)
+    return ProcessedImage(
+        content=content,
+        width=width,
+        height=height,
+        phash=phash,
+        pixels=image.tobytes() if return_pixels else None,
+        size=image.size,
+        timings=timings,
+        variants=variants,
+        extension=ENCODE_FORMATS[encode_format][1])
+
+
+def timed_call(function: Callable, *args) -> Tuple[object, float]:
+    """Calls ``function`` and also returns how long it took, for work done in worker processes"""
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def is_resized(file_path: str,
+               image_shape: Tuple[int, int],
+               variants: Sequence[Tuple[Tuple[int, int], str]] = ()) -> bool:
+    """Whether an image file already has ``image_shape`` and its ``variants`` copies exist, from its header only"""
+    try:
+        with Image.open(file_path) as image:
+            return image.size == tuple(image_shape) and all(os.path.exists(path) for _, path in variants)
+    except Exception:
+        return False
+
+
+def resize_file(file_path: str,
+                image_shape: Tuple[int, int],
+                skip_if_sized: bool = False,
+                aspect_mode: str = 'stretch',
+                variants: Sequence[Tuple[Tuple[int, int], str]] = ()) -> Optional[str]:
+    """Resizes an image file in place, returns an error message on failure.
+
+    ``variants`` lists ``(shape, path)`` copies to write from the same decoded
+    image. A file that already has ``image_shape`` is left untouched, and
+    with ``skip_if_sized`` so are the copies that already exist.
+    """
+    try:
+        with Image.open(file_path) as image:
+            resize_source = image.size != tuple(image_shape)
+            variants = [(shape, path) for shape, path in variants if not (skip_if_sized and os.path.exists(path))]
+            if not resize_source and not variants:
+                return None
+            draft(image, _draft_shape([image_shape] + [shape for shape, _ in variants]), mode=image.mode)
+            image.load()
+            for shape, path in variants:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                # Copies share the name of the image, and so its format
+                resize(image.convert('RGB'), shape, aspect_mode).save(path)
+            resized = resize(image, image_shape, aspect_mode) if resize_source else None
+        if resized is not None:
+            resized.save(file_path)
+    except Exception as e:
+        return str(e)
+    return None
@@ -0,0 +1,196 @@
+import json
+import logging
+import re
+import time
+from abc import ABC, abstractmethod
+from itertools import chain
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+from urllib.parse import parse_qs, quote_plus, urlparse
+
+from .http_client import HttpClient
+
+logger = logging.getLogger("Dataset Augmentation classes")
+
+GOOGLE_IMAGES_URL = "https://www.google.com/search?safe=off&tbm=isch&q={q}&ijn={page}&start={start}"
+
+# Result metadata embedded as JSON, full-size images are ["<url>",<height>,<width>]
+EMBEDDED_IMAGE_PATTERN = re.compile(r'\["(https?://(?:[^"\\]|\\.)+)",(\d+),(\d+)\]')
+# Thumbnails inlined in the result metadata, ["data:image/...",<height>,<width>]
+EMBEDDED_DATA_PATTERN = re.compile(r'\["(data:image/(?:[^"\\]|\\.)+)",(\d+),(\d+)\]')
+# Older result pages, {"ou":"<url>", ...}
+ORIGINAL_URL_PATTERN = re.compile(r'"ou"\s*:\s*"(https?://(?:[^"\\]|\\.)+)"')
+# Basic HTML result pages link every result to /imgres?imgurl=<url>
+IMGRES_PATTERN = re.compile(r'href="([^"]*imgres\?[^"]*)"')
+# Hosts serving Google's own thumbnails of the results, not full-size images
+THUMBNAIL_HOST_PATTERN = re.compile(r'^encrypted-tbn\d*\.gstatic\.com$')
+
+
+def _unescape(value: str) -> str:
+    try:
+        return json.loads('"{}"'.format(value))
+    except ValueError:
+        return value
+
+
+def _is_thumbnail(url: str) -> bool:
+    host = urlparse(url).hostname or ''
+    return THUMBNAIL_HOST_PATTERN.match(host) is not None
+
+
+class Thumbnail(NamedTuple):
+    url: str
+    width: int
+    height: int
+
+    def covers(self, min_size: Tuple[int, int]) -> bool:
+        return self.width >= min_size[0] and self.height >= min_size[1]
+
+
+def parse_thumbnails(page: str) -> Dict[str, Thumbnail]:
+    """Maps the full-size image URLs of a result page to the thumbnail embedded right before each of them"""
+    entries = sorted(chain(EMBEDDED_IMAGE_PATTERN.finditer(page), EMBEDDED_DATA_PATTERN.finditer(page)),
+                     key=lambda match: match.start())
+    thumbnails = {}
+    thumbnail = None
+    for match in entries:
+        image_url = _unescape(match.group(1))
+        height, width = int(match.group(2)), int(match.group(3))
+        if image_url.startswith('data:') or _is_thumbnail(image_url):
+            thumbnail = Thumbnail(image_url, width, height)
+        elif thumbnail is not None:
+            thumbnails.setdefault(image_url, thumbnail)
+            thumbnail = None
+    return thumbnails
+
+
+def parse_image_urls(page: str) -> List[str]:
+    """Extracts the full-size image URLs of a result page, in page order and without duplicates"""
+    candidates = []
+    for match in EMBEDDED_IMAGE_PATTERN.finditer(page):
+        candidates.append((match.start(), _unescape(match.group(1))))
+    for match in ORIGINAL_URL_PATTERN.finditer(page):
+        candidates.append((match.start(), _unescape(match.group(1))))
+    for match in IMGRES_PATTERN.finditer(page):
+        query = urlparse(match.group(1).replace('&amp;', '&')).query
+        for image_url in parse_qs(query).get('imgurl', []):
+            candidates.append((match.start(), image_url))
+
+    image_urls = []
+    seen = set()
+    for _, image_url in sorted(candidates, key=lambda candidate: candidate[0]):
+        if image_url in seen or _is_thumbnail(image_url):
+            continue
+        seen.add(image_url)
+        image_urls.append(image_url)
+    return image_urls
+
+
+class SearchBackend(ABC):
+    """Source of image URLs for a query, as used by DatasetAugmentation.
+
+    Implementations yield URLs from ``iter_images`` as they find them and
+    release whatever they hold in ``close_session``. Those that can read the
+    thumbnails of the results page also override ``iter_thumbnails``.
+    Results are only kept in a SearchCache under a ``cache_key``, which
+    must change along with anything that changes them (the search URL, for
+    instance): either the ``search_cache_key`` given to DatasetAugmentation
+    or a ``cache_key`` attribute of the backend factory.
+    """
+
+    @abstractmethod
+    def iter_images(self,
+                    query: str,
+                    max_links_to_fetch: int,
+                    sleep_between_interactions: float = 1) -> Iterator[str]:
+        """Yields up to ``max_links_to_fetch`` full-size image URLs for ``query`` as they are found"""
+
+    def iter_thumbnails(self,
+                        query: str,
+                        max_links_to_fetch: int,
+                        min_size: Tuple[int, int],
+                        sleep_between_interactions: float = 1) -> Iterator[str]:
+        """Yields the thumbnail of each result when it is at least ``min_size``, its full-size URL otherwise.
+
+        Thumbnails can be ``data:`` URLs. Backends that cannot read thumbnails
+        only yield full-size URLs.
+        """
+        return self.iter_images(query, max_links_to_fetch, sleep_between_interactions)
+
+    def search_images(self,
+                      query: str,
+                      max_links_to_fetch: int,
+                      sleep_between_interactions: float = 1) -> set:
+        return set(self.iter_images(query, max_links_to_fetch, sleep_between_interactions))
+
+    def close_session(self) -> None:
+        pass
+
+
+class HttpSearchBackend(SearchBackend):
+    """Gets image URLs by fetching result pages over HTTP and parsing them, without a browser.
+
+    ``search_url`` is formatted with the quoted query ``q``, the page number
+    ``page`` and the offset of its first result ``start``. Pages are fetched
+    until enough URLs are found, ``max_pages`` is reached or a page brings
+    nothing new.
+    """
+
+    def __init__(self,
+                 http_client: Optional[HttpClient] = None,
+                 search_url: str = GOOGLE_IMAGES_URL,
+                 results_per_page: int = 100,
+                 max_pages: int = 10):
+        self._owns_client = http_client is None
+        self.http_client = http_client or HttpClient()
+        self.search_url = search_url
+        self.results_per_page = results_per_page
+        self.max_pages = max_pages
+
+    def _fetch_page(self, query: str, page: int) -> str:
+        response = self.http_client.get(self.search_url.format(
+            q=quote_plus(query), page=page, start=page * self.results_per_page))
+        response.raise_for_status()
+        return response.text
+
+    def iter_images(self,
+                    query: str,
+                    max_links_to_fetch: int,
+                    sleep_between_interactions: float = 1) -> Iterator[str]:
+        """Yields up to ``max_links_to_fetch`` image URLs, pausing ``sleep_between_interactions`` between pages"""
+        return self._iter_pages(query, max_links_to_fetch, sleep_between_interactions)
+
+    def iter_thumbnails(self,
+                        query: str,
+                        max_links_to_fetch: int,
+                        min_size: Tuple[int, int],
+                        sleep_between_interactions: float = 1) -> Iterator[str]:
+        return self._iter_pages(query, max_links_to_fetch, sleep_between_interactions, min_size)
+
+    def _iter_pages(self,
+                    query: str,
+                    max_links_to_fetch: int,
+                    sleep_between_interactions: float,
+                    min_size: Optional[Tuple[int, int]] = None) -> Iterator[str]:
+        image_urls = set()
+        for page in range(self.max_pages):
+            if page:
+                time.sleep(sleep_between_interactions)
+            content = self._fetch_page(query, page)
+            page_urls = [image_url for image_url in parse_image_urls(content) if image_url not in image_urls]
+            if not page_urls:
+                break
+            thumbnails = parse_thumbnails(content) if min_size is not None else {}
+            for image_url in page_urls:
+                image_urls.add(image_url)
+                thumbnail = thumbnails.get(image_url)
+                yield thumbnail.url if thumbnail is not None and thumbnail.covers(min_size) else image_url
+                if len(image_urls) >= max_links_to_fetch:
+                    break
+            if len(image_urls) >= max_links_to_fetch:
+                break
+
+        logger.info(f"Found: {len(image_urls)} image links, done!")
+
+    def close_session(self) -> None:
+        if self._owns_client:
+            self.http_client.close()
@@ -0,0 +1,139 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import List, NamedTuple, Optional
+
+from .drivers import cache_directory
+from .inline import is_inline_key, url_key
+
+
+class CachedSearch(NamedTuple):
+    urls: List[str]
+    # Largest number of links a completed search was asked for, fewer URLs means there were no more
+    max_links_to_fetch: int
+    updated: float
+
+    def covers(self, max_links_to_fetch: int) -> bool:
+        """Whether these results are all a search for ``max_links_to_fetch`` links would find"""
+        return len(self.urls) >= max_links_to_fetch or self.max_links_to_fetch >= max_links_to_fetch
+
+
+class SearchCache:
+    """Persistent map from a query, and the backend that ran it, to the ordered URLs it found.
+
+    Shared by every output directory, in ``searches.sqlite`` of the cache
+    directory by default. Results older than ``ttl`` seconds are ignored, and
+    past ``max_entries`` the least recently used ones are evicted. The list of
+    URLs holds the ``url_key`` of ``data:`` URLs, whose data is kept apart
+    and put back in the results, so that the list stays small.
+    """
+
+    def __init__(self,
+                 path: Optional[str] = None,
+                 ttl: Optional[float] = 7 * 24 * 3600,
+                 max_entries: int = 10000):
+        self.path = path or os.path.join(cache_directory(), 'searches.sqlite')
+        self.ttl = ttl
+        self.max_entries = max_entries
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._lock = threading.RLock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS searches (
+                backend TEXT NOT NULL,
+                query TEXT NOT NULL,
+                urls TEXT NOT NULL,
+                max_links_to_fetch INTEGER NOT NULL,
+                updated REAL NOT NULL,
+                accessed REAL NOT NULL,
+                PRIMARY KEY (backend, query)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS inline_urls (
+                backend TEXT NOT NULL,
+                query TEXT NOT NULL,
+                key TEXT NOT NULL,
+                url TEXT NOT NULL,
+                PRIMARY KEY (backend, query, key)
+            ) WITHOUT ROWID;
+        """)
+        self._connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _expired(self, updated: float, now: float) -> bool:
+        return self.ttl is not None and now - updated > self.ttl
+
+    def get(self, query: str, backend: str) -> Optional[CachedSearch]:
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT urls, max_links_to_fetch, updated FROM searches WHERE backend = ? AND query = ?',
+                (backend, query)).fetchone()
+            if row is None:
+                return None
+            if self._expired(row[2], now):
+                self._connection.execute('DELETE FROM searches WHERE backend = ? AND query = ?', (backend, query))
+                self._connection.execute('DELETE FROM inline_urls WHERE backend = ? AND query = ?', (backend, query))
+                self._connection.commit()
+                return None
+            self._connection.execute('UPDATE searches SET accessed = ? WHERE backend = ? AND query = ?',
+                                     (now, backend, query))
+            self._connection.commit()
+            inline_urls = dict(self._connection.execute(
+                'SELECT key, url FROM inline_urls WHERE backend = ? AND query = ?', (backend, query)))
+        # Keys of data: URLs that were not at hand when the search was cached are left out
+        urls = [inline_urls.get(url, url) for url in json.loads(row[0])]
+        return CachedSearch([url for url in urls if not is_inline_key(url)], row[1], row[2])
+
+    def put(self, query: str, backend: str, urls: List[str], max_links_to_fetch: int) -> None:
+        """Records the URLs of a completed search, keeping the largest search done so far"""
+        now = time.time()
+        with self._lock:
+            cached = self.get(query, backend)
+            if cached is not None and cached.max_links_to_fetch > max_links_to_fetch and len(cached.urls) > len(urls):
+                # A larger search is still cached, a smaller one does not replace it
+                return
+            keys = [url_key(url) for url in urls]
+            self._connection.execute(
+                'INSERT OR REPLACE INTO searches VALUES (?, ?, ?, ?, ?, ?)',
+                (backend, query, json.dumps(keys), max_links_to_fetch, now, now))
+            self._connection.execute('DELETE FROM inline_urls WHERE backend = ? AND query = ?', (backend, query))
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO inline_urls VALUES (?, ?, ?, ?)',
+                [(backend, query, key, url) for key, url in zip(keys, urls) if key != url])
+            self._evict(now)
+            self._connection.commit()
+
+    def _evict(self, now: float) -> None:
+        if self.ttl is not None:
+            self._connection.execute('DELETE FROM searches WHERE updated < ?', (now - self.ttl,))
+        self._connection.execute("""
+            DELETE FROM searches WHERE (backend, query) NOT IN (
+                SELECT backend, query FROM searches ORDER BY accessed DESC LIMIT ?
+            )
+        """, (self.max_entries,))
+        self._connection.execute("""
+            DELETE FROM inline_urls WHERE (backend, query) NOT IN (SELECT backend, query FROM searches)
+        """)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._connection.execute('DELETE FROM searches')
+            self._connection.execute('DELETE FROM inline_urls')
+            self._connection.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.commit()
+            self._connection.close()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute('SELECT COUNT(*) FROM searches').fetchone()[0]
@@ -0,0 +1,162 @@
+import io
+import json
+import os
+import tarfile
+from typing import Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+from PIL import Image
+
+from .files import replace_json, temporary_path
+from .processing import resize
+
+SHARDS_INDEX = 'shards.json'
+ARRAYS_INDEX = 'arrays.json'
+IMAGES_FILENAME = 'images.u8'
+LABELS_FILENAME = 'labels.npy'
+
+
+class ShardWriter:
+    """Writes images into sequential, size-bounded tar shards.
+
+    Every sample is stored as ``<key>.<ext>`` with its label in ``<key>.cls``,
+    the layout used by WebDataset, and ``shards.json`` lists the shards along
+    with the number of samples per label.
+    """
+
+    def __init__(self, directory: str, max_shard_bytes: int = 256 * 1024 * 1024, prefix: str = 'shard'):
+        self.directory = directory
+        self.max_shard_bytes = max_shard_bytes
+        self.prefix = prefix
+        self.shards: List[dict] = []
+        self.label_counts = {}
+        self._tar: Optional[tarfile.TarFile] = None
+        self._count = 0
+        os.makedirs(directory, exist_ok=True)
+        # Shards left over from a previous, bigger, export
+        for file_name in os.listdir(directory):
+            if file_name.startswith(prefix + '-') and file_name.endswith('.tar'):
+                os.remove(os.path.join(directory, file_name))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _add_member(self, name: str, content: bytes) -> None:
+        info = tarfile.TarInfo(name)
+        info.size = len(content)
+        self._tar.addfile(info, io.BytesIO(content))
+
+    def add(self, label: str, path: str, image: Optional[Image.Image] = None) -> None:
+        with open(path, 'rb') as f:
+            content = f.read()
+        # Every member costs a 512 bytes header plus padding to the next block
+        sample_bytes = len(content) + 3 * 512
+        if self._tar is not None and self.shards[-1]['bytes'] + sample_bytes > self.max_shard_bytes:
+            self._tar.close()
+            self._tar = None
+        if self._tar is None:
+            file_name = '{}-{:05d}.tar'.format(self.prefix, len(self.shards))
+            self._tar = tarfile.open(os.path.join(self.directory, file_name), 'w')
+            self.shards.append({'file': file_name, 'count': 0, 'bytes': 0})
+
+        key = '{:08d}'.format(self._count)
+        extension = os.path.splitext(path)[1] or '.jpg'
+        self._add_member(key + extension, content)
+        self._add_member(key + '.cls', label.encode('utf-8'))
+        self._count += 1
+        self.shards[-1]['count'] += 1
+        self.shards[-1]['bytes'] += sample_bytes
+        self.label_counts[label] = self.label_counts.get(label, 0) + 1
+
+    def close(self) -> None:
+        if self._tar is not None:
+            self._tar.close()
+            self._tar = None
+        replace_json(os.path.join(self.directory, SHARDS_INDEX), {
+            'count': self._count,
+            'shards': self.shards,
+            'labels': self.label_counts,
+        })
+
+
+class ArrayWriter:
+    """Appends fixed-shape images to a raw uint8 array that can be memory-mapped back.
+
+    ``images.u8`` holds N x H x W x 3 pixels, ``labels.npy`` the label id of
+    every image and ``arrays.json`` the shape and the label names.
+    """
+
+    def __init__(self, directory: str, image_shape: Tuple[int, int], aspect_mode: str = 'stretch'):
+        self.directory = directory
+        self.image_shape = tuple(image_shape)
+        self.aspect_mode = aspect_mode
+        self.label_names: List[str] = []
+        self._label_ids = {}
+        self._labels: List[int] = []
+        os.makedirs(directory, exist_ok=True)
+        self._images_tmp_path = temporary_path(os.path.join(directory, IMAGES_FILENAME))
+        self._images = open(self._images_tmp_path, 'wb')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add(self, label: str, path: str, image: Optional[Image.Image] = None) -> None:
+        if image is None:
+            with Image.open(path) as stored:
+                image = stored.convert('RGB')
+        image = resize(image, self.image_shape, self.aspect_mode)
+        self._images.write(np.asarray(image.convert('RGB'), dtype=np.uint8).tobytes())
+        if label not in self._label_ids:
+            self._label_ids[label] = len(self.label_names)
+            self.label_names.append(label)
+        self._labels.append(self._label_ids[label])
+
+    def close(self) -> None:
+        if self._images.closed:
+            return
+        self._images.close()
+        os.replace(self._images_tmp_path, os.path.join(self.directory, IMAGES_FILENAME))
+        np.save(os.path.join(self.directory, LABELS_FILENAME), np.asarray(self._labels, dtype=np.int32))
+        width, height = self.image_shape
+        replace_json(os.path.join(self.directory, ARRAYS_INDEX), {
+            'shape': [len(self._labels), height, width, 3],
+            'dtype': 'uint8',
+            'label_names': self.label_names,
+        })
+
+
+def iter_shards(directory: str, decode: bool = False) -> Iterator[Tuple[str, Union[bytes, Image.Image]]]:
+    """Streams ``(label, image)`` pairs out of the shards written by ShardWriter"""
+    with open(os.path.join(directory, SHARDS_INDEX)) as f:
+        shards = json.load(f)['shards']
+    for shard in shards:
+        with tarfile.open(os.path.join(directory, shard['file']), 'r|') as tar:
+            content = None
+            for member in tar:
+                data = tar.extractfile(member).read()
+                if member.name.endswith('.cls'):
+                    if decode:
+                        with Image.open(io.BytesIO(content)) as image:
+                            content = image.convert('RGB')
+                    yield data.decode('utf-8'), content
+                else:
+                    content = data
+
+
+def load_array(directory: str) -> Tuple[np.ndarray, np.ndarray, List[str]]:
+    """Memory-maps the images written by ArrayWriter, returns ``(images, labels, label_names)``"""
+    with open(os.path.join(directory, ARRAYS_INDEX)) as f:
+        metadata = json.load(f)
+    shape = tuple(metadata['shape'])
+    if shape[0]:
+        images = np.memmap(os.path.join(directory, IMAGES_FILENAME), dtype=metadata['dtype'], mode='r', shape=shape)
+    else:
+        images = np.zeros(shape, dtype=metadata['dtype'])
+    labels = np.load(os.path.join(directory, LABELS_FILENAME), mmap_mode='r')
+    return images, labels, metadata['label_names']
@@ -0,0 +1,112 @@
+import hashlib
+import json
+import os
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from .files import replace_json, temporary_path
+from .index import METADATA_DIRNAME
+
+TENSORS_MANIFEST = 'tensors.json'
+
+
+def folder_fingerprint(image_folder: str, file_names: Iterable[str]) -> str:
+    """Hash of the names, sizes and modification times of the files, in order.
+
+    Any file added, removed, renamed or rewritten (resized in place, for
+    instance) changes it, without reading the images themselves.
+    """
+    digest = hashlib.sha1()
+    for file_name in file_names:
+        stat = os.stat(os.path.join(image_folder, file_name))
+        digest.update('{}\0{}\0{}\n'.format(file_name, stat.st_size, stat.st_mtime_ns).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class TensorCache:
+    """Decoded images of each label, stored as a contiguous N x H x W x 3 uint8 array per ``image_shape``.
+
+    Every label and shape gets a folder under
+    ``<output_directory>/.imagines/tensors`` holding the raw array and
+    ``tensors.json``, which records its shape, the source files in array order
+    and their fingerprint. A cached array is only returned while the
+    fingerprint of the label folder still matches, and is memory-mapped
+    rather than read.
+    """
+
+    def __init__(self, output_directory: str, directory: Optional[str] = None):
+        self.directory = directory or os.path.join(output_directory, METADATA_DIRNAME, 'tensors')
+
+    def _folder(self, label: str, image_shape: Tuple[int, int]) -> str:
+        width, height = image_shape
+        return os.path.join(self.directory, label, '{}x{}'.format(width, height))
+
+    def _manifest(self, label: str, image_shape: Tuple[int, int]) -> Optional[dict]:
+        try:
+            with open(os.path.join(self._folder(label, image_shape), TENSORS_MANIFEST)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def load(self,
+             label: str,
+             image_shape: Tuple[int, int],
+             fingerprint: str) -> Optional[Tuple[np.ndarray, List[str]]]:
+        """Memory-maps the array of ``label``, returns ``(images, file_names)`` or None if it is missing or stale"""
+        manifest = self._manifest(label, image_shape)
+        if manifest is None or manifest['fingerprint'] != fingerprint:
+            return None
+        shape = tuple(manifest['shape'])
+        if not shape[0]:
+            return np.zeros(shape, dtype=np.uint8), manifest['files']
+        try:
+            images = np.memmap(os.path.join(self._folder(label, image_shape), manifest['array']),
+                               dtype=manifest['dtype'], mode='r', shape=shape)
+        except (OSError, ValueError):
+            return None
+        return images, manifest['files']
+
+    def store(self,
+              label: str,
+              image_shape: Tuple[int, int],
+              fingerprint: str,
+              file_names: List[str],
+              images: Iterable[Image.Image]) -> None:
+        """Writes the array of ``label`` from ``images``, one per entry of ``file_names``, resized if needed"""
+        folder = self._folder(label, image_shape)
+        os.makedirs(folder, exist_ok=True)
+        # Named after the fingerprint, so that readers of the previous manifest keep a consistent array
+        array_name = 'images-{}.u8'.format(fingerprint[:16])
+        array_path = os.path.join(folder, array_name)
+        array_tmp_path = temporary_path(array_path)
+        count = 0
+        with open(array_tmp_path, 'wb') as f:
+            for image in images:
+                if image.size != tuple(image_shape):
+                    image = image.resize(image_shape)
+                f.write(np.asarray(image.convert('RGB'), dtype=np.uint8).tobytes())
+                count += 1
+        if count != len(file_names):
+            os.remove(array_tmp_path)
+            raise ValueError('Expected {} images, got {}'.format(len(file_names), count))
+        os.replace(array_tmp_path, array_path)
+
+        width, height = image_shape
+        replace_json(os.path.join(folder, TENSORS_MANIFEST), {
+            'label': label,
+            'shape': [count, height, width, 3],
+            'dtype': 'uint8',
+            'array': array_name,
+            'fingerprint': fingerprint,
+            'files': file_names,
+        })
+
+        # Arrays of previous versions of the folder, not the ones other writers are still writing
+        for file_name in os.listdir(folder):
+            if file_name.startswith('images-') and file_name != array_name and not file_name.endswith('.tmp'):
+                try:
+                    os.remove(os.path.join(folder, file_name))
+                except OSError:
+                    pass
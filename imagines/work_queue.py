@@ -0,0 +1,183 @@
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from .files import replace_json
+from .index import METADATA_DIRNAME
+from .manifest import LabelManifest
+
+logger = logging.getLogger("Dataset Augmentation classes")
+
+MERGED_MANIFEST = 'dataset.json'
+
+
+class WorkQueue:
+    """Labels of a dataset shared out between workers through lease files in the output directory.
+
+    A worker owns a label while ``.imagines/queue/leases/<label>.lease``
+    holds its id, and keeps the lease alive by touching it. A lease not
+    touched for ``lease_seconds`` belongs to a dead worker and is reclaimed by
+    the next worker asking for the label, which resumes the label from its
+    manifest. Finished labels get a ``done/<label>.json`` marker. Only atomic
+    file creation and renames are relied upon, so any filesystem shared by
+    the workers works, as long as their clocks agree.
+    """
+
+    def __init__(self, output_directory: str, worker_id: Optional[str] = None, lease_seconds: float = 600.0):
+        self.output_directory = output_directory
+        self.worker_id = worker_id or '{}-{}-{}'.format(socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+        self.lease_seconds = lease_seconds
+        self.directory = os.path.join(output_directory, METADATA_DIRNAME, 'queue')
+        os.makedirs(os.path.join(self.directory, 'leases'), exist_ok=True)
+        os.makedirs(os.path.join(self.directory, 'done'), exist_ok=True)
+
+    def _lease_path(self, label: str) -> str:
+        return os.path.join(self.directory, 'leases', label + '.lease')
+
+    def _done_path(self, label: str) -> str:
+        return os.path.join(self.directory, 'done', label + '.json')
+
+    def lease_owner(self, label: str) -> Optional[str]:
+        try:
+            with open(self._lease_path(label)) as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    def is_done(self, label: str) -> bool:
+        return os.path.exists(self._done_path(label))
+
+    def _is_expired(self, label: str) -> bool:
+        try:
+            return time.time() - os.path.getmtime(self._lease_path(label)) > self.lease_seconds
+        except OSError:
+            return False
+
+    def claim(self, label: str) -> bool:
+        """Takes the lease of ``label`` if it is neither done nor held by a live worker"""
+        if self.is_done(label):
+            return False
+        path = self._lease_path(label)
+        if self._is_expired(label):
+            owner = self.lease_owner(label)
+            # Renaming only succeeds for one of the workers reclaiming the lease at the same time
+            stale_path = '{}.{}.stale'.format(path, self.worker_id)
+            try:
+                os.rename(path, stale_path)
+            except OSError:
+                return False
+            if not self._is_stale(stale_path, owner):
+                # Another worker reclaimed the lease in the meantime, and this one took away its fresh lease
+                os.rename(stale_path, path)
+                return False
+            logger.info(f"Reclaiming the expired lease of label {label}")
+            os.remove(stale_path)
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w') as f:
+            f.write(self.worker_id)
+        if self.is_done(label):
+            # Finished by another worker in the meantime
+            self.release(label)
+            return False
+        return True
+
+    def _is_stale(self, path: str, owner: Optional[str]) -> bool:
+        """Whether the lease file at ``path`` is still the expired one of ``owner``"""
+        try:
+            with open(path) as f:
+                stale_owner = f.read().strip() or None
+            return stale_owner == owner and time.time() - os.path.getmtime(path) > self.lease_seconds
+        except OSError:
+            return False
+
+    def renew(self, label: str) -> bool:
+        """Extends the lease of ``label``, returns False if it was lost to another worker"""
+        if self.lease_owner(label) != self.worker_id:
+            return False
+        try:
+            os.utime(self._lease_path(label))
+        except OSError:
+            return False
+        return True
+
+    def release(self, label: str) -> None:
+        if self.lease_owner(label) == self.worker_id:
+            try:
+                os.remove(self._lease_path(label))
+            except OSError:
+                pass
+
+    def complete(self, label: str, count: int) -> None:
+        replace_json(self._done_path(label), {'worker': self.worker_id, 'count': count, 'finished': time.time()})
+
+    @contextmanager
+    def hold(self, label: str) -> Iterator[threading.Event]:
+        """Keeps the lease of a claimed label alive while the block runs, and releases it afterwards.
+
+        Yields an event set once the lease is lost to another worker, which
+        then owns the label: the block should stop building it.
+        """
+        stop = threading.Event()
+        lost = threading.Event()
+
+        def heartbeat():
+            while not stop.wait(self.lease_seconds / 3):
+                if not self.renew(label):
+                    logger.warning(f"Lost the lease of label {label} to another worker")
+                    lost.set()
+                    return
+
+        thread = threading.Thread(target=heartbeat, name='imagines-lease-{}'.format(label), daemon=True)
+        thread.start()
+        try:
+            yield lost
+        finally:
+            stop.set()
+            thread.join()
+            self.release(label)
+
+    def merge(self, labels: Iterable[str]) -> dict:
+        """Writes ``.imagines/dataset.json``, the consolidated state of every label, and returns it.
+
+        Each finished label lists its files, the worker that finished it and
+        what its queries found. Labels not finished yet are listed under
+        ``pending``, so the manifest is only ``complete`` once every worker is.
+        """
+        labels = list(labels)
+        while True:
+            content = self._merged(labels)
+            replace_json(os.path.join(self.output_directory, METADATA_DIRNAME, MERGED_MANIFEST), content)
+            # A worker that finished a label while this one was writing may have been overwritten
+            if not any(self.is_done(label) for label in content['pending']):
+                return content
+
+    def _merged(self, labels: List[str]) -> dict:
+        merged: Dict[str, dict] = {}
+        pending: List[str] = []
+        for label in labels:
+            if not self.is_done(label):
+                pending.append(label)
+                continue
+            with open(self._done_path(label)) as f:
+                done = json.load(f)
+            target_folder = os.path.join(self.output_directory, label)
+            files = sorted(os.listdir(target_folder)) if os.path.isdir(target_folder) else []
+            manifest = LabelManifest(self.output_directory, label)
+            merged[label] = {
+                'worker': done['worker'],
+                'files': files,
+                'queries': {query: {'urls': len(progress.urls),
+                                    'saved': len(progress.saved),
+                                    'skipped': len(progress.skipped)}
+                            for query, progress in manifest.queries.items()},
+            }
+        return {'complete': not pending, 'labels': merged, 'pending': pending}
@@ -8,9 +8,45 @@ import logging
 
 from tests.webscrapper_unittests import WebScrapperUnitTests
 from tests.datasetaugmentation_unittests import DatasetAugmentationUnitTests
+from tests.download_unittests import ConcurrentDownloaderUnitTests
+from tests.http_client_unittests import HttpClientUnitTests
+from tests.index_unittests import ImageIndexUnitTests
+from tests.phash_unittests import PerceptualHashUnitTests
+from tests.processing_unittests import ProcessingUnitTests
+from tests.shards_unittests import ShardsUnitTests
+from tests.pool_unittests import ScraperPoolUnitTests
+from tests.search_unittests import SearchBackendUnitTests
+from tests.benchmarks_unittests import BenchmarksUnitTests
+from tests.metrics_unittests import MetricsUnitTests
+from tests.drivers_unittests import DriversUnitTests
+from tests.fetch_unittests import FetchUnitTests
+from tests.dataset_unittests import LazyImageDatasetUnitTests
+from tests.tensors_unittests import TensorCacheUnitTests
+from tests.search_cache_unittests import SearchCacheUnitTests
+from tests.work_queue_unittests import WorkQueueUnitTests
+from tests.files_unittests import FilesUnitTests
+from tests.inline_unittests import InlineUnitTests
 
 assert WebScrapperUnitTests
 assert DatasetAugmentationUnitTests
+assert ConcurrentDownloaderUnitTests
+assert HttpClientUnitTests
+assert ImageIndexUnitTests
+assert PerceptualHashUnitTests
+assert ProcessingUnitTests
+assert ShardsUnitTests
+assert ScraperPoolUnitTests
+assert SearchBackendUnitTests
+assert BenchmarksUnitTests
+assert MetricsUnitTests
+assert DriversUnitTests
+assert FetchUnitTests
+assert LazyImageDatasetUnitTests
+assert TensorCacheUnitTests
+assert SearchCacheUnitTests
+assert WorkQueueUnitTests
+assert FilesUnitTests
+assert InlineUnitTests
 
 sys.path.append(os.getcwd())
 
@@ -0,0 +1,76 @@
+"""Unit tests for the offline benchmarks"""
+
+import json
+import shutil
+import tempfile
+import unittest
+import os
+
+import requests
+
+from benchmarks.run import BENCHMARKS, main, query_offsets
+from benchmarks.server import BenchmarkServer
+from imagines.search import parse_image_urls
+
+import logging
+
+# Set up logging
+logging.basicConfig(level=os.getenv("LOGGER_LEVEL", logging.WARNING))
+logger = logging.getLogger("Dataset Benchmarks UnitTests")
+
+class BenchmarksUnitTests(unittest.TestCase):
+    """Unit tests for the offline benchmarks"""
+
+    def setUp(self):
+        """Set up all tests."""
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Tear down all tests."""
+        shutil.rmtree(self.tmp_dir)
+
+    def test_benchmark_server(self):
+        """Unit tests for BenchmarkServer"""
+        with BenchmarkServer(image_count=20, image_size=(64, 48), image_formats=('jpeg', 'png'),
+                             error_rate=0.25, results_per_page=8) as server:
+            page = requests.get(server.search_url.format(q='apple', page=0, start=0)).text
+            image_urls = parse_image_urls(page)
+            self.assertEqual(len(image_urls), 8)
+            self.assertEqual(image_urls, server.image_urls(8, server.query_offset('apple')))
+
+            statuses = [requests.get(server.image_url(index)).status_code for index in range(20)]
+            self.assertEqual(statuses.count(404), sum(server.fails(index) for index in range(20)))
+            response = requests.get(server.image_url(1))
+            if response.status_code == 200:
+                self.assertEqual(response.headers['Content-Type'], 'image/png')
+                self.assertEqual(response.content, server.image(1))
+
+    def test_benchmark_server_query_offsets(self):
+        """Unit tests for BenchmarkServer"""
+        offsets = query_offsets(40, 4)
+        self.assertEqual(sorted(offsets.values()), [0, 10, 20, 30])
+        with BenchmarkServer(image_count=40, image_size=(64, 48), results_per_page=10,
+                             query_offsets=offsets) as server:
+            image_urls = set()
+            for query in offsets:
+                page = requests.get(server.search_url.format(q=query, page=0, start=0)).text
+                image_urls.update(parse_image_urls(page))
+            # Every label gets images of its own
+            self.assertEqual(len(image_urls), 40)
+            self.assertEqual(server.query_offset('query 1'), 10)
+            # Queries left out are spread over the images
+            self.assertGreater(len({server.query_offset('other {}'.format(i)) for i in range(4)}), 1)
+
+    def test_benchmarks_report(self):
+        """Unit tests for the benchmarks runner"""
+        output = os.path.join(self.tmp_dir, 'results.json')
+        main(['--images', '8', '--image-size', '64x48', '--image-shape', '32x32', '--labels', '2',
+              '--process-workers', '0', '--no-isolate', '--output', output])
+        with open(output) as f:
+            report = json.load(f)
+        self.assertEqual([result['benchmark'] for result in report['results']], list(BENCHMARKS))
+        for result in report['results']:
+            self.assertEqual(result['images'], 8)
+            self.assertEqual(result['failures'], 0)
+            self.assertGreater(result['images_per_sec'], 0)
+            self.assertLessEqual(result['latency_p50_ms'], result['latency_p99_ms'])
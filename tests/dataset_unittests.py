@@ -0,0 +1,114 @@
+"""Unit tests for the lazy image dataset"""
+
+import pickle
+import shutil
+import tempfile
+import unittest
+import os
+from concurrent.futures import wait
+from unittest.mock import patch
+
+from PIL import Image
+
+from imagines import LazyImageDataset
+from imagines import dataset as dataset_module
+
+import logging
+
+# Set up logging
+logging.basicConfig(level=os.getenv("LOGGER_LEVEL", logging.WARNING))
+logger = logging.getLogger("Dataset LazyImageDataset UnitTests")
+
+def wait_for_prefetch(dataset):
+    """Waits until the images being prefetched are in the cache"""
+    while dataset._pending:
+        wait(list(dataset._pending.copy().values()))
+
+
+class LazyImageDatasetUnitTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.paths = []
+        for i in range(6):
+            path = os.path.join(self.tmp_dir, '{}.png'.format(i))
+            Image.new('RGB', (40 + i, 30), (i * 40, 0, 0)).save(path)
+            self.paths.append(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_lazy_dataset_sequence(self):
+        """Images are decoded on access, indexed like a list"""
+
+        with patch.object(dataset_module, 'load_image', wraps=dataset_module.load_image) as load_mock:
+            dataset = LazyImageDataset(self.paths, ['a', 'b'] * 3)
+            self.assertFalse(load_mock.called)
+            self.assertEqual(len(dataset), 6)
+            self.assertEqual(dataset[1].size, (41, 30))
+            self.assertEqual(dataset[-1].mode, 'RGB')
+            self.assertEqual(load_mock.call_count, 2)
+
+        with self.assertRaises(IndexError):
+            dataset[6]
+        self.assertEqual([image.size[0] for image in dataset], [40, 41, 42, 43, 44, 45])
+
+        subset = dataset[2:4]
+        self.assertIsInstance(subset, LazyImageDataset)
+        self.assertEqual(subset.labels, ['a', 'b'])
+        self.assertEqual(subset[0].size, (42, 30))
+
+        resized = LazyImageDataset(self.paths, image_shape=(8, 8))
+        self.assertEqual(resized[0].size, (8, 8))
+
+        with self.assertRaises(ValueError):
+            LazyImageDataset(self.paths, ['a'])
+
+    def test_lazy_dataset_cache(self):
+        """Only the most recently used images are kept decoded"""
+
+        dataset = LazyImageDataset(self.paths, cache_size=2)
+        with patch.object(dataset_module, 'load_image', wraps=dataset_module.load_image) as load_mock:
+            first = dataset[0]
+            self.assertIs(dataset[0], first)
+            dataset[1]
+            dataset[0]
+            dataset[2]
+            self.assertEqual(dataset.cached_indices(), [0, 2])
+            self.assertEqual(load_mock.call_count, 3)
+
+        uncached = LazyImageDataset(self.paths)
+        self.assertIsNot(uncached[0], uncached[0])
+        self.assertEqual(uncached.cached_indices(), [])
+
+    def test_lazy_dataset_prefetch(self):
+        """The next images are decoded in the background and survive pickling empty"""
+
+        with LazyImageDataset(self.paths, prefetch=2) as dataset:
+            dataset[0]
+            wait_for_prefetch(dataset)
+            self.assertEqual(sorted(dataset.cached_indices()), [1, 2])
+            with patch.object(dataset_module, 'load_image') as load_mock:
+                self.assertEqual(dataset[1].size, (41, 30))
+                self.assertFalse(load_mock.called)
+            # Used prefetched images are not kept without an LRU cache
+            wait_for_prefetch(dataset)
+            self.assertEqual(sorted(dataset.cached_indices()), [2, 3])
+
+            copy = pickle.loads(pickle.dumps(dataset))
+            self.assertEqual(copy.cached_indices(), [])
+            self.assertEqual(copy[3].size, (43, 30))
+            copy.close()
+        self.assertEqual(dataset.cached_indices(), [])
+
+    def test_lazy_dataset_from_folder(self):
+        """A label folder becomes a dataset of its images"""
+
+        dataset = LazyImageDataset.from_folder(self.tmp_dir, max_images=4)
+        self.assertEqual(len(dataset), 4)
+        self.assertEqual(dataset.labels, [os.path.basename(self.tmp_dir)] * 4)
+        self.assertEqual(LazyImageDataset.from_folder(self.tmp_dir + '/', label='x').labels, ['x'] * 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
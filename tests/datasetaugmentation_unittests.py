@@ -1,14 +1,28 @@
 """Unit tests for DataAugmentation class"""
 
+import base64
 import hashlib
 import io
+import json
+import shutil
 import unittest
 from unittest.mock import patch
 import os
 from PIL import Image
 import tempfile
+import types
+from functools import partial
 
-from imagines import DatasetAugmentation, WebScrapper
+import numpy as np
+import requests
+
+from imagines import DatasetAugmentation, LazyImageDataset, Metrics, WebScrapper, iter_shards, load_array
+from imagines.http_client import HttpClient
+from imagines.index import ImageIndex
+from imagines.inline import url_key
+from imagines.manifest import MAX_DOWNLOAD_ATTEMPTS, LabelManifest, QueryManifest
+from imagines.search import SearchBackend
+from imagines.search_cache import SearchCache
 
 import logging
 
@@ -28,10 +42,41 @@ class WebScrapperMock(WebScrapper):
         toy_image_urls = ['https://www.toyimageurl.com' for _ in range(max_links_to_fetch)]
         return set(toy_image_urls)
 
+    def iter_images(self, query, max_links_to_fetch, sleep_between_interactions):
+        """Mock class for WebScrapper"""
+        yield from self.search_images(query, max_links_to_fetch, sleep_between_interactions)
+
+    def iter_thumbnails(self, query, max_links_to_fetch, min_size, sleep_between_interactions):
+        """Mock class for WebScrapper"""
+        yield from self.iter_images(query, max_links_to_fetch, sleep_between_interactions)
+
     def close_session(self):
         """Mock class for WebScrapper"""
         pass
 
+class MockResponse:
+    """Mock class for requests.Response"""
+
+    def __init__(self, content, status_code=200, headers=None):
+        """Mock class for requests.Response"""
+        self.content = content
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        """Mock class for requests.Response"""
+        if self.status_code >= 400:
+            raise requests.HTTPError(response=self)
+
+    def iter_content(self, chunk_size=1):
+        """Mock class for requests.Response"""
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+    def close(self):
+        """Mock class for requests.Response"""
+        pass
+
 class DatasetAugmentationUnitTests(unittest.TestCase):
     """Unit tests for DatasetAugmentation"""
 
@@ -54,9 +99,9 @@ class DatasetAugmentationUnitTests(unittest.TestCase):
         self.assertIsInstance(dataset_augmentation, DatasetAugmentation)
         self.assertIsInstance(dataset_augmentation.driver, WebScrapper)
 
-    @patch('imagines.core.DatasetAugmentation._persist_images')
+    @patch('imagines.core.DatasetAugmentation._iter_persisted_images')
     @patch('imagines.core.DatasetAugmentation.resize_images')
-    @patch('imagines.core.DatasetAugmentation._load_label_images')
+    @patch('imagines.core.DatasetAugmentation._iter_label_images')
     @patch('imagines.core.WebScrapper', WebScrapperMock)
     def test_dataset_augmentation_augment_dataset(self,
                                                   load_label_images_mock,
@@ -65,9 +110,9 @@ class DatasetAugmentationUnitTests(unittest.TestCase):
         """Unit tests for DataAugmentation"""
 
         # Mocks
-        persist_images_mock.return_value = None
+        persist_images_mock.return_value = []
         resize_images_mock.return_value = None
-        load_label_images_mock.return_value = ['image_1.jpg', 'image_2.jpg']
+        load_label_images_mock.return_value = [('image_1.jpg', 'image_1'), ('image_2.jpg', 'image_2')]
 
         dataset_augmentation = DatasetAugmentation(
             driver_type='chrome',
@@ -160,7 +205,7 @@ class DatasetAugmentationUnitTests(unittest.TestCase):
 
         
     @patch('imagines.core.WebScrapper', WebScrapperMock)
-    @patch('requests.get')
+    @patch('requests.Session.get')
     def test_dataset_augmentation_persist_images(self, get_mock):
         """Unit tests for DataAugmentation"""
 
@@ -168,13 +213,8 @@ class DatasetAugmentationUnitTests(unittest.TestCase):
         with open('./tests/test_artifacts/test_label/test_image.jpg', 'rb') as f:
             image_data = f.read()
 
-        def get_mock_function(url, timeout, params=None, headers=None):
-            """Mock function for requests.get"""
-            class MockResponse:
-                def __init__(self, image_data):
-                    self.content = image_data
-                    self.status_code = 200
-
+        def get_mock_function(url, timeout, params=None, headers=None, stream=False):
+            """Mock function for requests.Session.get"""
             return MockResponse(image_data)
 
         # Mocks
@@ -196,6 +236,667 @@ class DatasetAugmentationUnitTests(unittest.TestCase):
         # Assert files have been created
         self.assertTrue(os.path.exists(output_dir + hashlib.sha1(image_data).hexdigest()[:10] + '.jpg'))
 
+    @patch('imagines.core.WebScrapper', WebScrapperMock)
+    @patch('requests.Session.get')
+    def test_dataset_augmentation_persist_images_dedup(self, get_mock):
+        """Unit tests for DataAugmentation"""
+
+        with open('./tests/test_artifacts/test_label/test_image.jpg', 'rb') as f:
+            image_data = f.read()
+
+        get_mock.return_value = MockResponse(image_data)
+
+        dataset_augmentation = DatasetAugmentation(
+            driver_type='chrome',
+        )
+        image_urls = ['https://www.toyimageurl.com/1.jpg', 'https://www.toyimageurl.com/2.jpg']
+        dataset_augmentation._persist_images(os.path.join(self.tmp_dir, 'label_1'), image_urls)
+        self.assertEqual(get_mock.call_count, 2)
+
+        # Known URLs are not downloaded again, and the stored file is linked into the new label
+        images = dataset_augmentation._persist_images(os.path.join(self.tmp_dir, 'label_2'), image_urls)
+        self.assertEqual(get_mock.call_count, 2)
+        self.assertEqual(len(images), 2)
+        file_name = hashlib.sha1(image_data).hexdigest()[:10] + '.jpg'
+        self.assertEqual(os.listdir(os.path.join(self.tmp_dir, 'label_1')), [file_name])
+        self.assertEqual(os.listdir(os.path.join(self.tmp_dir, 'label_2')), [file_name])
+
+    @patch('imagines.core.WebScrapper', WebScrapperMock)
+    @patch('requests.Session.get')
+    def test_dataset_augmentation_persist_images_near_duplicates(self, get_mock):
+        """Unit tests for DataAugmentation"""
+
+        image = Image.open('./tests/test_artifacts/test_label/test_image.jpg').convert('RGB')
+        contents = {}
+        for i, scale in enumerate([1, 2, 3]):
+            buffer = io.BytesIO()
+            image.resize((image.width // scale, image.height // scale)).save(buffer, format='JPEG')
+            contents['https://www.toyimageurl.com/{}.jpg'.format(i)] = buffer.getvalue()
+
+        def get_mock_function(url, timeout, stream=False):
+            """Mock function for requests.Session.get"""
+            return MockResponse(contents[url])
+
+        get_mock.side_effect = get_mock_function
+
+        dataset_augmentation = DatasetAugmentation(
+            driver_type='chrome',
+            near_duplicate_threshold=6,
+        )
+        target_folder = os.path.join(self.tmp_dir, 'label')
+        images = dataset_augmentation._persist_images(target_folder, list(contents))
+
+        # Only one of the three resized copies is kept
+        self.assertEqual(len(images), 1)
+        self.assertEqual(len(os.listdir(target_folder)), 1)
+
+    @patch('imagines.core.WebScrapper', WebScrapperMock)
+    @patch('requests.Session.get')
+    def test_dataset_augmentation_iter_dataset(self, get_mock):
+        """Unit tests for DataAugmentation"""
+
+        with open('./tests/test_artifacts/test_label/test_image.jpg', 'rb') as f:
+            image_data = f.read()
+
+        get_mock.return_value = MockResponse(image_data)
+
+        dataset_augmentation = DatasetAugmentation(
+            driver_type='chrome',
+        )
+        label_queries = {
+            'test_label_1': ['test_query_1_1'],
+            'test_label_2': ['test_query_2_1'],
+        }
+        records = dataset_augmentation.iter_dataset(label_queries, self.tmp_dir, max_links_to_fetch=1)
+        self.assertIsInstance(records, types.GeneratorType)
+
+        # Records are yielded one at a time, flat across labels
+        label, path, image = next(records)
+        self.assertEqual(label, 'test_label_1')
+        self.assertTrue(os.path.exists(path))
+        self.assertIsInstance(image, Image.Image)
+        self.assertEqual([record.label for record in records], ['test_label_2'])
+
+        # Cached labels are streamed from disk, without loading images if asked to
+        records = list(dataset_augmentation.iter_dataset(label_queries, self.tmp_dir, 1, load_images=False))
+        self.assertEqual([record.label for record in records], ['test_label_1', 'test_label_2'])
+        self.assertIsNone(records[0].image)
+
+    @patch('imagines.core.WebScrapper', WebScrapperMock)
+    @patch('requests.Session.get')
+    def test_dataset_augmentation_packed_output(self, get_mock):
+        """Unit tests for DataAugmentation"""
+
+        with open('./tests/test_artifacts/test_label/test_image.jpg', 'rb') as f:
+            image_data = f.read()
+
+        get_mock.return_value = MockResponse(image_data)
+
+        dataset_augmentation = DatasetAugmentation(
+            driver_type='chrome',
+            process_workers=0,
+        )
+        label_queries = {
+            'test_label_1': ['test_query_1_1'],
+            'test_label_2': ['test_query_2_1'],
+        }
+        packed_directory = os.path.join(self.tmp_dir, 'packed')
+        result = dataset_augmentation.augment_dataset(
+            label_queries,
+            self.tmp_dir,
+            1,
+            (24, 24),
+            resize_images=True,
+            return_data=False,
+            output_format=['files', 'shards', 'array'],
+            packed_directory=packed_directory
+        )
+        self.assertIsNone(result)
+
+        samples = list(iter_shards(os.path.join(packed_directory, 'shards')))
+        self.assertEqual([label for label, _ in samples], ['test_label_1', 'test_label_2'])
+        images, labels, label_names = load_array(os.path.join(packed_directory, 'array_24x24'))
+        self.assertEqual(images.shape, (2, 24, 24, 3))
+        self.assertEqual(label_names, ['test_label_1', 'test_label_2'])
+
+        with self.assertRaises(ValueError):
+            dataset_augmentation.augment_dataset(label_queries, self.tmp_dir, 1, (24, 24), output_format='zip')
+
+    @patch('imagines.core.WebScrapper', WebScrapperMock)
+    @patch('requests.Session.get')
+    def test_dataset_augmentation_multi_resolution(self, get_mock):
+        """Unit tests for DataAugmentation"""
+
+        with open('./tests/test_artifacts/test_label/test_image.jpg', 'rb') as f:
+            image_data = f.read()
+
+        get_mock.return_value = MockResponse(image_data)
+
+        dataset_augmentation = DatasetAugmentation(
+            driver_type='chrome',
+            process_workers=0,
+        )
+        label_queries = {
+            'test_label_1': ['test_query_1_1'],
+            'test_label_2': ['test_query_2_1'],
+        }
+        packed_directory = os.path.join(self.tmp_dir, 'packed')
+        images, labels = dataset_augmentation.augment_dataset(
+            label_queries,
+            self.tmp_dir,
+            1,
+            [(24, 24), (16, 8)],
+            resize_images=True,
+            output_format=['files', 'shards', 'array'],
+            packed_directory=packed_directory,
+            aspect_mode='crop'
+        )
+        self.assertEqual([image.size for image in images], [(24, 24), (24, 24)])
+
+        # The second label reuses the first one's image, along with its copy at the other shape
+        resolutions = os.path.join(self.tmp_dir, '.imagines', 'resolutions')
+        for label in label_queries:
+            file_name, = os.listdir(os.path.join(self.tmp_dir, label))
+            with Image.open(os.path.join(resolutions, '16x8', label, file_name)) as image:
+                self.assertEqual(image.size, (16, 8))
+
+        samples = list(iter_shards(os.path.join(packed_directory, 'shards_16x8'), decode=True))
+        self.assertEqual([image.size for _, image in samples], [(16, 8), (16, 8)])
+        arrays, _, _ = load_array(os.path.join(packed_directory, 'array_16x8'))
+        self.assertEqual(arrays.shape, (2, 8, 16, 3))
+        arrays, _, _ = load_array(os.path.join(packed_directory, 'array_24x24'))
+        self.assertEqual(arrays.shape, (2, 24, 24, 3))
+
+        # New shapes of cached labels are made by resize_images
+        other_resolutions = os.path.join(self.tmp_dir, 'other')
+        dataset_augmentation.augment_dataset(label_queries, self.tmp_dir, 1, [(24, 24), (12, 12)],
+                                             resize_images=True, resolutions_directory=other_resolutions)
+        self.assertEqual(sorted(os.listdir(os.path.join(other_resolutions, '12x12'))), sorted(label_queries))
+
+        with self.assertRaises(ValueError):
+            dataset_augmentation.augment_dataset(label_queries, self.tmp_dir, 1, [(24, 24), (16, 8)])
+        with self.assertRaises(ValueError):
+            dataset_augmentation.augment_dataset(label_queries, self.tmp_dir, 1, (24, 24), aspect_mode='pad')
+
+    @patch('requests.Session.get')
+    def test_dataset_augmentation_search_cache(self, get_mock):
+        """Unit tests for DataAugmentation"""
+
+        with open('./tests/test_artifacts/test_label/test_image.jpg', 'rb') as f:
+            get_mock.return_value = MockResponse(f.read())
+
+        searches = []
+
+        class CountingBackend(SearchBackend):
+            """Backend with three results, recording every search"""
+
+            cache_key = 'counting'
+
+            def iter_images(self, query, max_links_to_fetch, sleep_between_interactions=1):
+                searches.append(max_links_to_fetch)
+                yield from ['https://www.toyimageurl.com/{}'.format(i) for i in range(3)][:max_links_to_fetch]
+
+        metrics = Metrics()
+        search_cache = SearchCache(os.path.join(self.tmp_dir, 'searches.sqlite'))
+        label_queries = {'test_label': ['test_query']}
+
+        def run(output_directory, max_links_to_fetch):
+            dataset_augmentation = DatasetAugmentation(search_backend=CountingBackend, process_workers=0,
+                                                       metrics=metrics, search_cache=search_cache)
+            with dataset_augmentation:
+                list(dataset_augmentation.iter_dataset(label_queries, os.path.join(self.tmp_dir, output_directory),
+                                                       max_links_to_fetch, sleep_between_interactions=0,
+                                                       load_images=False))
+            return LabelManifest(os.path.join(self.tmp_dir, output_directory), 'test_label').query('test_query')
+
+        run('first', 2)
+        self.assertEqual(searches, [2])
+
+        # Enough URLs are cached, the search is skipped
+        progress = run('second', 2)
+        self.assertEqual(searches, [2])
+        self.assertEqual(progress.urls, ['https://www.toyimageurl.com/0', 'https://www.toyimageurl.com/1'])
+        self.assertTrue(progress.searched)
+
+        # The cached URLs come first, the search adds the others
+        progress = run('third', 4)
+        self.assertEqual(searches, [2, 4])
+        self.assertEqual(len(progress.urls), 3)
+
+        # The search found fewer URLs than asked for, there are no more to find
+        run('fourth', 4)
+        self.assertEqual(searches, [2, 4])
+        self.assertEqual(metrics.report().counters['search_cache_hits'], 2)
+        self.assertEqual(metrics.report().counters['search_cache_partial_hits'], 1)
+
+        # Factories of the same backend with other parameters are told apart by their key
+        dataset_augmentation = DatasetAugmentation(search_backend=partial(CountingBackend), process_workers=0,
+                                                   search_cache=search_cache, search_cache_key='other')
+        self.assertEqual(dataset_augmentation._search_backend_name(), 'custom:other')
+        with dataset_augmentation:
+            list(dataset_augmentation.iter_dataset(label_queries, os.path.join(self.tmp_dir, 'fifth'), 2,
+                                                   sleep_between_interactions=0, load_images=False))
+        self.assertEqual(searches, [2, 4, 2])
+        with self.assertRaises(ValueError):
+            DatasetAugmentation(search_backend=partial(CountingBackend), search_cache=search_cache)
+        search_cache.close()
+
+    @patch('requests.Session.get')
+    def test_dataset_augmentation_thumbnails(self, get_mock):
+        """Unit tests for DataAugmentation"""
+
+        with open('./tests/test_artifacts/test_label/test_image.jpg', 'rb') as f:
+            get_mock.return_value = MockResponse(f.read())
+
+        thumbnails = []
+        for i in range(3):
+            buffer = io.BytesIO()
+            Image.new('RGB', (48, 32), (80 * i, 20, 200)).save(buffer, format='JPEG')
+            thumbnails.append('data:image/jpeg;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii'))
+        searches = []
+
+        class ThumbnailBackend(SearchBackend):
+            """Backend whose results have 48x32 inline thumbnails"""
+
+            cache_key = 'thumbnail'
+
+            def iter_images(self, query, max_links_to_fetch, sleep_between_interactions=1):
+                searches.append(None)
+                yield from ['https://www.toyimageurl.com/{}'.format(i) for i in range(3)][:max_links_to_fetch]
+
+            def iter_thumbnails(self, query, max_links_to_fetch, min_size, sleep_between_interactions=1):
+                searches.append(min_size)
+                if min_size[0] > 48 or min_size[1] > 32:
+                    yield from self.iter_images(query, max_links_to_fetch, sleep_between_interactions)
+                    return
+                yield from thumbnails[:max_links_to_fetch]
+
+        label_queries = {'test_label': ['test_query']}
+        search_cache = SearchCache(os.path.join(self.tmp_dir, 'searches.sqlite'))
+
+        def run(output_directory, image_shape, **kwargs):
+            dataset_augmentation = DatasetAugmentation(search_backend=ThumbnailBackend, process_workers=0,
+                                                       search_cache=search_cache, **kwargs)
+            with dataset_augmentation:
+                return list(dataset_augmentation.iter_dataset(
+                    label_queries, os.path.join(self.tmp_dir, output_directory), 3,
+                    sleep_between_interactions=0, image_shape=image_shape))
+
+        # The thumbnails cover the shape, nothing is downloaded
+        records = run('small', (32, 32))
+        self.assertEqual(searches, [(32, 32)])
+        self.assertFalse(get_mock.called)
+        self.assertEqual(len(records), 3)
+        self.assertTrue(all(record.image.size == (32, 32) for record in records))
+
+        # Only a digest of the data: URLs is recorded, the data is gone once they are stored
+        keys = [url_key(thumbnail) for thumbnail in thumbnails]
+        progress = LabelManifest(os.path.join(self.tmp_dir, 'small'), 'test_label').query('test_query')
+        self.assertEqual(progress.urls, keys)
+        self.assertEqual(sorted(progress.saved), sorted(keys))
+        self.assertEqual(os.listdir(os.path.join(self.tmp_dir, 'small', '.imagines', 'inline', 'test_label')), [])
+        with ImageIndex(os.path.join(self.tmp_dir, 'small')) as index:
+            self.assertTrue(all(index.lookup_url(key) for key in keys))
+        stored_urls = search_cache._connection.execute('SELECT urls FROM searches').fetchone()[0]
+        self.assertEqual(json.loads(stored_urls), keys)
+
+        # Thumbnails too small for one of the shapes give way to full-size images
+        records = run('large', [(32, 32), (64, 64)])
+        self.assertEqual(searches[1:], [(64, 64), None])
+        self.assertEqual(get_mock.call_count, 3)
+
+        # Without resizing, or with thumbnails disabled, full-size images are searched for
+        run('original', None)
+        self.assertEqual(searches[3:], [None])
+        run('disabled', (32, 32), use_thumbnails=False)
+        self.assertEqual(len(searches), 4)
+        self.assertEqual(get_mock.call_count, 9)
+
+        # Thumbnail results are cached apart from the full-size ones
+        run('cached', (32, 32))
+        self.assertEqual(len(searches), 4)
+        self.assertEqual(get_mock.call_count, 9)
+        self.assertEqual(search_cache.get('test_query', 'custom:thumbnail:thumbnails:32x32').urls, thumbnails)
+        search_cache.close()
+
+    @patch('imagines.core.WebScrapper', WebScrapperMock)
+    @patch('requests.Session.get')
+    def test_dataset_augmentation_keep_original_bytes(self, get_mock):
+        """Unit tests for DataAugmentation"""
+
+        buffer = io.BytesIO()
+        Image.new('RGB', (40, 30), (10, 200, 30)).save(buffer, format='PNG')
+        image_data = buffer.getvalue()
+        get_mock.return_value = MockResponse(image_data, headers={'Content-Type': 'image/png'})
+
+        dataset_augmentation = DatasetAugmentation(driver_type='chrome', process_workers=0,
+                                                   keep_original_bytes=True)
+        records = list(dataset_augmentation._iter_persisted_images(
+            os.path.join(self.tmp_dir, 'original'), ['https://www.toyimageurl.com/image.png']))
+        self.assertTrue(records[0].path.endswith('.png'))
+        with open(records[0].path, 'rb') as f:
+            self.assertEqual(f.read(), image_data)
+        self.assertEqual(records[0].image.size, (40, 30))
+
+        # Resized images are encoded to the configured format
+        dataset_augmentation = DatasetAugmentation(driver_type='chrome', process_workers=0, use_index=False,
+                                                   keep_original_bytes=True, encode_format='webp')
+        records = list(dataset_augmentation._iter_persisted_images(
+            os.path.join(self.tmp_dir, 'resized'), ['https://www.toyimageurl.com/image.png'], image_shape=(20, 20)))
+        self.assertTrue(records[0].path.endswith('.webp'))
+        with Image.open(records[0].path) as image:
+            self.assertEqual((image.format, image.size), ('WEBP', (20, 20)))
+
+        with self.assertRaises(ValueError):
+            DatasetAugmentation(driver_type='chrome', encode_format='tiff')
+
+    @patch('imagines.core.WebScrapper', WebScrapperMock)
+    @patch('requests.Session.get')
+    def test_dataset_augmentation_iter_dataset_resume(self, get_mock):
+        """Unit tests for DataAugmentation"""
+
+        contents = {}
+        for i, color in enumerate([(255, 0, 0), (0, 255, 0), (0, 0, 255)]):
+            buffer = io.BytesIO()
+            Image.new('RGB', (16, 16), color).save(buffer, format='JPEG')
+            contents['https://www.toyimageurl.com/{}.jpg'.format(i)] = buffer.getvalue()
+
+        def get_mock_function(url, timeout, stream=False):
+            """Mock function for requests.Session.get"""
+            return MockResponse(contents[url])
+
+        get_mock.side_effect = get_mock_function
+        search_results = {
+            'test_query_1': list(contents)[:2],
+            'test_query_2': list(contents)[2:],
+        }
+        searches = []
+
+        def iter_images(query, max_links_to_fetch, sleep_between_interactions):
+            """Mock function for WebScrapper.iter_images"""
+            searches.append(query)
+            yield from search_results[query]
+
+        dataset_augmentation = DatasetAugmentation(
+            driver_type='chrome',
+            max_workers=1,
+            process_workers=0,
+        )
+        dataset_augmentation.driver.iter_images = iter_images
+        label_queries = {'test_label': ['test_query_1']}
+
+        # Interrupted after the first image
+        records = dataset_augmentation.iter_dataset(label_queries, self.tmp_dir, 2)
+        next(records)
+        records.close()
+        self.assertEqual(searches, ['test_query_1'])
+        self.assertEqual(get_mock.call_count, 1)
+
+        # Resuming neither searches again nor downloads the saved image
+        records = list(dataset_augmentation.iter_dataset(label_queries, self.tmp_dir, 2))
+        self.assertEqual(len(records), 2)
+        self.assertEqual(searches, ['test_query_1'])
+        self.assertEqual(get_mock.call_count, 2)
+
+        # A complete label is loaded from disk
+        records = list(dataset_augmentation.iter_dataset(label_queries, self.tmp_dir, 2))
+        self.assertEqual(len(records), 2)
+        self.assertEqual(searches, ['test_query_1'])
+
+        # Only the new query is searched and downloaded
+        label_queries = {'test_label': ['test_query_1', 'test_query_2']}
+        records = list(dataset_augmentation.iter_dataset(label_queries, self.tmp_dir, 2))
+        self.assertEqual(len(records), 3)
+        self.assertEqual(len(set(record.path for record in records)), 3)
+        self.assertEqual(searches, ['test_query_1', 'test_query_2'])
+
+    @patch('imagines.core.WebScrapper', WebScrapperMock)
+    @patch('requests.Session.get')
+    def test_dataset_augmentation_iter_dataset_resume_failures(self, get_mock):
+        """Unit tests for DataAugmentation"""
+
+        with open('./tests/test_artifacts/test_label/test_image.jpg', 'rb') as f:
+            image_data = f.read()
+        image_urls = ['https://www.toyimageurl.com/unavailable', 'https://www.toyimageurl.com/missing',
+                      'https://dead.invalid/image.jpg']
+        status_codes = {image_urls[0]: 503, image_urls[1]: 404}
+
+        def get_mock_function(url, timeout, stream=False):
+            """Mock function for requests.Session.get"""
+            if url not in status_codes:
+                raise requests.ConnectionError('Name or service not known')
+            return MockResponse(image_data, status_codes[url])
+
+        get_mock.side_effect = get_mock_function
+        searches = []
+
+        def iter_images(query, max_links_to_fetch, sleep_between_interactions):
+            """Mock function for WebScrapper.iter_images"""
+            searches.append(query)
+            yield from image_urls
+
+        dataset_augmentation = DatasetAugmentation(driver_type='chrome', max_workers=1, process_workers=0,
+                                                   http_client=HttpClient(max_retries=0))
+        dataset_augmentation.driver.iter_images = iter_images
+        label_queries = {'test_label': ['test_query']}
+
+        # A first run killed right after creating the label folder is not taken for a complete one
+        os.makedirs(os.path.join(self.tmp_dir, 'test_label'))
+        self.assertEqual(list(dataset_augmentation.iter_dataset(label_queries, self.tmp_dir, 3)), [])
+        self.assertEqual(searches, ['test_query'])
+
+        # Only the missing image is final, the others are downloaded again on the next run
+        progress = LabelManifest(self.tmp_dir, 'test_label').query('test_query')
+        self.assertEqual(progress.skipped, {image_urls[1]: 'download'})
+        self.assertEqual(progress.pending_urls(), [image_urls[0], image_urls[2]])
+        self.assertEqual(progress.failed, {image_urls[0]: 1, image_urls[2]: 1})
+
+        status_codes[image_urls[0]] = 200
+        records = list(dataset_augmentation.iter_dataset(label_queries, self.tmp_dir, 3))
+        self.assertEqual(len(records), 1)
+        self.assertEqual(searches, ['test_query'])
+        progress = LabelManifest(self.tmp_dir, 'test_label').query('test_query')
+        self.assertEqual(progress.failed, {image_urls[2]: 2})
+        self.assertFalse(progress.is_complete(3))
+
+        # The dead host is given up on after MAX_DOWNLOAD_ATTEMPTS runs, which completes the label
+        self.assertEqual(len(list(dataset_augmentation.iter_dataset(label_queries, self.tmp_dir, 3))), 1)
+        progress = LabelManifest(self.tmp_dir, 'test_label').query('test_query')
+        self.assertEqual(progress.skipped, {image_urls[1]: 'download', image_urls[2]: 'download'})
+        self.assertEqual(progress.failed, {})
+        self.assertTrue(LabelManifest(self.tmp_dir, 'test_label').is_complete(['test_query'], 3))
+        calls = [call[0][0] for call in get_mock.call_args_list]
+        self.assertEqual(calls.count(image_urls[2]), MAX_DOWNLOAD_ATTEMPTS)
+
+    @patch('imagines.core.WebScrapper', WebScrapperMock)
+    @patch('requests.Session.get')
+    def test_dataset_augmentation_run_report(self, get_mock):
+        """Unit tests for DataAugmentation"""
+
+        with open('./tests/test_artifacts/test_label/test_image.jpg', 'rb') as f:
+            image_data = f.read()
+
+        get_mock.return_value = MockResponse(image_data)
+        events = []
+        dataset_augmentation = DatasetAugmentation(
+            driver_type='chrome',
+            process_workers=0,
+            metrics=Metrics(hooks=[events.append]),
+        )
+        label_queries = {'test_label_1': ['test_query_1'], 'test_label_2': ['test_query_2']}
+        images, labels, report = dataset_augmentation.augment_dataset(
+            label_queries, self.tmp_dir, 1, (32, 32), resize_images=True, return_data=False, return_report=True)
+        self.assertIsNone(images)
+        self.assertEqual(report.stages['search']['succeeded'], 2)
+        self.assertEqual(report.stages['download']['succeeded'], 1)
+        self.assertEqual(report.stages['download']['bytes'], len(image_data))
+        for stage in ('decode', 'resize', 'encode', 'write'):
+            self.assertEqual(report.stages[stage]['succeeded'], 1)
+        # The same URL is linked into the second label instead of being downloaded again
+        self.assertEqual(report.counters, {'images_saved': 1, 'images_reused': 1})
+        self.assertEqual(len(events), sum(stats['succeeded'] for stats in report.stages.values()))
+        self.assertIn('imagines_stage_bytes_total{stage="download"} %d' % len(image_data), report.to_prometheus())
+
+        # Cached labels are loaded back, failed downloads are counted by reason
+        get_mock.return_value.status_code = 404
+        dataset_augmentation = DatasetAugmentation(driver_type='chrome', process_workers=0, use_index=False)
+        label_queries['test_label_3'] = ['test_query_3']
+        _, _, report = dataset_augmentation.augment_dataset(
+            label_queries, self.tmp_dir, 1, (32, 32), return_report=True)
+        self.assertEqual(report.stages['cache_load']['succeeded'], 2)
+        self.assertEqual(report.stages['download']['failures'], {'http_404': 1})
+        self.assertEqual(report.to_dict()['counters'], {'images_failed': 1})
+
+    @patch('imagines.core.WebScrapper', WebScrapperMock)
+    @patch('requests.Session.get')
+    def test_dataset_augmentation_rejects_responses(self, get_mock):
+        """Unit tests for DataAugmentation"""
+
+        with open('./tests/test_artifacts/test_label/test_image.jpg', 'rb') as f:
+            image_data = f.read()
+        responses = {
+            'https://www.toyimageurl.com/page': MockResponse(b'<html></html>', headers={'Content-Type': 'text/html'}),
+            'https://www.toyimageurl.com/small': MockResponse(image_data),
+        }
+        get_mock.side_effect = lambda url, timeout, stream=False: responses[url]
+
+        dataset_augmentation = DatasetAugmentation(driver_type='chrome', process_workers=0, min_image_size=(4000, 10))
+        progress = QueryManifest()
+        records = list(dataset_augmentation._iter_persisted_images(
+            os.path.join(self.tmp_dir, 'test_label'), list(responses), progress=progress))
+        self.assertEqual(records, [])
+        self.assertEqual(progress.skipped, {'https://www.toyimageurl.com/page': 'content_type',
+                                            'https://www.toyimageurl.com/small': 'too_small'})
+
+    @patch('imagines.core.WebScrapper')
+    def test_dataset_augmentation_offline(self, webscrapper_mock):
+        """Unit tests for DataAugmentation"""
+
+        os.makedirs(os.path.join(self.tmp_dir, 'test_label'))
+        shutil.copyfile('./tests/test_artifacts/test_label/test_image.jpg',
+                        os.path.join(self.tmp_dir, 'test_label', 'test_image.jpg'))
+
+        # No browser is started until a search is needed
+        dataset_augmentation = DatasetAugmentation(driver_type='chrome')
+        self.assertFalse(webscrapper_mock.called)
+        dataset_augmentation.close()
+
+        dataset_augmentation = DatasetAugmentation(driver_type='chrome', offline=True)
+        label_queries = {'test_label': ['test_query'], 'missing_label': ['missing_query']}
+        images, labels = dataset_augmentation.augment_dataset(label_queries, self.tmp_dir, 5, (32, 32))
+        self.assertEqual(labels, ['test_label'])
+        self.assertEqual(len(images), 1)
+        self.assertFalse(webscrapper_mock.called)
+        self.assertFalse(os.path.exists(os.path.join(self.tmp_dir, 'missing_label')))
+
+        images, labels = dataset_augmentation.augment_dataset(label_queries, self.tmp_dir, 5, (32, 32), lazy=True)
+        self.assertIsInstance(images, LazyImageDataset)
+        self.assertEqual(images.labels, ['test_label'])
+        self.assertEqual(images[0].mode, 'RGB')
+
+        with self.assertRaises(RuntimeError):
+            dataset_augmentation.driver
+        with self.assertRaises(ValueError):
+            list(dataset_augmentation.iter_dataset(label_queries, self.tmp_dir, 5, cache_data=False))
+
+    @patch('imagines.core.WebScrapper', WebScrapperMock)
+    def test_dataset_augmentation_tensor_cache(self):
+        """Unit tests for DataAugmentation"""
+
+        image_folder = os.path.join(self.tmp_dir, 'test_label')
+        shutil.copytree('./tests/test_artifacts/test_label', image_folder)
+        metrics = Metrics()
+        dataset_augmentation = DatasetAugmentation(driver_type='chrome', metrics=metrics, tensor_cache=True)
+
+        images, paths = dataset_augmentation.load_label_tensor(image_folder, (16, 8))
+        self.assertEqual(images.shape, (2, 8, 16, 3))
+        self.assertEqual(sorted(paths), sorted(os.path.join(image_folder, f) for f in os.listdir(image_folder)))
+        cached, cached_paths = dataset_augmentation.load_label_tensor(image_folder, (16, 8), max_images=1)
+        self.assertIsInstance(cached, np.memmap)
+        self.assertEqual(cached_paths, paths[:1])
+        np.testing.assert_array_equal(cached, images[:1])
+        self.assertEqual(metrics.report().counters, {'tensor_cache_misses': 1, 'tensor_cache_hits': 1})
+
+        # Changing the folder invalidates the array
+        os.remove(paths[0])
+        images, paths = dataset_augmentation.load_label_tensor(image_folder, (16, 8))
+        self.assertEqual(images.shape, (1, 8, 16, 3))
+        self.assertEqual(metrics.report().counters['tensor_cache_misses'], 2)
+
+        # Cached labels of resized datasets are loaded from the array
+        label_queries = {'test_label': ['test_query']}
+        for _ in range(2):
+            images, labels, report = dataset_augmentation.augment_dataset(
+                label_queries, self.tmp_dir, 5, (16, 8), resize_images=True, return_report=True)
+            self.assertEqual(labels, ['test_label'])
+            self.assertEqual(images[0].size, (16, 8))
+        self.assertEqual(report.counters, {'tensor_cache_hits': 1})
+
+    @patch('imagines.core.WebScrapper', WebScrapperMock)
+    @patch('imagines.core.DatasetAugmentation._iter_persisted_images')
+    def test_dataset_augmentation_closes_sessions_on_error(self, persist_images_mock):
+        """Unit tests for DataAugmentation"""
+
+        persist_images_mock.side_effect = RuntimeError('disk full')
+        dataset_augmentation = DatasetAugmentation(
+            driver_type='chrome',
+            search_workers=2,
+        )
+        with patch.object(WebScrapperMock, 'close_session') as close_session_mock:
+            with self.assertRaises(RuntimeError):
+                dataset_augmentation.augment_dataset({'test_label': ['test_query']}, self.tmp_dir, 1, (224, 224))
+            self.assertTrue(close_session_mock.called)
+        self.assertIsNone(dataset_augmentation._search_pool)
+
+    def test_dataset_augmentation_forgets_discarded_driver(self):
+        """The search session closed by the pool after a failure is not handed out again"""
+
+        class FailingOnceBackend(SearchBackend):
+            """Backend whose first session fails its search"""
+
+            created = []
+
+            def __init__(self):
+                self.closed = False
+                self.created.append(self)
+
+            def iter_images(self, query, max_links_to_fetch, sleep_between_interactions=1):
+                if len(self.created) == 1:
+                    raise RuntimeError('browser crashed')
+                yield 'https://www.toyimageurl.com/0'
+
+            def close_session(self):
+                self.closed = True
+
+        with DatasetAugmentation(search_backend=FailingOnceBackend, process_workers=0) as dataset_augmentation:
+            first = dataset_augmentation.driver
+            self.assertEqual(list(dataset_augmentation._get_search_pool().stream('query', 1)),
+                             ['https://www.toyimageurl.com/0'])
+            self.assertTrue(first.closed)
+            self.assertIsNot(dataset_augmentation.driver, first)
+            self.assertFalse(dataset_augmentation.driver.closed)
+
+    def test_dataset_augmentation_resize_images_progress(self):
+        """Without a process pool, images are resized as the progress bar advances"""
+        os.makedirs(os.path.join(self.tmp_dir, 'label'))
+        for i in range(3):
+            shutil.copy('./tests/test_artifacts/test_label/test_image.jpg',
+                        os.path.join(self.tmp_dir, 'label', '{}.jpg'.format(i)))
+        resized = []
+        progress = []
+
+        def resize_file_mock(file_path, *args):
+            resized.append(file_path)
+
+        def tqdm_mock(iterable, **kwargs):
+            for item in iterable:
+                progress.append(len(resized))
+                yield item
+
+        with patch('imagines.core.resize_file', resize_file_mock), patch('imagines.core.tqdm', tqdm_mock):
+            DatasetAugmentation(process_workers=0).resize_images(self.tmp_dir, (224, 224))
+        self.assertEqual(progress, [1, 2, 3])
+
     @patch('imagines.core.WebScrapper', WebScrapperMock)
     def test_dataset_augmentation_resize_images(self):
         """Unit tests for DataAugmentation"""
@@ -222,6 +923,36 @@ class DatasetAugmentationUnitTests(unittest.TestCase):
         image = Image.open(image_file).convert('RGB')
         self.assertEqual(image.size, image_shape)
 
+        # Images already resized are checked in this process, without going through the process pool
+        with patch.object(dataset_augmentation, '_submit', wraps=dataset_augmentation._submit) as submit_mock:
+            dataset_augmentation.resize_images(self.tmp_dir, image_shape, skip_if_sized=True)
+            self.assertFalse(submit_mock.called)
+            dataset_augmentation.resize_images(self.tmp_dir, (100, 100), skip_if_sized=True)
+            self.assertEqual(submit_mock.call_count, 1)
+
+    @patch('imagines.core.WebScrapper', WebScrapperMock)
+    @patch('requests.Session.get')
+    def test_dataset_augmentation_persist_images_resized(self, get_mock):
+        """Unit tests for DataAugmentation"""
+
+        with open('./tests/test_artifacts/test_label/test_image.jpg', 'rb') as f:
+            image_data = f.read()
+
+        get_mock.return_value = MockResponse(image_data)
+
+        dataset_augmentation = DatasetAugmentation(
+            driver_type='chrome',
+            process_workers=0,
+        )
+        target_folder = os.path.join(self.tmp_dir, 'label')
+        records = list(dataset_augmentation._iter_persisted_images(
+            target_folder, ['https://www.toyimageurl.com'], image_shape=(32, 32)))
+
+        # Images are resized before being written
+        self.assertEqual(records[0].image.size, (32, 32))
+        with Image.open(records[0].path) as image:
+            self.assertEqual(image.size, (32, 32))
+
     @patch('imagines.core.WebScrapper', WebScrapperMock)
     def test_dataset_augmentation_load_label_images(self):
         """Unit tests for DataAugmentation"""
@@ -244,3 +975,9 @@ class DatasetAugmentationUnitTests(unittest.TestCase):
         # max_images
         images = dataset_augmentation._load_label_images(image_folder, max_images=1)
         self.assertEqual(len(images), 1)
+
+        # Lazy counterpart
+        dataset = dataset_augmentation.load_label_dataset(image_folder)
+        self.assertEqual(len(dataset), 2)
+        self.assertEqual(dataset.labels, ['test_label', 'test_label'])
+        self.assertEqual(dataset[0].tobytes(), dataset_augmentation._load_label_images(image_folder)[0].tobytes())
@@ -0,0 +1,134 @@
+"""Unit tests for ConcurrentDownloader class"""
+
+import threading
+import time
+import unittest
+import os
+
+from imagines.download import ByteBudget, ConcurrentDownloader
+
+import logging
+
+# Set up logging
+logging.basicConfig(level=os.getenv("LOGGER_LEVEL", logging.WARNING))
+logger = logging.getLogger("Dataset Download UnitTests")
+
+class ConcurrentDownloaderUnitTests(unittest.TestCase):
+    """Unit tests for ConcurrentDownloader"""
+
+    def test_downloader_returns_every_url(self):
+        """Unit tests for ConcurrentDownloader"""
+        urls = ['https://host{}.com/{}.jpg'.format(i % 3, i) for i in range(20)]
+        downloader = ConcurrentDownloader(fetch=lambda url, reserve: url.encode(), max_workers=4)
+        results = list(downloader.download(urls))
+        self.assertEqual(sorted(r.url for r in results), sorted(urls))
+        for result in results:
+            self.assertEqual(result.content, result.url.encode())
+            self.assertIsNone(result.error)
+
+    def test_downloader_reports_errors(self):
+        """Unit tests for ConcurrentDownloader"""
+        def fetch(url, reserve):
+            if 'bad' in url:
+                raise IOError('connection reset')
+            return b'data'
+
+        downloader = ConcurrentDownloader(fetch=fetch, max_workers=2)
+        results = {r.url: r for r in downloader.download(['https://a.com/bad', 'https://a.com/good'])}
+        self.assertIsInstance(results['https://a.com/bad'].error, IOError)
+        self.assertIsNone(results['https://a.com/bad'].content)
+        self.assertEqual(results['https://a.com/good'].content, b'data')
+
+    def test_downloader_per_host_limit(self):
+        """Unit tests for ConcurrentDownloader"""
+        lock = threading.Lock()
+        running = {'a.com': 0, 'b.com': 0}
+        peak = {'a.com': 0, 'b.com': 0}
+
+        def fetch(url, reserve):
+            host = url.split('/')[2]
+            with lock:
+                running[host] += 1
+                peak[host] = max(peak[host], running[host])
+            time.sleep(0.01)
+            with lock:
+                running[host] -= 1
+            return b'x'
+
+        urls = ['https://a.com/{}'.format(i) for i in range(12)] + ['https://b.com/{}'.format(i) for i in range(12)]
+        downloader = ConcurrentDownloader(fetch=fetch, max_workers=8, max_per_host=2)
+        self.assertEqual(len(list(downloader.download(urls))), 24)
+        self.assertLessEqual(peak['a.com'], 2)
+        self.assertLessEqual(peak['b.com'], 2)
+        self.assertEqual(peak['b.com'], 2)
+
+    def test_downloader_byte_budget(self):
+        """Unit tests for ConcurrentDownloader"""
+        downloader = ConcurrentDownloader(fetch=lambda url, reserve: b'x' * 100,
+                                          max_workers=4,
+                                          max_inflight_bytes=250)
+        results = downloader.download(['https://a.com/{}'.format(i) for i in range(10)])
+        held = [next(results)]
+        # Holding a result keeps its bytes reserved while the rest keep arriving
+        time.sleep(0.05)
+        held.extend(results)
+        self.assertEqual(len(held), 10)
+
+    def test_downloader_reserves_while_streaming(self):
+        """Unit tests for ConcurrentDownloader"""
+        lock = threading.Lock()
+        held = {}
+        peak = [0]
+
+        def fetch(url, reserve):
+            """Receives a 400 byte body in chunks, reserving them as they come in"""
+            content = b''
+            for _ in range(4):
+                time.sleep(0.002)
+                content += b'x' * 100
+                reserve(len(content))
+                with lock:
+                    held[url] = len(content)
+                    peak[0] = max(peak[0], sum(held.values()))
+            if url.endswith('bad'):
+                with lock:
+                    del held[url]
+                raise IOError('connection reset')
+            return content
+
+        downloader = ConcurrentDownloader(fetch=fetch, max_workers=8, max_inflight_bytes=1000)
+        urls = ['https://a{}.com/{}'.format(i % 8, 'bad' if i % 5 == 0 else i) for i in range(40)]
+        count = 0
+        for result in downloader.download(urls):
+            # The consumer is slow, bodies keep arriving meanwhile
+            time.sleep(0.005)
+            with lock:
+                held.pop(result.url, None)
+            count += 1
+        self.assertEqual(count, 40)
+        # Bodies still being received count too: at most the budget plus one payload
+        self.assertLessEqual(peak[0], 1000 + 400)
+        self.assertGreater(peak[0], 400)
+
+    def test_byte_budget_blocks_until_release(self):
+        """Unit tests for ByteBudget"""
+        budget = ByteBudget(100)
+        budget.acquire(80)
+        acquired = threading.Event()
+
+        def acquire():
+            budget.acquire(50)
+            acquired.set()
+
+        thread = threading.Thread(target=acquire)
+        thread.start()
+        self.assertFalse(acquired.wait(0.05))
+        budget.release(80)
+        self.assertTrue(acquired.wait(1))
+        thread.join()
+        self.assertEqual(budget.in_flight, 50)
+
+    def test_downloader_invalid_arguments(self):
+        """Unit tests for ConcurrentDownloader"""
+        with self.assertRaises(ValueError):
+            ConcurrentDownloader(fetch=lambda url, reserve: b'', max_workers=0)
@@ -0,0 +1,65 @@
+"""Unit tests for driver resolution"""
+
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+import os
+from unittest.mock import patch
+
+from imagines.drivers import cached_driver_path, resolve_driver_path
+
+import logging
+
+# Set up logging
+logging.basicConfig(level=os.getenv("LOGGER_LEVEL", logging.WARNING))
+logger = logging.getLogger("Dataset Drivers UnitTests")
+
+class DriversUnitTests(unittest.TestCase):
+    """Unit tests for driver resolution"""
+
+    def setUp(self):
+        """Set up all tests."""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.driver_path = os.path.join(self.tmp_dir, 'chromedriver')
+        with open(self.driver_path, 'w') as f:
+            f.write('driver')
+        self.environ = patch.dict(os.environ, {'IMAGINES_CACHE_DIR': os.path.join(self.tmp_dir, 'cache')})
+        self.environ.start()
+
+    def tearDown(self):
+        """Tear down all tests."""
+        self.environ.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    @patch('webdriver_manager.chrome.ChromeDriverManager')
+    def test_resolve_driver_path_cached(self, manager_mock):
+        """Unit tests for resolve_driver_path"""
+        manager_mock.return_value.install.return_value = self.driver_path
+        self.assertIsNone(cached_driver_path('chrome'))
+        self.assertEqual(resolve_driver_path('chrome'), self.driver_path)
+        self.assertEqual(resolve_driver_path('chrome'), self.driver_path)
+        # The online lookup only happens once
+        self.assertEqual(manager_mock.return_value.install.call_count, 1)
+        self.assertEqual(cached_driver_path('chrome'), self.driver_path)
+        self.assertIsNone(cached_driver_path('chromium'))
+
+        resolve_driver_path('chrome', refresh=True)
+        self.assertEqual(manager_mock.return_value.install.call_count, 2)
+
+        # A driver that disappeared is resolved again
+        os.remove(self.driver_path)
+        self.assertIsNone(cached_driver_path('chrome'))
+
+    def test_resolve_driver_path_invalid(self):
+        """Unit tests for resolve_driver_path"""
+        with self.assertRaises(ValueError):
+            resolve_driver_path('firefox')
+
+    def test_import_is_lazy(self):
+        """Unit tests for the imagines package imports"""
+        output = subprocess.check_output([
+            sys.executable, '-c',
+            'import sys, imagines; print("selenium" in sys.modules, "webdriver_manager" in sys.modules)'])
+        self.assertEqual(output.decode().split(), ['False', 'False'])
@@ -0,0 +1,157 @@
+"""Unit tests for the bounded image fetch"""
+
+import base64
+import io
+import threading
+import unittest
+import os
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image
+
+from imagines.fetch import RejectedResponse, decode_data_url, fetch_image, sniff_image
+from imagines.http_client import HttpClient
+
+import logging
+
+# Set up logging
+logging.basicConfig(level=os.getenv("LOGGER_LEVEL", logging.WARNING))
+logger = logging.getLogger("Dataset Fetch UnitTests")
+
+def encode(size, image_format='JPEG'):
+    """Encodes a blank image"""
+    buffer = io.BytesIO()
+    Image.new('RGB', size, (120, 30, 200)).save(buffer, format=image_format)
+    return buffer.getvalue()
+
+class ImageHandler(BaseHTTPRequestHandler):
+    """Serves images, and responses that are not worth downloading"""
+
+    protocol_version = 'HTTP/1.1'
+    sent = {}
+
+    def do_GET(self):
+        if self.path == '/image.jpg':
+            self._reply(encode((200, 150)), 'image/jpeg')
+        elif self.path == '/image.png':
+            self._reply(encode((200, 150), 'PNG'), 'application/octet-stream')
+        elif self.path == '/tiny.jpg':
+            self._reply(encode((20, 15)), 'image/jpeg')
+        elif self.path == '/page.html':
+            self._reply(b'<html>Not found</html>', 'text/html; charset=utf-8')
+        elif self.path == '/fake.jpg':
+            self._reply(b'<html>' + b' ' * 300000 + b'</html>', 'image/jpeg')
+        elif self.path == '/announced.jpg':
+            self._reply(encode((200, 150)), 'image/jpeg', content_length=10 ** 9)
+        elif self.path == '/endless.jpg':
+            # An image header followed by far more data than the cap, without Content-Length
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/jpeg')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            ImageHandler.sent[self.path] = 0
+            try:
+                self.wfile.write(encode((200, 150)))
+                for _ in range(1000):
+                    self.wfile.write(b'\0' * 65536)
+                    ImageHandler.sent[self.path] += 65536
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+        else:
+            self._reply(b'missing', 'text/plain', status=404)
+
+    def _reply(self, body, content_type, status=200, content_length=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(content_length or len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+class FetchUnitTests(unittest.TestCase):
+    """Unit tests for fetch_image"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Set up all tests."""
+        super(FetchUnitTests, cls).setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), ImageHandler)
+        cls.server.daemon_threads = True
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+        cls.base_url = 'http://127.0.0.1:{}'.format(cls.server.server_address[1])
+
+    @classmethod
+    def tearDownClass(cls):
+        """Tear down all tests."""
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        """Set up all tests."""
+        self.http_client = HttpClient(max_retries=0)
+
+    def tearDown(self):
+        """Tear down all tests."""
+        self.http_client.close()
+
+    def assertRejected(self, path, reason, **kwargs):
+        """Asserts that fetching ``path`` is rejected for ``reason``"""
+        with self.assertRaises(RejectedResponse) as context:
+            fetch_image(self.http_client, self.base_url + path, **kwargs)
+        self.assertEqual(context.exception.reason, reason)
+
+    def test_fetch_image(self):
+        """Unit tests for fetch_image"""
+        content = fetch_image(self.http_client, self.base_url + '/image.jpg', min_image_size=(100, 100))
+        self.assertEqual(content, encode((200, 150)))
+        # Bytes are reserved as they come in, starting with the announced length
+        reserved = []
+        content = fetch_image(self.http_client, self.base_url + '/image.jpg', chunk_size=256,
+                              reserve=reserved.append)
+        self.assertEqual(reserved[0], len(content))
+        self.assertEqual(reserved[1:], sorted(reserved[1:]))
+        self.assertEqual(reserved[-1], len(content))
+        self.assertGreater(len(reserved), 2)
+        # The body decides when the server does not say what it sends
+        content = fetch_image(self.http_client, self.base_url + '/image.png')
+        self.assertEqual(sniff_image(content), ('PNG', 200, 150))
+
+    def test_fetch_image_rejections(self):
+        """Unit tests for fetch_image"""
+        self.assertRejected('/page.html', 'content_type')
+        self.assertRejected('/fake.jpg', 'not_an_image')
+        self.assertRejected('/tiny.jpg', 'too_small', min_image_size=(100, 100))
+        self.assertRejected('/announced.jpg', 'too_large', max_bytes=1024 * 1024)
+        self.assertRejected('/endless.jpg', 'too_large', max_bytes=1024 * 1024)
+        # The download stopped shortly after the cap
+        self.assertLess(ImageHandler.sent['/endless.jpg'], 16 * 1024 * 1024)
+
+    def test_fetch_data_url(self):
+        """Unit tests for fetch_image"""
+        content = encode((120, 90))
+        data_url = 'data:image/jpeg;base64,' + base64.b64encode(content).decode('ascii')
+        self.assertEqual(decode_data_url(data_url), ('image/jpeg', content))
+        # Decoded in place, the client is never asked for it
+        self.assertEqual(fetch_image(None, data_url, min_image_size=(100, 50)), content)
+        with self.assertRaises(RejectedResponse) as context:
+            fetch_image(None, data_url, min_image_size=(200, 50))
+        self.assertEqual(context.exception.reason, 'too_small')
+        with self.assertRaises(RejectedResponse) as context:
+            fetch_image(None, 'data:text/plain,not%20an%20image')
+        self.assertEqual(context.exception.reason, 'content_type')
+        with self.assertRaises(RejectedResponse) as context:
+            fetch_image(None, 'data:image/jpeg;base64,@@@')
+        self.assertEqual(context.exception.reason, 'not_an_image')
+
+    def test_sniff_image(self):
+        """Unit tests for sniff_image"""
+        content = encode((640, 480))
+        self.assertEqual(sniff_image(content[:2048]), ('JPEG', 640, 480))
+        self.assertIsNone(sniff_image(content[:2]))
+        self.assertIsNone(sniff_image(b'<html></html>'))
@@ -0,0 +1,65 @@
+"""Unit tests for the atomic file helpers"""
+
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+import os
+
+from imagines.files import replace_json, temporary_path
+
+import logging
+
+# Set up logging
+logging.basicConfig(level=os.getenv("LOGGER_LEVEL", logging.WARNING))
+logger = logging.getLogger("Dataset Files UnitTests")
+
+
+class FilesUnitTests(unittest.TestCase):
+    """Unit tests for replace_json"""
+
+    def setUp(self):
+        """Set up all tests."""
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Tear down all tests."""
+        shutil.rmtree(self.tmp_dir)
+
+    def test_replace_json_concurrent_writers(self):
+        """Unit tests for replace_json"""
+        path = os.path.join(self.tmp_dir, 'state.json')
+        self.assertNotEqual(temporary_path(path), temporary_path(path))
+        errors = []
+
+        def write(writer):
+            """Rewrites the file over and over, with content only this writer produces"""
+            try:
+                for i in range(50):
+                    replace_json(path, {'writer': writer, 'values': [writer] * 200, 'i': i})
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=write, args=(writer,)) for writer in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        with open(path) as f:
+            content = json.load(f)
+        self.assertEqual(content['values'], [content['writer']] * 200)
+        # No temporary file is left behind
+        self.assertEqual(os.listdir(self.tmp_dir), ['state.json'])
+
+    def test_replace_json_failure(self):
+        """Unit tests for replace_json"""
+        path = os.path.join(self.tmp_dir, 'state.json')
+        replace_json(path, {'value': 1})
+        with self.assertRaises(TypeError):
+            replace_json(path, {'value': object()})
+        # The previous content is kept and the partial file removed
+        with open(path) as f:
+            self.assertEqual(json.load(f), {'value': 1})
+        self.assertEqual(os.listdir(self.tmp_dir), ['state.json'])
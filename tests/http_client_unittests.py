@@ -0,0 +1,98 @@
+"""Unit tests for HttpClient class"""
+
+import threading
+import unittest
+import os
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from imagines.http_client import HttpClient
+
+import logging
+
+# Set up logging
+logging.basicConfig(level=os.getenv("LOGGER_LEVEL", logging.WARNING))
+logger = logging.getLogger("Dataset HttpClient UnitTests")
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    """Serves /ok, fails /flaky twice with a 503 and rate limits /limited once"""
+
+    protocol_version = 'HTTP/1.1'
+    hits = {}
+
+    def do_GET(self):
+        hits = FlakyHandler.hits[self.path] = FlakyHandler.hits.get(self.path, 0) + 1
+        if self.path == '/flaky' and hits <= 2:
+            self._reply(503, b'unavailable')
+        elif self.path == '/limited' and hits <= 1:
+            self._reply(429, b'slow down', {'Retry-After': '0'})
+        elif self.path == '/broken':
+            self._reply(500, b'broken')
+        else:
+            self._reply(200, b'image bytes')
+
+    def _reply(self, status, body, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class HttpClientUnitTests(unittest.TestCase):
+    """Unit tests for HttpClient"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Set up all tests."""
+        super(HttpClientUnitTests, cls).setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), FlakyHandler)
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+        cls.base_url = 'http://127.0.0.1:{}'.format(cls.server.server_address[1])
+
+    @classmethod
+    def tearDownClass(cls):
+        """Tear down all tests."""
+        cls.server.shutdown()
+        cls.server.server_close()
+        super(HttpClientUnitTests, cls).tearDownClass()
+
+    def setUp(self):
+        """Set up all tests."""
+        FlakyHandler.hits = {}
+        self.client = HttpClient(backoff_factor=0.01)
+
+    def tearDown(self):
+        """Tear down all tests."""
+        self.client.close()
+
+    def test_http_client_reuses_connections(self):
+        """Unit tests for HttpClient"""
+        for _ in range(5):
+            response = self.client.get(self.base_url + '/ok')
+            self.assertEqual(response.content, b'image bytes')
+        stats = self.client.stats.as_dict()
+        self.assertEqual(stats['requests'], 5)
+        self.assertEqual(stats['new_connections'], 1)
+        self.assertEqual(stats['reused_connections'], 4)
+
+    def test_http_client_retries_server_errors(self):
+        """Unit tests for HttpClient"""
+        response = self.client.get(self.base_url + '/flaky')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.stats.as_dict()['retries'], 2)
+
+    def test_http_client_honours_retry_after(self):
+        """Unit tests for HttpClient"""
+        response = self.client.get(self.base_url + '/limited')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.stats.as_dict()['retries'], 1)
+
+    def test_http_client_gives_up_after_max_retries(self):
+        """Unit tests for HttpClient"""
+        response = self.client.get(self.base_url + '/broken')
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(FlakyHandler.hits['/broken'], self.client.max_retries + 1)
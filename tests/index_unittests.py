@@ -0,0 +1,107 @@
+"""Unit tests for ImageIndex class"""
+
+import sqlite3
+import unittest
+from unittest.mock import patch
+import os
+import tempfile
+
+from imagines.index import ImageIndex
+
+import logging
+
+# Set up logging
+logging.basicConfig(level=os.getenv("LOGGER_LEVEL", logging.WARNING))
+logger = logging.getLogger("Dataset ImageIndex UnitTests")
+
+
+class StaleSchemaConnection:
+    """SQLite connection whose first schema read misses the phash column"""
+
+    def __init__(self, connection):
+        self._connection = connection
+        self._stale = True
+
+    def execute(self, sql, *args):
+        cursor = self._connection.execute(sql, *args)
+        if self._stale and sql.startswith('PRAGMA table_info'):
+            self._stale = False
+            return [row for row in cursor if row[1] != 'phash']
+        return cursor
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+
+class ImageIndexUnitTests(unittest.TestCase):
+    """Unit tests for ImageIndex"""
+
+    def setUp(self):
+        """Set up all tests."""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.tmp_dir, 'label', 'abc.jpg')
+        os.makedirs(os.path.dirname(self.file_path))
+        with open(self.file_path, 'wb') as f:
+            f.write(b'image')
+
+    def test_index_lookup(self):
+        """Unit tests for ImageIndex"""
+        with ImageIndex(self.tmp_dir) as index:
+            index.add('abc', 'label', self.file_path, 32, 16, url='https://a.com/1.jpg')
+            self.assertEqual(index.lookup_url('https://a.com/1.jpg'), 'abc')
+            self.assertIsNone(index.lookup_url('https://a.com/2.jpg'))
+            entry = index.lookup('abc')
+            self.assertEqual(entry.label, 'label')
+            self.assertEqual(entry.path, self.file_path)
+            self.assertEqual((entry.width, entry.height), (32, 16))
+            self.assertEqual(index.owner(self.file_path), 'abc')
+            self.assertEqual(len(index), 1)
+
+    def test_index_persists_across_runs(self):
+        """Unit tests for ImageIndex"""
+        with ImageIndex(self.tmp_dir) as index:
+            index.add('abc', 'label', self.file_path, 32, 16, url='https://a.com/1.jpg')
+        with ImageIndex(self.tmp_dir) as index:
+            self.assertEqual(index.lookup_url('https://a.com/1.jpg'), 'abc')
+            self.assertEqual([entry.sha1 for entry in index.entries('label')], ['abc'])
+
+    def test_index_ignores_missing_files(self):
+        """Unit tests for ImageIndex"""
+        with ImageIndex(self.tmp_dir) as index:
+            index.add('abc', 'label', self.file_path, 32, 16)
+            os.remove(self.file_path)
+            self.assertIsNone(index.lookup('abc'))
+
+    def test_index_prefers_requested_label(self):
+        """Unit tests for ImageIndex"""
+        other_path = os.path.join(self.tmp_dir, 'other', 'abc.jpg')
+        os.makedirs(os.path.dirname(other_path))
+        os.link(self.file_path, other_path)
+        with ImageIndex(self.tmp_dir) as index:
+            index.add('abc', 'label', self.file_path, 32, 16)
+            index.add('abc', 'other', other_path, 32, 16)
+            self.assertEqual(index.lookup('abc', 'other').path, other_path)
+            self.assertEqual(index.lookup('abc', 'label').path, self.file_path)
+
+    def test_index_opened_concurrently(self):
+        """Another process adding the phash column between the schema read and the ALTER is not an error"""
+        ImageIndex(self.tmp_dir).close()
+        connect = sqlite3.connect
+        # Another process added the column after this one read the schema
+        with patch('imagines.index.sqlite3.connect',
+                   side_effect=lambda *args, **kwargs: StaleSchemaConnection(connect(*args, **kwargs))):
+            with ImageIndex(self.tmp_dir, shared=True) as index:
+                index.add('abc', 'label', self.file_path, 32, 16, phash=7)
+                self.assertEqual(index.phashes('label'), [7])
+
+    def test_index_adds_phash_column(self):
+        """Indexes created before perceptual hashes get the phash column"""
+        path = os.path.join(self.tmp_dir, '.imagines', 'index.sqlite')
+        os.makedirs(os.path.dirname(path))
+        with sqlite3.connect(path) as connection:
+            connection.execute('CREATE TABLE files (sha1 TEXT NOT NULL, label TEXT NOT NULL, path TEXT NOT NULL, '
+                               'width INTEGER, height INTEGER, PRIMARY KEY (sha1, label)) WITHOUT ROWID')
+        connection.close()
+        with ImageIndex(self.tmp_dir) as index:
+            index.add('abc', 'label', self.file_path, 32, 16, phash=7)
+            self.assertEqual(index.phashes('label'), [7])
@@ -0,0 +1,106 @@
+"""Unit tests for the keys and the store of data: URLs"""
+
+import json
+import shutil
+import tempfile
+import unittest
+import os
+
+from imagines.inline import InlineStore, is_inline_key, url_key
+from imagines.manifest import LabelManifest
+
+import logging
+
+# Set up logging
+logging.basicConfig(level=os.getenv("LOGGER_LEVEL", logging.WARNING))
+logger = logging.getLogger("Dataset Inline UnitTests")
+
+DATA_URL = 'data:image/jpeg;base64,' + 'A' * 4096
+
+
+class InlineUnitTests(unittest.TestCase):
+    """Unit tests for the keys and the store of data: URLs"""
+
+    def setUp(self):
+        """Set up all tests."""
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Tear down all tests."""
+        shutil.rmtree(self.tmp_dir)
+
+    def test_url_key(self):
+        """Unit tests for url_key"""
+        key = url_key(DATA_URL)
+        self.assertRegex(key, '^data:sha1:[0-9a-f]{40}$')
+        self.assertTrue(is_inline_key(key))
+        self.assertEqual(url_key(key), key)
+        self.assertNotEqual(url_key(DATA_URL + 'A'), key)
+        self.assertEqual(url_key('https://www.toyimageurl.com/0.jpg'), 'https://www.toyimageurl.com/0.jpg')
+        self.assertFalse(is_inline_key(DATA_URL))
+        self.assertFalse(is_inline_key('https://www.toyimageurl.com/0.jpg'))
+
+    def test_inline_store(self):
+        """Unit tests for InlineStore"""
+        store = InlineStore(os.path.join(self.tmp_dir, 'inline'))
+        key = store.put(DATA_URL)
+        self.assertEqual(key, url_key(DATA_URL))
+        self.assertEqual(store.put(DATA_URL), key)
+        self.assertEqual(store.get(key), DATA_URL)
+        self.assertEqual(len(os.listdir(store.directory)), 1)
+
+        store.discard(key)
+        self.assertIsNone(store.get(key))
+        store.discard(key)
+
+    def test_manifest_records_keys(self):
+        """Manifests record the key of data: URLs, a resumed run finds their data in the store"""
+        image_url = 'https://www.toyimageurl.com/0.jpg'
+        manifest = LabelManifest(self.tmp_dir, 'apple')
+        progress = manifest.query('apple')
+        self.assertTrue(progress.add_url(DATA_URL))
+        self.assertFalse(progress.add_url(DATA_URL))
+        self.assertTrue(progress.add_url(image_url))
+        manifest.save()
+        with open(manifest.path) as f:
+            content = f.read()
+        self.assertNotIn(DATA_URL, content)
+        self.assertEqual(json.loads(content)['queries']['apple']['urls'], [url_key(DATA_URL), image_url])
+
+        # Interrupted before the download, the data comes back from the store
+        progress = LabelManifest(self.tmp_dir, 'apple').query('apple')
+        self.assertEqual(progress.pending_downloads(), [DATA_URL, image_url])
+        progress.mark_saved(DATA_URL, os.path.join(self.tmp_dir, 'apple', 'image.jpg'))
+        self.assertEqual(progress.saved, {url_key(DATA_URL): 'image.jpg'})
+        self.assertEqual(os.listdir(manifest.inline.directory), [])
+        self.assertEqual(progress.search_results(), [DATA_URL, image_url])
+
+        # Data lost along the way is skipped for good
+        progress = LabelManifest(self.tmp_dir, 'pear').query('pear')
+        progress.add_url(DATA_URL)
+        shutil.rmtree(os.path.join(self.tmp_dir, '.imagines', 'inline', 'pear'))
+        progress = LabelManifest(self.tmp_dir, 'pear').query('pear')
+        progress.inline_urls.clear()
+        self.assertEqual(progress.pending_downloads(), [])
+        self.assertEqual(progress.skipped, {url_key(DATA_URL): 'missing'})
+
+    def test_manifest_reads_data_urls(self):
+        """Manifests written with whole data: URLs are read back with keys"""
+        path = os.path.join(self.tmp_dir, '.imagines', 'manifests', 'apple.json')
+        os.makedirs(os.path.dirname(path))
+        other_url = DATA_URL + 'B'
+        with open(path, 'w') as f:
+            json.dump({'label': 'apple', 'queries': {'apple': {
+                'max_links_to_fetch': 2, 'searched': True, 'urls': [DATA_URL, other_url],
+                'saved': {DATA_URL: 'image.jpg'}, 'skipped': {}}}}, f)
+
+        manifest = LabelManifest(self.tmp_dir, 'apple')
+        progress = manifest.query('apple')
+        self.assertEqual(progress.urls, [url_key(DATA_URL), url_key(other_url)])
+        self.assertEqual(progress.saved, {url_key(DATA_URL): 'image.jpg'})
+        self.assertEqual(progress.pending_urls(), [url_key(other_url)])
+        self.assertEqual(os.listdir(manifest.inline.directory), [url_key(other_url)[len('data:sha1:'):]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+"""Unit tests for Metrics class"""
+
+import json
+import threading
+import time
+import unittest
+import os
+
+import requests
+
+from imagines.metrics import Metrics, MetricEvent, NullMetrics
+
+import logging
+
+# Set up logging
+logging.basicConfig(level=os.getenv("LOGGER_LEVEL", logging.WARNING))
+logger = logging.getLogger("Dataset Metrics UnitTests")
+
+class MetricsUnitTests(unittest.TestCase):
+    """Unit tests for Metrics"""
+
+    def test_metrics_record(self):
+        """Unit tests for Metrics"""
+        events = []
+        metrics = Metrics(hooks=[events.append])
+        with metrics.time('download') as timer:
+            time.sleep(0.01)
+            timer.bytes = 100
+        with self.assertRaises(ValueError):
+            with metrics.time('decode'):
+                raise ValueError('broken image')
+        response = requests.Response()
+        response.status_code = 503
+        with self.assertRaises(requests.HTTPError):
+            with metrics.time('download'):
+                raise requests.HTTPError(response=response)
+        metrics.increment('images_saved', 2)
+
+        report = metrics.report()
+        self.assertEqual(report.stages['download']['succeeded'], 1)
+        self.assertEqual(report.stages['download']['failures'], {'http_503': 1})
+        self.assertEqual(report.stages['download']['bytes'], 100)
+        self.assertGreaterEqual(report.stages['download']['seconds'], 0.01)
+        self.assertEqual(report.stages['decode']['failures'], {'ValueError': 1})
+        self.assertEqual(report.counters, {'images_saved': 2})
+        self.assertEqual(events[0].stage, 'download')
+        self.assertEqual(events[0].bytes, 100)
+        self.assertEqual(events[-1], MetricEvent('download', events[-1].seconds, 0, 'http_503'))
+        self.assertEqual(json.loads(report.to_json())['stages']['decode']['failed'], 1)
+
+        metrics.reset()
+        self.assertEqual(metrics.report().stages, {})
+
+    def test_metrics_prometheus(self):
+        """Unit tests for RunReport.to_prometheus"""
+        metrics = Metrics()
+        metrics.record('write', 0.5, 2048)
+        metrics.record('write', error='OSError')
+        text = metrics.report().to_prometheus()
+        self.assertIn('# TYPE imagines_stage_seconds_total counter', text)
+        self.assertIn('imagines_stage_seconds_total{stage="write"} 0.5', text)
+        self.assertIn('imagines_stage_bytes_total{stage="write"} 2048', text)
+        self.assertIn('imagines_stage_runs_total{stage="write",outcome="failed"} 1', text)
+        self.assertIn('imagines_stage_failures_total{stage="write",reason="OSError"} 1', text)
+
+    def test_metrics_thread_safe(self):
+        """Unit tests for Metrics"""
+        metrics = Metrics()
+
+        def work():
+            for _ in range(1000):
+                metrics.record('download', 0.001, 10)
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(metrics.report().stages['download']['succeeded'], 4000)
+        self.assertEqual(metrics.report().stages['download']['bytes'], 40000)
+
+    def test_null_metrics(self):
+        """Unit tests for NullMetrics"""
+        metrics = NullMetrics()
+        with metrics.time('download') as timer:
+            timer.bytes = 10
+        metrics.record('write', 1.0)
+        metrics.increment('images_saved')
+        report = metrics.report()
+        self.assertEqual(report.stages, {})
+        self.assertEqual(report.counters, {})
+        self.assertFalse(metrics.enabled)
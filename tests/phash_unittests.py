@@ -0,0 +1,68 @@
+"""Unit tests for perceptual hashing"""
+
+import io
+import unittest
+import os
+
+import numpy as np
+from PIL import Image
+
+from imagines.phash import PerceptualHashIndex, hamming_distances, perceptual_hash, swar_popcount
+
+import logging
+
+# Set up logging
+logging.basicConfig(level=os.getenv("LOGGER_LEVEL", logging.WARNING))
+logger = logging.getLogger("Dataset PerceptualHash UnitTests")
+
+class PerceptualHashUnitTests(unittest.TestCase):
+    """Unit tests for perceptual hashing"""
+
+    def setUp(self):
+        """Set up all tests."""
+        self.image = Image.open('./tests/test_artifacts/test_label/test_image.jpg').convert('RGB')
+        pixels = np.random.default_rng(0).integers(0, 256, size=(400, 500, 3), dtype=np.uint8)
+        self.other_image = Image.fromarray(pixels)
+
+    def test_perceptual_hash_near_duplicates(self):
+        """Unit tests for perceptual_hash"""
+        image_hash = perceptual_hash(self.image)
+        self.assertLess(image_hash, 1 << 64)
+
+        # Resized and recompressed copy
+        buffer = io.BytesIO()
+        self.image.resize((self.image.width // 3, self.image.height // 3)).save(buffer, format='JPEG', quality=40)
+        copy_hash = perceptual_hash(Image.open(buffer))
+        other_hash = perceptual_hash(self.other_image)
+
+        index = PerceptualHashIndex(threshold=6, hashes=[image_hash])
+        self.assertTrue(index.contains(copy_hash))
+        self.assertFalse(index.contains(other_hash))
+
+    def test_perceptual_hash_index_add_if_new(self):
+        """Unit tests for PerceptualHashIndex"""
+        index = PerceptualHashIndex(threshold=2)
+        self.assertTrue(index.add_if_new(0b1111))
+        self.assertFalse(index.add_if_new(0b0111))
+        self.assertTrue(index.add_if_new(0b1111 << 60))
+        self.assertEqual(len(index), 2)
+        self.assertEqual(index.nearest_distance(0), 4)
+
+    def test_hamming_distances_vectorized(self):
+        """Unit tests for hamming_distances"""
+        rng = np.random.default_rng(0)
+        hashes = rng.integers(0, 2 ** 63, size=200000, dtype=np.uint64)
+        index = PerceptualHashIndex(threshold=3, hashes=hashes)
+        target = int(hashes[123456]) ^ 0b101
+        self.assertEqual(index.nearest_distance(target), 2)
+        self.assertTrue(index.contains(target))
+        self.assertFalse(index.contains(int(hashes[123456]) ^ 0b1111))
+
+        # The fallback of numpy versions without bitwise_count
+        xor = np.bitwise_xor(hashes[:100000], np.uint64(target))
+        expected = [bin(int(value)).count('1') for value in xor[:1000]]
+        self.assertEqual(list(swar_popcount(xor.copy())[:1000]), expected)
+        self.assertEqual(list(swar_popcount(xor.copy())), list(hamming_distances(hashes[:100000], target)))
+
+        distances = hamming_distances(np.array([0, 1, 2 ** 64 - 1], dtype=np.uint64), 0)
+        self.assertEqual(list(distances), [0, 1, 64])
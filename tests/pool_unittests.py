@@ -0,0 +1,170 @@
+"""Unit tests for ScraperPool class"""
+
+import threading
+import time
+import unittest
+import os
+
+from imagines.pool import ScraperPool
+
+import logging
+
+# Set up logging
+logging.basicConfig(level=os.getenv("LOGGER_LEVEL", logging.WARNING))
+logger = logging.getLogger("Dataset ScraperPool UnitTests")
+
+class FakeSession:
+    """Stand-in for WebScrapper"""
+
+    running = 0
+    peak = 0
+    lock = threading.Lock()
+
+    def __init__(self, fail=False, hang=False):
+        self.fail = fail
+        self.hang = hang
+        self.closed = threading.Event()
+
+    def search_images(self, query, max_links_to_fetch, sleep_between_interactions):
+        with FakeSession.lock:
+            FakeSession.running += 1
+            FakeSession.peak = max(FakeSession.peak, FakeSession.running)
+        try:
+            if self.fail:
+                raise RuntimeError('browser crashed')
+            if self.hang:
+                self.closed.wait()
+                raise RuntimeError('session closed')
+            time.sleep(0.02)
+            return {'https://{}.com/{}.jpg'.format(query, i) for i in range(max_links_to_fetch)}
+        finally:
+            with FakeSession.lock:
+                FakeSession.running -= 1
+
+    def iter_images(self, query, max_links_to_fetch, sleep_between_interactions):
+        for i in range(max_links_to_fetch):
+            if self.fail and i == 2:
+                raise RuntimeError('browser crashed')
+            time.sleep(0.01)
+            yield 'https://{}.com/{}.jpg'.format(query, i)
+
+    def iter_thumbnails(self, query, max_links_to_fetch, min_size, sleep_between_interactions):
+        for i in range(max_links_to_fetch):
+            yield 'https://thumbnails.{}.com/{}x{}/{}.jpg'.format(query, *min_size, i)
+
+    def close_session(self):
+        self.closed.set()
+
+class ScraperPoolUnitTests(unittest.TestCase):
+    """Unit tests for ScraperPool"""
+
+    def setUp(self):
+        """Set up all tests."""
+        FakeSession.running = 0
+        FakeSession.peak = 0
+
+    def test_pool_runs_searches_concurrently(self):
+        """Unit tests for ScraperPool"""
+        created = []
+
+        def factory():
+            created.append(FakeSession())
+            return created[-1]
+
+        with ScraperPool(factory, size=3) as pool:
+            futures = [pool.submit('query{}'.format(i), 2) for i in range(9)]
+            results = [future.result() for future in futures]
+        self.assertEqual(results[4], {'https://query4.com/0.jpg', 'https://query4.com/1.jpg'})
+        self.assertLessEqual(len(created), 3)
+        self.assertLessEqual(FakeSession.peak, 3)
+        self.assertGreater(FakeSession.peak, 1)
+        # Sessions created by the pool are shut down with it
+        self.assertTrue(all(session.closed.is_set() for session in created))
+
+    def test_pool_recycles_failed_sessions(self):
+        """Unit tests for ScraperPool"""
+        broken = FakeSession(fail=True)
+        with ScraperPool(FakeSession, size=1, sessions=[broken]) as pool:
+            self.assertEqual(len(pool.submit('query', 1).result()), 1)
+            self.assertTrue(broken.closed.is_set())
+            self.assertNotIn(broken, pool.sessions)
+
+    def test_pool_recycles_hung_sessions(self):
+        """Unit tests for ScraperPool"""
+        hung = FakeSession(hang=True)
+        with ScraperPool(FakeSession, size=1, sessions=[hung], search_timeout=0.2) as pool:
+            self.assertEqual(len(pool.submit('query', 1).result(timeout=5)), 1)
+            self.assertTrue(hung.closed.is_set())
+
+    def test_pool_gives_up_after_max_attempts(self):
+        """Unit tests for ScraperPool"""
+        with ScraperPool(lambda: FakeSession(fail=True), size=1, max_attempts=2) as pool:
+            with self.assertRaises(RuntimeError):
+                pool.submit('query', 1).result()
+
+    def test_pool_does_not_close_adopted_sessions(self):
+        """Unit tests for ScraperPool"""
+        adopted = FakeSession()
+        with ScraperPool(FakeSession, size=1, sessions=[adopted]) as pool:
+            pool.submit('query', 1).result()
+        self.assertFalse(adopted.closed.is_set())
+
+    def test_pool_reports_discarded_adopted_sessions(self):
+        """Unit tests for ScraperPool"""
+        broken = FakeSession(fail=True)
+        discarded = []
+        with ScraperPool(FakeSession, size=1, sessions=[broken], on_discard=discarded.append) as pool:
+            pool.submit('query', 1).result()
+            pool.submit('query', 1).result()
+        self.assertEqual(discarded, [broken])
+
+    def test_pool_streams_urls_while_searching(self):
+        """Unit tests for ScraperPool.stream"""
+        with ScraperPool(FakeSession, size=1) as pool:
+            stream = pool.stream('query', 20, maxsize=2)
+            first = next(iter(stream))
+            # The search is still scrolling when the first URL is handed over
+            self.assertFalse(stream.future.done())
+            urls = [first] + list(stream)
+        self.assertEqual(urls, ['https://query.com/{}.jpg'.format(i) for i in range(20)])
+
+    def test_pool_streams_thumbnails(self):
+        """Unit tests for ScraperPool.stream"""
+        with ScraperPool(FakeSession, size=1) as pool:
+            stream = pool.stream('query', 3, thumbnail_size=(64, 32))
+            urls = list(stream)
+        self.assertEqual(stream.thumbnail_size, (64, 32))
+        self.assertEqual(urls, ['https://thumbnails.query.com/64x32/{}.jpg'.format(i) for i in range(3)])
+
+    def test_pool_streams_plain_iterators(self):
+        """Unit tests for ScraperPool.stream"""
+
+        class IteratorSession(FakeSession):
+            """Session returning an iterator that is not a generator"""
+
+            def iter_images(self, query, max_links_to_fetch, sleep_between_interactions):
+                return iter(['https://{}.com/{}.jpg'.format(query, i) for i in range(max_links_to_fetch)])
+
+        with ScraperPool(IteratorSession, size=1) as pool:
+            stream = pool.stream('query', 3)
+            urls = list(stream)
+        self.assertEqual(urls, ['https://query.com/{}.jpg'.format(i) for i in range(3)])
+        self.assertIsNone(stream.future.exception())
+
+    def test_pool_streams_without_repeating_urls_after_a_failure(self):
+        """Unit tests for ScraperPool.stream"""
+        broken = FakeSession(fail=True)
+        with ScraperPool(FakeSession, size=1, sessions=[broken]) as pool:
+            urls = list(pool.stream('query', 5))
+        self.assertEqual(urls, ['https://query.com/{}.jpg'.format(i) for i in range(5)])
+        self.assertTrue(broken.closed.is_set())
+
+    def test_pool_cancels_blocked_streams_on_close(self):
+        """Unit tests for ScraperPool.stream"""
+        pool = ScraperPool(FakeSession, size=1)
+        stream = pool.stream('query', 50, maxsize=1)
+        next(iter(stream))
+        pool.close()
+        self.assertTrue(stream.future.done())
+        _, completed = stream.drain()
+        self.assertFalse(completed)
@@ -0,0 +1,175 @@
+"""Unit tests for image processing functions"""
+
+import io
+import shutil
+import unittest
+import os
+import tempfile
+
+import numpy as np
+from PIL import Image
+
+from imagines.processing import is_resized, process_image, resize, resize_file, split_shapes
+
+import logging
+
+# Set up logging
+logging.basicConfig(level=os.getenv("LOGGER_LEVEL", logging.WARNING))
+logger = logging.getLogger("Dataset Processing UnitTests")
+
+class ProcessingUnitTests(unittest.TestCase):
+    """Unit tests for image processing functions"""
+
+    def setUp(self):
+        """Set up all tests."""
+        self.tmp_dir = tempfile.mkdtemp()
+        with open('./tests/test_artifacts/test_label/test_image.jpg', 'rb') as f:
+            self.image_data = f.read()
+
+    def test_process_image(self):
+        """Unit tests for process_image"""
+        processed = process_image(self.image_data, (64, 32), compute_phash=True, return_pixels=True)
+
+        # Source dimensions are kept, the output is resized
+        self.assertEqual((processed.width, processed.height), (500, 400))
+        self.assertEqual(processed.size, (64, 32))
+        self.assertIsNotNone(processed.phash)
+        self.assertEqual(processed.to_image().size, (64, 32))
+
+        with Image.open(io.BytesIO(processed.content)) as image:
+            self.assertEqual(image.format, 'JPEG')
+            self.assertEqual(image.size, (64, 32))
+
+    def test_process_image_extra_shapes(self):
+        """Unit tests for process_image"""
+        processed = process_image(self.image_data, (64, 32), extra_shapes=[(16, 16), (100, 50)], aspect_mode='fit')
+        self.assertEqual(processed.size, (64, 32))
+        self.assertEqual(len(processed.variants), 2)
+        for content, size in zip(processed.variants, [(16, 16), (100, 50)]):
+            with Image.open(io.BytesIO(content)) as image:
+                self.assertEqual(image.size, size)
+        self.assertIsNone(process_image(self.image_data, (64, 32)).variants)
+
+    def test_process_image_keep_original(self):
+        """Unit tests for process_image"""
+        processed = process_image(self.image_data, keep_original=True)
+        self.assertIs(processed.content, self.image_data)
+        self.assertEqual(processed.extension, '.jpg')
+        self.assertEqual(processed.size, (500, 400))
+        self.assertNotIn('encode', processed.timings)
+
+        # Pixels and hashes still come from the original
+        processed = process_image(self.image_data, (500, 400), compute_phash=True, return_pixels=True,
+                                  keep_original=True)
+        self.assertIs(processed.content, self.image_data)
+        self.assertIsNotNone(processed.phash)
+        self.assertEqual(processed.to_image().size, (500, 400))
+
+        buffer = io.BytesIO()
+        Image.new('RGBA', (40, 30)).save(buffer, format='PNG')
+        processed = process_image(buffer.getvalue(), keep_original=True)
+        self.assertEqual((processed.content, processed.extension), (buffer.getvalue(), '.png'))
+
+        # Images that need converting are transcoded
+        self.assertEqual(process_image(self.image_data, (64, 32), keep_original=True).extension, '.jpg')
+        self.assertIsNot(process_image(self.image_data, (64, 32), keep_original=True).content, self.image_data)
+        buffer = io.BytesIO()
+        Image.new('CMYK', (40, 30)).save(buffer, format='JPEG')
+        processed = process_image(buffer.getvalue(), keep_original=True, encode_format='png')
+        self.assertEqual(processed.extension, '.png')
+        with Image.open(io.BytesIO(processed.content)) as image:
+            self.assertEqual((image.format, image.mode), ('PNG', 'RGB'))
+
+    def test_process_image_encode_options(self):
+        """Unit tests for process_image"""
+        processed = process_image(self.image_data, (64, 32), encode_format='webp', extra_shapes=[(16, 16)])
+        self.assertEqual(processed.extension, '.webp')
+        for content in (processed.content, processed.variants[0]):
+            with Image.open(io.BytesIO(content)) as image:
+                self.assertEqual(image.format, 'WEBP')
+
+        low = process_image(self.image_data, encode_quality=10)
+        high = process_image(self.image_data, encode_quality=95)
+        self.assertLess(len(low.content), len(high.content))
+
+    def test_resize_aspect_modes(self):
+        """Unit tests for resize"""
+        image = Image.new('RGB', (200, 100), (255, 255, 255))
+        self.assertEqual(resize(image, (50, 50)).size, (50, 50))
+        self.assertIs(resize(image, (200, 100), 'crop'), image)
+
+        # Padded to the shape, the image keeps its proportions in the middle
+        fitted = resize(image, (50, 50), 'fit')
+        self.assertEqual(fitted.size, (50, 50))
+        self.assertEqual(fitted.getpixel((25, 0)), (0, 0, 0))
+        self.assertEqual(fitted.getpixel((25, 25)), (255, 255, 255))
+
+        # Cropped to the center
+        image.paste((255, 0, 0), (0, 0, 40, 100))
+        cropped = resize(image, (50, 50), 'crop')
+        self.assertEqual(cropped.size, (50, 50))
+        self.assertEqual(cropped.getpixel((0, 25)), (255, 255, 255))
+
+    def test_split_shapes(self):
+        """Unit tests for split_shapes"""
+        self.assertEqual(split_shapes((224, 224)), ((224, 224), ()))
+        self.assertEqual(split_shapes([(224, 224), [299, 299]]), ((224, 224), ((299, 299),)))
+        self.assertEqual(split_shapes(None), (None, ()))
+        shape, others = split_shapes(np.array((224, 112)))
+        self.assertEqual(shape, (224, 112))
+        self.assertIs(type(shape[0]), int)
+        self.assertEqual(split_shapes(np.array([(224, 224), (299, 299)])), ((224, 224), ((299, 299),)))
+        with self.assertRaises(ValueError):
+            split_shapes([])
+
+    def test_process_image_without_resize(self):
+        """Unit tests for process_image"""
+        processed = process_image(self.image_data)
+        self.assertEqual(processed.size, (500, 400))
+        self.assertIsNone(processed.phash)
+        self.assertIsNone(processed.pixels)
+        self.assertEqual(processed.to_image().mode, 'RGB')
+
+    def test_process_image_invalid_content(self):
+        """Unit tests for process_image"""
+        with self.assertRaises(Exception):
+            process_image(b'<html>not an image</html>')
+
+    def test_resize_file(self):
+        """Unit tests for resize_file"""
+        file_path = os.path.join(self.tmp_dir, 'test.jpg')
+        shutil.copyfile('./tests/test_artifacts/test_label/test_image.jpg', file_path)
+
+        self.assertIsNone(resize_file(file_path, (100, 80)))
+        with Image.open(file_path) as image:
+            self.assertEqual(image.size, (100, 80))
+
+        modified = os.path.getmtime(file_path)
+        os.utime(file_path, (0, 0))
+        self.assertIsNone(resize_file(file_path, (100, 80), skip_if_sized=True))
+        self.assertEqual(os.path.getmtime(file_path), 0)
+        self.assertNotEqual(modified, 0)
+
+        self.assertIsNotNone(resize_file(os.path.join(self.tmp_dir, 'missing.jpg'), (100, 80)))
+
+        # Copies at other shapes are written next to it, once
+        variant_path = os.path.join(self.tmp_dir, '50x50', 'test.jpg')
+        self.assertIsNone(resize_file(file_path, (100, 80), skip_if_sized=True, variants=[((50, 50), variant_path)]))
+        with Image.open(variant_path) as image:
+            self.assertEqual(image.size, (50, 50))
+        os.utime(variant_path, (0, 0))
+        self.assertIsNone(resize_file(file_path, (100, 80), skip_if_sized=True, variants=[((50, 50), variant_path)]))
+        self.assertEqual(os.path.getmtime(variant_path), 0)
+
+    def test_is_resized(self):
+        """Unit tests for is_resized"""
+        file_path = os.path.join(self.tmp_dir, 'test.jpg')
+        Image.new('RGB', (100, 80)).save(file_path)
+        variant_path = os.path.join(self.tmp_dir, '50x50', 'test.jpg')
+
+        self.assertTrue(is_resized(file_path, (100, 80)))
+        self.assertFalse(is_resized(file_path, (80, 100)))
+        self.assertFalse(is_resized(file_path, (100, 80), variants=[((50, 50), variant_path)]))
+        self.assertIsNone(resize_file(file_path, (100, 80), variants=[((50, 50), variant_path)]))
+        self.assertTrue(is_resized(file_path, (100, 80), variants=[((50, 50), variant_path)]))
+        self.assertFalse(is_resized(os.path.join(self.tmp_dir, 'missing.jpg'), (100, 80)))
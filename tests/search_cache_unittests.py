@@ -0,0 +1,97 @@
+"""Unit tests for the persistent search cache"""
+
+import shutil
+import tempfile
+import time
+import unittest
+import os
+from unittest.mock import patch
+
+from imagines.inline import url_key
+from imagines.search_cache import CachedSearch, SearchCache
+
+import logging
+
+# Set up logging
+logging.basicConfig(level=os.getenv("LOGGER_LEVEL", logging.WARNING))
+logger = logging.getLogger("Dataset SearchCache UnitTests")
+
+
+class SearchCacheUnitTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'searches.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_search_cache(self):
+        """Searches are kept per query and backend, across instances"""
+
+        with SearchCache(self.path) as cache:
+            self.assertIsNone(cache.get('apple', 'chrome'))
+            cache.put('apple', 'chrome', ['a', 'b'], 2)
+            cache.put('apple', 'http', ['c'], 5)
+
+        with SearchCache(self.path) as cache:
+            cached = cache.get('apple', 'chrome')
+            self.assertEqual((cached.urls, cached.max_links_to_fetch), (['a', 'b'], 2))
+            self.assertEqual(cache.get('apple', 'http').urls, ['c'])
+            self.assertEqual(len(cache), 2)
+
+            # A smaller search does not replace a larger one
+            cache.put('apple', 'chrome', ['a', 'b', 'c'], 3)
+            cache.put('apple', 'chrome', ['a'], 1)
+            self.assertEqual(cache.get('apple', 'chrome').urls, ['a', 'b', 'c'])
+
+            cache.clear()
+            self.assertEqual(len(cache), 0)
+
+        with patch.dict(os.environ, {'IMAGINES_CACHE_DIR': self.tmp_dir}):
+            with SearchCache() as cache:
+                self.assertEqual(cache.path, self.path)
+
+    def test_search_cache_covers(self):
+        """Cached URLs cover searches for as many links, or any search once exhausted"""
+
+        self.assertTrue(CachedSearch(['a', 'b'], 2, 0).covers(2))
+        self.assertFalse(CachedSearch(['a', 'b'], 2, 0).covers(3))
+        self.assertTrue(CachedSearch(['a', 'b'], 10, 0).covers(5))
+        self.assertTrue(CachedSearch(['a', 'b', 'c'], 3, 0).covers(1))
+
+    def test_search_cache_data_urls(self):
+        """data: URLs are listed by key, their data is kept apart as long as their search"""
+
+        data_url = 'data:image/jpeg;base64,' + 'A' * 4096
+        with SearchCache(self.path, max_entries=1) as cache:
+            cache.put('apple', 'chrome', ['a', data_url, url_key('data:image/png;base64,lost')], 3)
+            self.assertEqual(cache.get('apple', 'chrome').urls, ['a', data_url])
+            stored_urls = cache._connection.execute('SELECT urls FROM searches').fetchone()[0]
+            self.assertNotIn(data_url, stored_urls)
+            self.assertIn(url_key(data_url), stored_urls)
+
+            cache.put('pear', 'chrome', ['b'], 1)
+            self.assertEqual(cache._connection.execute('SELECT COUNT(*) FROM inline_urls').fetchone()[0], 0)
+
+    def test_search_cache_eviction(self):
+        """Expired searches are ignored and the least recently used ones evicted"""
+
+        with SearchCache(self.path, ttl=60, max_entries=2) as cache:
+            cache.put('old', 'chrome', ['a'], 1)
+            with patch('imagines.search_cache.time.time', return_value=time.time() + 120):
+                self.assertIsNone(cache.get('old', 'chrome'))
+            self.assertEqual(len(cache), 0)
+
+            cache.put('first', 'chrome', ['a'], 1)
+            cache.put('second', 'chrome', ['b'], 1)
+            time.sleep(0.01)
+            cache.get('first', 'chrome')
+            cache.put('third', 'chrome', ['c'], 1)
+            self.assertIsNone(cache.get('second', 'chrome'))
+            self.assertIsNotNone(cache.get('first', 'chrome'))
+            self.assertIsNotNone(cache.get('third', 'chrome'))
+
+
+if __name__ == '__main__':
+    unittest.main()
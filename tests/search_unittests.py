@@ -0,0 +1,155 @@
+"""Unit tests for search backends"""
+
+import threading
+import unittest
+import os
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+from benchmarks.server import BenchmarkServer
+from imagines import DatasetAugmentation
+from imagines.search import HttpSearchBackend, SearchBackend, Thumbnail, parse_image_urls, parse_thumbnails
+
+import logging
+
+# Set up logging
+logging.basicConfig(level=os.getenv("LOGGER_LEVEL", logging.WARNING))
+logger = logging.getLogger("Dataset SearchBackend UnitTests")
+
+FIXTURE_PATH = './tests/test_artifacts/search_results.html'
+FIXTURE_URLS = [
+    'https://example.com/apples/red-apple.jpg',
+    'https://cdn.example.org/fruit/green_apple.png',
+    'https://images.example.net/photo?id=42&size=large',
+    'https://example.com/apples/slices.jpeg',
+    'https://example.org/basket.webp',
+]
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    """Serves the saved result page for every request"""
+
+    protocol_version = 'HTTP/1.1'
+    paths = []
+
+    def do_GET(self):
+        FixtureHandler.paths.append(self.path)
+        with open(FIXTURE_PATH, 'rb') as f:
+            body = f.read()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class SearchBackendUnitTests(unittest.TestCase):
+    """Unit tests for search backends"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Set up all tests."""
+        super(SearchBackendUnitTests, cls).setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), FixtureHandler)
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+        cls.search_url = 'http://127.0.0.1:{}/search?q={{q}}&ijn={{page}}&start={{start}}'.format(
+            cls.server.server_address[1])
+
+    @classmethod
+    def tearDownClass(cls):
+        """Tear down all tests."""
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        """Set up all tests."""
+        FixtureHandler.paths = []
+
+    def test_parse_image_urls(self):
+        """Unit tests for parse_image_urls"""
+        with open(FIXTURE_PATH) as f:
+            page = f.read()
+        self.assertEqual(parse_image_urls(page), FIXTURE_URLS)
+
+    def test_http_search_backend_iter_images(self):
+        """Unit tests for HttpSearchBackend"""
+        backend = HttpSearchBackend(search_url=self.search_url)
+        image_urls = list(backend.iter_images('red apple', 10, sleep_between_interactions=0))
+        backend.close_session()
+        self.assertEqual(image_urls, FIXTURE_URLS)
+        # The second page brings nothing new, which ends the search
+        self.assertEqual(FixtureHandler.paths, ['/search?q=red+apple&ijn=0&start=0',
+                                                '/search?q=red+apple&ijn=1&start=100'])
+
+    def test_http_search_backend_search_images(self):
+        """Unit tests for HttpSearchBackend"""
+        backend = HttpSearchBackend(search_url=self.search_url)
+        image_urls = backend.search_images('apple', 3, sleep_between_interactions=0)
+        backend.close_session()
+        self.assertEqual(image_urls, set(FIXTURE_URLS[:3]))
+        self.assertEqual(len(FixtureHandler.paths), 1)
+
+    def test_search_backend_interface(self):
+        """Unit tests for SearchBackend"""
+        class StaticBackend(SearchBackend):
+            """Backend returning fixed URLs"""
+
+            def iter_images(self, query, max_links_to_fetch, sleep_between_interactions=1):
+                yield from FIXTURE_URLS[:max_links_to_fetch]
+
+        self.assertEqual(StaticBackend().search_images('apple', 2), set(FIXTURE_URLS[:2]))
+        # Backends that cannot read thumbnails hand over full-size images
+        self.assertEqual(list(StaticBackend().iter_thumbnails('apple', 2, (16, 16))), FIXTURE_URLS[:2])
+        # A backend without iter_images cannot be created
+        with self.assertRaises(TypeError):
+            SearchBackend()
+
+    def test_parse_thumbnails(self):
+        """Unit tests for parse_thumbnails"""
+        page = ('[1,[0,"a",["https://encrypted-tbn0.gstatic.com/images?q\\u003dtbn:a",150,200],'
+                '["https://example.com/a.jpg",600,800]]],'
+                '[1,[0,"b",["data:image/jpeg;base64,/9j/4AAQ\\u003d",90,120],["https://example.com/b.jpg",480,640]]],'
+                '[1,[0,"c",null,["https://example.com/c.jpg",480,640]]]')
+        self.assertEqual(parse_thumbnails(page), {
+            'https://example.com/a.jpg': Thumbnail('https://encrypted-tbn0.gstatic.com/images?q=tbn:a', 200, 150),
+            'https://example.com/b.jpg': Thumbnail('data:image/jpeg;base64,/9j/4AAQ=', 120, 90),
+        })
+        # Thumbnails are never taken for full-size images
+        self.assertEqual(parse_image_urls(page), ['https://example.com/{}.jpg'.format(name) for name in 'abc'])
+        # Full-size images hosted by Google are results like any other
+        page = ('[1,[0,"d",["https://encrypted-tbn1.gstatic.com/images?q\\u003dtbn:d",150,200],'
+                '["https://lh3.googleusercontent.com/d\\u003dw800",600,800]]]')
+        self.assertEqual(parse_image_urls(page), ['https://lh3.googleusercontent.com/d=w800'])
+        self.assertEqual(list(parse_thumbnails(page)), ['https://lh3.googleusercontent.com/d=w800'])
+        self.assertTrue(Thumbnail('data:', 120, 90).covers((120, 64)))
+        self.assertFalse(Thumbnail('data:', 120, 90).covers((128, 64)))
+
+    def test_http_search_backend_iter_thumbnails(self):
+        """Unit tests for HttpSearchBackend"""
+        with BenchmarkServer(image_count=4, image_size=(64, 48), thumbnail_size=(32, 24)) as server:
+            backend = HttpSearchBackend(search_url=server.search_url)
+            thumbnails = list(backend.iter_thumbnails('apple', 3, (32, 24), sleep_between_interactions=0))
+            image_urls = list(backend.iter_thumbnails('apple', 3, (64, 48), sleep_between_interactions=0))
+            backend.close_session()
+            base_url = server.base_url
+        self.assertEqual(len(thumbnails), 3)
+        self.assertTrue(all(url.startswith('data:image/jpeg;base64,') for url in thumbnails))
+        # Thumbnails smaller than asked for give way to the full-size images
+        self.assertTrue(all(url.startswith(base_url + '/images/') for url in image_urls))
+
+    @patch('imagines.core.WebScrapper')
+    def test_dataset_augmentation_http_backend(self, webscrapper_mock):
+        """Unit tests for DataAugmentation with a browser-free backend"""
+        dataset_augmentation = DatasetAugmentation(driver_type='http', process_workers=0)
+        self.assertIsInstance(dataset_augmentation.driver, HttpSearchBackend)
+        self.assertIs(dataset_augmentation.driver.http_client, dataset_augmentation.http_client)
+
+        dataset_augmentation = DatasetAugmentation(
+            search_backend=lambda: HttpSearchBackend(search_url=self.search_url),
+            process_workers=0)
+        image_urls = dataset_augmentation._get_search_pool().submit('apple', 2, 0).result()
+        dataset_augmentation.close()
+        self.assertEqual(image_urls, set(FIXTURE_URLS[:2]))
+        self.assertFalse(webscrapper_mock.called)
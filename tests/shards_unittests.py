@@ -0,0 +1,65 @@
+"""Unit tests for packed dataset writers and readers"""
+
+import unittest
+import os
+import tempfile
+
+import numpy as np
+from PIL import Image
+
+from imagines.shards import ArrayWriter, ShardWriter, iter_shards, load_array
+
+import logging
+
+# Set up logging
+logging.basicConfig(level=os.getenv("LOGGER_LEVEL", logging.WARNING))
+logger = logging.getLogger("Dataset Shards UnitTests")
+
+class ShardsUnitTests(unittest.TestCase):
+    """Unit tests for packed dataset writers and readers"""
+
+    def setUp(self):
+        """Set up all tests."""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.image_path = './tests/test_artifacts/test_label/test_image.jpg'
+        self.image_size = os.path.getsize(self.image_path)
+
+    def test_shard_writer_rolls_over(self):
+        """Unit tests for ShardWriter"""
+        with ShardWriter(self.tmp_dir, max_shard_bytes=int(self.image_size * 2.5)) as writer:
+            for label in ['a', 'b', 'a', 'b', 'a']:
+                writer.add(label, self.image_path)
+
+        self.assertEqual([shard['count'] for shard in writer.shards], [2, 2, 1])
+        self.assertEqual(writer.label_counts, {'a': 3, 'b': 2})
+
+        samples = list(iter_shards(self.tmp_dir))
+        self.assertEqual([label for label, _ in samples], ['a', 'b', 'a', 'b', 'a'])
+        with open(self.image_path, 'rb') as f:
+            self.assertEqual(samples[0][1], f.read())
+
+        _, image = next(iter_shards(self.tmp_dir, decode=True))
+        self.assertIsInstance(image, Image.Image)
+
+    def test_shard_writer_removes_stale_shards(self):
+        """Unit tests for ShardWriter"""
+        with ShardWriter(self.tmp_dir, max_shard_bytes=1) as writer:
+            for _ in range(3):
+                writer.add('a', self.image_path)
+        with ShardWriter(self.tmp_dir) as writer:
+            writer.add('a', self.image_path)
+        self.assertEqual(sorted(f for f in os.listdir(self.tmp_dir) if f.endswith('.tar')), ['shard-00000.tar'])
+
+    def test_array_writer(self):
+        """Unit tests for ArrayWriter"""
+        with ArrayWriter(self.tmp_dir, (32, 16)) as writer:
+            writer.add('a', self.image_path)
+            writer.add('b', self.image_path, Image.new('RGB', (32, 16), (255, 0, 0)))
+
+        images, labels, label_names = load_array(self.tmp_dir)
+        self.assertIsInstance(images, np.memmap)
+        self.assertEqual(images.shape, (2, 16, 32, 3))
+        self.assertEqual(images.dtype, np.uint8)
+        self.assertEqual(list(labels), [0, 1])
+        self.assertEqual(label_names, ['a', 'b'])
+        self.assertEqual(tuple(images[1, 0, 0]), (255, 0, 0))
@@ -0,0 +1,79 @@
+"""Unit tests for the decoded images cache"""
+
+import shutil
+import tempfile
+import unittest
+import os
+
+import numpy as np
+from PIL import Image
+
+from imagines.tensors import TensorCache, folder_fingerprint
+
+import logging
+
+# Set up logging
+logging.basicConfig(level=os.getenv("LOGGER_LEVEL", logging.WARNING))
+logger = logging.getLogger("Dataset Tensors UnitTests")
+
+
+class TensorCacheUnitTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.label_folder = os.path.join(self.tmp_dir, 'label')
+        os.makedirs(self.label_folder)
+        for i in range(3):
+            Image.new('RGB', (20, 10), (i * 50, 0, 0)).save(os.path.join(self.label_folder, '{}.png'.format(i)))
+        self.file_names = sorted(os.listdir(self.label_folder))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def images(self):
+        """Decoded images of the label folder"""
+        for file_name in self.file_names:
+            with Image.open(os.path.join(self.label_folder, file_name)) as image:
+                yield image.convert('RGB')
+
+    def test_folder_fingerprint(self):
+        """Any change to the files changes the fingerprint"""
+
+        fingerprint = folder_fingerprint(self.label_folder, self.file_names)
+        self.assertEqual(fingerprint, folder_fingerprint(self.label_folder, self.file_names))
+        self.assertNotEqual(fingerprint, folder_fingerprint(self.label_folder, self.file_names[:2]))
+        self.assertNotEqual(fingerprint, folder_fingerprint(self.label_folder, self.file_names[::-1]))
+
+        Image.new('RGB', (30, 10)).save(os.path.join(self.label_folder, self.file_names[0]))
+        self.assertNotEqual(fingerprint, folder_fingerprint(self.label_folder, self.file_names))
+
+    def test_tensor_cache(self):
+        """Arrays are stored per label and shape, and only returned for their fingerprint"""
+
+        cache = TensorCache(self.tmp_dir)
+        self.assertIsNone(cache.load('label', (8, 4), 'a' * 40))
+
+        cache.store('label', (8, 4), 'a' * 40, self.file_names, self.images())
+        images, file_names = cache.load('label', (8, 4), 'a' * 40)
+        self.assertIsInstance(images, np.memmap)
+        self.assertEqual(images.shape, (3, 4, 8, 3))
+        self.assertEqual(images.dtype, np.uint8)
+        self.assertEqual(file_names, self.file_names)
+        self.assertEqual(images[1, 0, 0].tolist(), [50, 0, 0])
+        self.assertIsNone(cache.load('label', (8, 4), 'b' * 40))
+        self.assertIsNone(cache.load('label', (4, 4), 'a' * 40))
+
+        # A new version replaces the previous array
+        cache.store('label', (8, 4), 'b' * 40, self.file_names[:1], list(self.images())[:1])
+        self.assertIsNone(cache.load('label', (8, 4), 'a' * 40))
+        images, _ = cache.load('label', (8, 4), 'b' * 40)
+        self.assertEqual(images.shape, (1, 4, 8, 3))
+        arrays = [f for f in os.listdir(os.path.join(cache.directory, 'label', '8x4')) if f.startswith('images-')]
+        self.assertEqual(arrays, ['images-{}.u8'.format('b' * 16)])
+
+        cache.store('empty', (8, 4), 'c' * 40, [], iter(()))
+        images, file_names = cache.load('empty', (8, 4), 'c' * 40)
+        self.assertEqual(images.shape, (0, 4, 8, 3))
+
+        with self.assertRaises(ValueError):
+            cache.store('label', (8, 4), 'd' * 40, self.file_names, iter(()))
@@ -1,9 +1,11 @@
 """Unit tests for WebScrapper class"""
 
+import time
 import unittest
 import os
 
 from imagines import WebScrapper
+from imagines.core import FULL_IMAGE_SOURCES_SCRIPT, THUMBNAIL_COUNT_SCRIPT, THUMBNAIL_SOURCES_SCRIPT
 from selenium.webdriver import Chrome
 
 import logging
@@ -12,6 +14,52 @@ import logging
 logging.basicConfig(level=os.getenv("LOGGER_LEVEL", logging.WARNING))
 logger = logging.getLogger("Dataset WebScrapper UnitTests")
 
+class FakeThumbnail:
+    """Stand-in for a thumbnail WebElement"""
+
+    def __init__(self, driver, index):
+        self.driver = driver
+        self.index = index
+
+    def click(self):
+        self.driver.clicks += 1
+        self.driver.selected = self.index
+        self.driver.loaded_at = time.monotonic() + self.driver.delay
+
+class FakeDriver:
+    """Stand-in for a Chrome WebDriver on a results page that loads thumbnails in batches"""
+
+    def __init__(self, n_results=30, batch=10, delay=0.01):
+        self.n_results = n_results
+        self.batch = batch
+        self.delay = delay
+        self.loaded = 0
+        self.selected = None
+        self.loaded_at = 0
+        self.scripts = 0
+        self.clicks = 0
+
+    def get(self, url):
+        self.loaded = min(self.batch, self.n_results)
+
+    def execute_script(self, script):
+        self.scripts += 1
+        if 'scrollTo' in script:
+            self.loaded = min(self.loaded + self.batch, self.n_results)
+        elif script == THUMBNAIL_COUNT_SCRIPT:
+            return self.loaded
+        elif script == FULL_IMAGE_SOURCES_SCRIPT:
+            if self.selected is None or time.monotonic() < self.loaded_at:
+                return []
+            return ['https://www.toyimageurl.com/{}.jpg'.format(self.selected)]
+        elif script == THUMBNAIL_SOURCES_SCRIPT:
+            # Every fifth thumbnail is not loaded yet
+            return [['data:image/jpeg;base64,{}'.format(i), 0, 0] if i % 5 == 4 else
+                    ['data:image/jpeg;base64,{}'.format(i), 120, 90] for i in range(self.loaded)]
+
+    def find_elements(self, by, selector):
+        return [FakeThumbnail(self, i) for i in range(self.loaded)]
+
 class WebScrapperUnitTests(unittest.TestCase):
     """Unit tests for WebScrapper"""
 
@@ -52,3 +100,37 @@ class WebScrapperUnitTests(unittest.TestCase):
         driver_type = 'invalid'
         with self.assertRaises(ValueError):
             WebScrapper(driver_type)
+
+    def test_webscrapper_search_images_waits_for_events(self):
+        """Unit tests for WebScrapper"""
+        webscrapper = WebScrapper.__new__(WebScrapper)
+        webscrapper.driver = FakeDriver()
+        start = time.monotonic()
+        image_urls = webscrapper.search_images('test', max_links_to_fetch=25, sleep_between_interactions=1)
+        # Fixed sleeps would take at least 25 seconds here
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual(len(image_urls), 25)
+
+    def test_webscrapper_search_images_stops_when_exhausted(self):
+        """Unit tests for WebScrapper"""
+        webscrapper = WebScrapper.__new__(WebScrapper)
+        webscrapper.driver = FakeDriver(n_results=12)
+        image_urls = webscrapper.search_images('test', max_links_to_fetch=100, sleep_between_interactions=0.1)
+        self.assertEqual(len(image_urls), 12)
+
+    def test_webscrapper_iter_thumbnails(self):
+        """Unit tests for WebScrapper"""
+        webscrapper = WebScrapper.__new__(WebScrapper)
+        webscrapper.driver = FakeDriver()
+        image_urls = list(webscrapper.iter_thumbnails('test', 20, (100, 80), sleep_between_interactions=1))
+        self.assertEqual(len(image_urls), 20)
+        # Only the thumbnails that are not loaded yet are clicked
+        self.assertEqual(webscrapper.driver.clicks, 4)
+        self.assertEqual(sum(url.startswith('https://') for url in image_urls), 4)
+        self.assertEqual(image_urls[:4], ['data:image/jpeg;base64,{}'.format(i) for i in range(4)])
+
+        webscrapper.driver = FakeDriver()
+        image_urls = list(webscrapper.iter_thumbnails('test', 10, (224, 224), sleep_between_interactions=1))
+        # Thumbnails too small for the shape are all clicked
+        self.assertEqual(webscrapper.driver.clicks, 10)
+        self.assertTrue(all(url.startswith('https://') for url in image_urls))
@@ -0,0 +1,217 @@
+"""Unit tests for the distributed work queue"""
+
+import json
+import multiprocessing
+import shutil
+import tempfile
+import time
+import unittest
+import os
+from functools import partial
+from unittest.mock import patch
+
+from benchmarks.server import BenchmarkServer
+from imagines import DatasetAugmentation, HttpSearchBackend
+from imagines.index import ImageIndex
+from imagines.manifest import LabelManifest
+from imagines.work_queue import WorkQueue
+
+import logging
+
+# Set up logging
+logging.basicConfig(level=os.getenv("LOGGER_LEVEL", logging.WARNING))
+logger = logging.getLogger("Dataset WorkQueue UnitTests")
+
+LABEL_QUERIES = {'label_{}'.format(i): ['query {}'.format(i)] for i in range(6)}
+
+
+def build_labels(output_directory, search_url, worker_id, results, label_queries=LABEL_QUERIES, max_links_to_fetch=3,
+                 **options):
+    """Runs a worker in its own process, reporting the labels it built"""
+    dataset_augmentation = DatasetAugmentation(search_backend=partial(HttpSearchBackend, search_url=search_url),
+                                               process_workers=0, **options)
+    built = dataset_augmentation.run_worker(label_queries, output_directory, max_links_to_fetch, image_shape=(16, 16),
+                                            sleep_between_interactions=0, worker_id=worker_id, lease_seconds=5)
+    results.put((worker_id, built))
+
+
+class WorkQueueUnitTests(unittest.TestCase):
+    """Unit tests for the distributed work queue"""
+
+    def setUp(self):
+        """Set up all tests."""
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Tear down all tests."""
+        shutil.rmtree(self.tmp_dir)
+
+    def test_work_queue_leases(self):
+        """Unit tests for WorkQueue"""
+        first = WorkQueue(self.tmp_dir, 'first', lease_seconds=60)
+        second = WorkQueue(self.tmp_dir, 'second', lease_seconds=60)
+
+        self.assertTrue(first.claim('apple'))
+        self.assertFalse(second.claim('apple'))
+        self.assertFalse(first.claim('apple'))
+        self.assertEqual(second.lease_owner('apple'), 'first')
+        self.assertTrue(first.renew('apple'))
+        self.assertFalse(second.renew('apple'))
+
+        # Releasing lets others claim the label, until it is done
+        second.release('apple')
+        self.assertEqual(first.lease_owner('apple'), 'first')
+        first.release('apple')
+        self.assertTrue(second.claim('apple'))
+        second.complete('apple', 3)
+        second.release('apple')
+        self.assertTrue(first.is_done('apple'))
+        self.assertFalse(first.claim('apple'))
+
+    def test_work_queue_reclaims_expired_leases(self):
+        """Unit tests for WorkQueue"""
+        dead = WorkQueue(self.tmp_dir, 'dead', lease_seconds=60)
+        alive = WorkQueue(self.tmp_dir, 'alive', lease_seconds=60)
+        self.assertTrue(dead.claim('apple'))
+        lease_path = os.path.join(self.tmp_dir, '.imagines', 'queue', 'leases', 'apple.lease')
+        os.utime(lease_path, (time.time() - 120, time.time() - 120))
+
+        self.assertTrue(alive.claim('apple'))
+        self.assertEqual(alive.lease_owner('apple'), 'alive')
+        self.assertFalse(dead.renew('apple'))
+
+        # The heartbeat keeps a held lease fresh
+        alive = WorkQueue(self.tmp_dir, 'alive', lease_seconds=0.3)
+        with alive.hold('apple'):
+            os.utime(lease_path, (time.time() - 1, time.time() - 1))
+            time.sleep(0.3)
+            self.assertFalse(WorkQueue(self.tmp_dir, 'other', lease_seconds=0.3).claim('apple'))
+        self.assertIsNone(alive.lease_owner('apple'))
+
+    def test_work_queue_keeps_fresh_leases(self):
+        """A lease reclaimed by another worker in the meantime is put back"""
+        dead = WorkQueue(self.tmp_dir, 'dead', lease_seconds=60)
+        first = WorkQueue(self.tmp_dir, 'first', lease_seconds=60)
+        second = WorkQueue(self.tmp_dir, 'second', lease_seconds=60)
+        self.assertTrue(dead.claim('apple'))
+        lease_path = os.path.join(self.tmp_dir, '.imagines', 'queue', 'leases', 'apple.lease')
+        os.utime(lease_path, (time.time() - 120, time.time() - 120))
+
+        # The second worker saw the expired lease, the first one reclaimed it before the second one renamed it
+        self.assertTrue(first.claim('apple'))
+        with patch.object(second, '_is_expired', return_value=True):
+            self.assertFalse(second.claim('apple'))
+        self.assertEqual(first.lease_owner('apple'), 'first')
+        self.assertTrue(first.renew('apple'))
+        self.assertEqual(os.listdir(os.path.dirname(lease_path)), ['apple.lease'])
+
+    def test_work_queue_reports_lost_leases(self):
+        """Holding a lease taken over by another worker sets its lost flag"""
+        queue = WorkQueue(self.tmp_dir, 'first', lease_seconds=0.3)
+        self.assertTrue(queue.claim('apple'))
+        with queue.hold('apple') as lost:
+            self.assertFalse(lost.is_set())
+            with open(os.path.join(self.tmp_dir, '.imagines', 'queue', 'leases', 'apple.lease'), 'w') as f:
+                f.write('second')
+            self.assertTrue(lost.wait(2))
+        # The lease of the other worker is left alone
+        self.assertEqual(queue.lease_owner('apple'), 'second')
+
+    def test_run_worker_stops_on_lost_leases(self):
+        """A worker that lost the lease of its label does not mark it done"""
+        dataset_augmentation = DatasetAugmentation(driver_type='http', process_workers=0)
+        records = (record for record in [])
+        with patch.object(DatasetAugmentation, 'iter_dataset', return_value=records), \
+                patch.object(LabelManifest, 'is_complete', return_value=True), \
+                patch.object(WorkQueue, 'renew', return_value=False):
+            built = dataset_augmentation.run_worker({'apple': ['apple']}, self.tmp_dir, 1, merge=False)
+        self.assertEqual(built, [])
+        self.assertFalse(WorkQueue(self.tmp_dir).is_done('apple'))
+        self.assertIsNone(WorkQueue(self.tmp_dir).lease_owner('apple'))
+
+    def test_work_queue_merge(self):
+        """Unit tests for WorkQueue"""
+        queue = WorkQueue(self.tmp_dir, 'worker')
+        os.makedirs(os.path.join(self.tmp_dir, 'apple'))
+        open(os.path.join(self.tmp_dir, 'apple', 'a.jpg'), 'wb').close()
+        queue.complete('apple', 1)
+
+        merged = queue.merge(['apple', 'pear'])
+        self.assertFalse(merged['complete'])
+        self.assertEqual(merged['pending'], ['pear'])
+        self.assertEqual(merged['labels']['apple']['files'], ['a.jpg'])
+        self.assertEqual(merged['labels']['apple']['worker'], 'worker')
+        with open(os.path.join(self.tmp_dir, '.imagines', 'dataset.json')) as f:
+            self.assertEqual(json.load(f), merged)
+
+    def test_work_queue_processes(self):
+        """Several worker processes build a dataset together, taking over the labels of a dead one"""
+        # A worker died while building a label
+        dead = WorkQueue(self.tmp_dir, 'dead', lease_seconds=5)
+        self.assertTrue(dead.claim('label_0'))
+        lease_path = os.path.join(self.tmp_dir, '.imagines', 'queue', 'leases', 'label_0.lease')
+        os.utime(lease_path, (time.time() - 60, time.time() - 60))
+
+        context = multiprocessing.get_context('spawn')
+        with BenchmarkServer(image_count=40, image_size=(64, 48), results_per_page=10) as server:
+            results = context.Queue()
+            workers = [context.Process(target=build_labels,
+                                       args=(self.tmp_dir, server.search_url, 'worker_{}'.format(i), results))
+                       for i in range(3)]
+            for worker in workers:
+                worker.start()
+            built = dict(results.get(timeout=120) for _ in workers)
+            for worker in workers:
+                worker.join(timeout=30)
+                self.assertEqual(worker.exitcode, 0)
+
+        # Every label was built once
+        labels = [label for worker_labels in built.values() for label in worker_labels]
+        self.assertEqual(sorted(labels), sorted(LABEL_QUERIES))
+
+        with open(os.path.join(self.tmp_dir, '.imagines', 'dataset.json')) as f:
+            merged = json.load(f)
+        self.assertTrue(merged['complete'])
+        for label, entry in merged['labels'].items():
+            self.assertEqual(len(entry['files']), 3)
+            self.assertEqual(sorted(entry['files']), sorted(os.listdir(os.path.join(self.tmp_dir, label))))
+            self.assertIn(entry['worker'], built)
+
+    def test_work_queue_processes_share_index(self):
+        """Workers storing images for longer than the SQLite busy timeout share the index of the dataset"""
+        label_queries = {'label_{}'.format(i): ['query {}'.format(i)] for i in range(2)}
+        context = multiprocessing.get_context('spawn')
+        # One download at a time, every label takes about 9 seconds to store
+        with BenchmarkServer(image_count=40, image_size=(64, 48), results_per_page=10, latency=1.5) as server:
+            results = context.Queue()
+            workers = [context.Process(target=build_labels,
+                                       args=(self.tmp_dir, server.search_url, 'worker_{}'.format(i), results,
+                                             label_queries, 6),
+                                       kwargs={'max_workers': 1, 'use_thumbnails': False})
+                       for i in range(2)]
+            for worker in workers:
+                worker.start()
+            built = dict(results.get(timeout=120) for _ in workers)
+            for worker in workers:
+                worker.join(timeout=30)
+                self.assertEqual(worker.exitcode, 0)
+
+        labels = [label for worker_labels in built.values() for label in worker_labels]
+        self.assertEqual(sorted(labels), sorted(label_queries))
+        with open(os.path.join(self.tmp_dir, '.imagines', 'dataset.json')) as f:
+            merged = json.load(f)
+        self.assertTrue(merged['complete'])
+
+        # Every stored image made it into the index and the manifests
+        with ImageIndex(self.tmp_dir) as index:
+            for label in label_queries:
+                files = sorted(os.listdir(os.path.join(self.tmp_dir, label)))
+                self.assertEqual(len(files), 6)
+                self.assertEqual(sorted(os.path.basename(entry.path) for entry in index.entries(label)), files)
+                self.assertEqual(sorted(merged['labels'][label]['files']), files)
+                progress = LabelManifest(self.tmp_dir, label).query(label_queries[label][0])
+                self.assertEqual(sorted(progress.saved.values()), files)
+
+
+if __name__ == '__main__':
+    unittest.main()